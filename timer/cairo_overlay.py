@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+A graphical splits overlay drawn with cairo, for capturing into a stream without a terminal.
+
+The overlay is a fixed grid: a title, one slot per visible split row, and the timer at the bottom. Every frame the
+text each slot should show is worked out from the view model and compared with what was last drawn there, and only
+slots whose text changed are repainted. While a run is going that is normally just the current split's row and the
+timer, so a frame costs two small text draws no matter how long the route is.
+
+Frames can go to a shared memory file (a small header followed by the raw ARGB32 pixels, with only the changed rows
+copied in) or to a numbered PNG sequence written only for frames that changed.
+"""
+
+import os
+import mmap
+import struct
+import argparse
+
+import cairo
+
+from .celeste_timer import fmt_time
+from .full_splits import main, visible_rows
+from .view import build_view, cached_stats, fmt_time_ex
+from .stream import color_split, color_mark, RED, GREEN, GOLD, NORMAL
+from . import stats
+from . import schedule
+
+COLORS = {
+    NORMAL: (1.0, 1.0, 1.0),
+    RED: (0.95, 0.35, 0.35),
+    GREEN: (0.35, 0.85, 0.45),
+    GOLD: (1.0, 0.8, 0.2),
+}
+BACKGROUND = (0.08, 0.08, 0.1)
+HIGHLIGHT = (0.18, 0.2, 0.3)
+DIM = (0.6, 0.6, 0.65)
+
+class Overlay:
+    def __init__(self, width=360, rows=16, row_height=24, font='monospace', font_size=15):
+        self.width = width
+        self.rows = rows
+        self.row_height = row_height
+        self.font = font
+        self.font_size = font_size
+        self.title_height = row_height
+        self.timer_height = row_height * 2
+        self.height = self.title_height + rows * row_height + self.timer_height
+
+        self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.width, self.height)
+        self.ctx = cairo.Context(self.surface)
+        self.ctx.select_font_face(font, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+        self.drawn_title = None
+        self.drawn_rows = [None] * rows
+        self.drawn_timer = None
+
+        self.ctx.set_source_rgb(*BACKGROUND)
+        self.ctx.paint()
+
+    def fill(self, y, height, color):
+        self.ctx.rectangle(0, y, self.width, height)
+        self.ctx.set_source_rgb(*color)
+        self.ctx.fill()
+
+    def text(self, text, x, baseline, color, size, right=False):
+        ctx = self.ctx
+        ctx.set_font_size(size)
+        if right:
+            x -= ctx.text_extents(text)[4]  # x_advance
+        ctx.move_to(x, baseline)
+        ctx.set_source_rgb(*color)
+        ctx.show_text(text)
+
+    def row_content(self, sm, split, level, current):
+        """
+        Everything which decides how a row looks, as a tuple which can be compared with what is on screen
+        """
+        if split is None:
+            return None
+        stat = cached_stats(sm, split, level)
+        name = '  ' * level + split.level_name(level)
+        if stat['status'] == 'present':
+            return (name, fmt_time_ex(stat['atime'], split), color_split(stat), fmt_time_ex(stat['ptime'], split), current)
+        if stat['status'] == 'past':
+            return (name, fmt_time_ex(stat['pb_delta'], split, sign=True), color_split(stat),
+                    fmt_time_ex(stat['amark'], split), current)
+        return (name, fmt_time_ex(stat['ptime'], split), None, fmt_time_ex(stat['pmark'], split), current)
+
+    def draw_row(self, slot, content):
+        y = self.title_height + slot * self.row_height
+        baseline = y + self.row_height * 0.72
+        self.fill(y, self.row_height, HIGHLIGHT if content is not None and content[4] else BACKGROUND)
+        if content is None:
+            return
+        name, middle, color, right, _ = content
+        self.text(name, 8, baseline, COLORS[NORMAL], self.font_size)
+        self.text(middle, self.width * 0.72, baseline, DIM if color is None else COLORS[color], self.font_size, right=True)
+        self.text(right, self.width - 8, baseline, DIM if color is None else COLORS[NORMAL], self.font_size, right=True)
+
+    def draw(self, sm):
+        """
+        Bring the surface up to date. Returns the (y, height) bands which were repainted.
+        """
+        view = build_view(sm)
+        dirty = []
+
+        if self.drawn_title != view.route_name:
+            self.drawn_title = view.route_name
+            self.fill(0, self.title_height, BACKGROUND)
+            self.text(view.route_name, 8, self.title_height * 0.72, DIM, self.font_size)
+            dirty.append((0, self.title_height))
+
+        current = sm.current_split(1000)
+        for slot, (split, level) in enumerate(visible_rows(sm, self.rows)):
+            content = self.row_content(sm, split, level, split is not None and split is current)
+            if content != self.drawn_rows[slot]:
+                self.drawn_rows[slot] = content
+                self.draw_row(slot, content)
+                dirty.append((self.title_height + slot * self.row_height, self.row_height))
+
+        timer = (fmt_time(view.current_time, ms_decimals=2) if view.started else fmt_time(0, ms_decimals=2),
+                 NORMAL if not view.done else GREEN if view.mark['pb_diff'] is None else color_mark(view.mark))
+        if timer != self.drawn_timer:
+            self.drawn_timer = timer
+            y = self.height - self.timer_height
+            self.fill(y, self.timer_height, BACKGROUND)
+            self.text(timer[0], self.width - 8, y + self.timer_height * 0.75, COLORS[timer[1]], self.font_size * 2, right=True)
+            dirty.append((y, self.timer_height))
+
+        if dirty:
+            self.surface.flush()
+        return dirty
+
+class ShmExporter:
+    """
+    Mirrors the surface into a shared memory file: a header of magic, width, height, stride and a frame counter which
+    is bumped after each update, followed by the pixels
+    """
+    header = struct.Struct('<4sIIII')
+
+    def __init__(self, path, surface):
+        self.path = path
+        self.width = surface.get_width()
+        self.height = surface.get_height()
+        self.stride = surface.get_stride()
+        self.size = self.header.size + self.stride * self.height
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.size)
+            self.map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.seq = 0
+        self.export(surface, [(0, self.height)])
+
+    def export(self, surface, dirty):
+        if not dirty:
+            return 0
+        data = surface.get_data()
+        written = 0
+        for y, height in dirty:
+            start = y * self.stride
+            end = (y + height) * self.stride
+            self.map[self.header.size + start:self.header.size + end] = data[start:end]
+            written += end - start
+        self.seq += 1
+        self.map[:self.header.size] = self.header.pack(b'CMTO', self.width, self.height, self.stride, self.seq)
+        return written
+
+    def close(self):
+        self.map.close()
+
+class PngExporter:
+    """
+    Writes frame_<n>.png into a directory for every frame which changed
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.frame = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, surface, dirty):
+        if not dirty:
+            return 0
+        filename = os.path.join(self.directory, 'frame_%06d.png' % self.frame)
+        self.frame += 1
+        surface.write_to_png(filename)
+        return os.path.getsize(filename)
+
+class OverlaySink:
+    """
+    A renderer for full_splits.run() which draws the overlay and hands what changed to an exporter
+    """
+    def __init__(self, overlay, exporter):
+        self.overlay = overlay
+        self.exporter = exporter
+
+    def __call__(self, sm):
+        return self.exporter.export(self.overlay.surface, self.overlay.draw(sm))
+
+def make_sink(args):
+    overlay = Overlay(width=args.width, rows=args.rows, row_height=args.row_height, font=args.font, font_size=args.font_size)
+    if args.png_dir:
+        exporter = PngExporter(args.png_dir)
+    else:
+        exporter = ShmExporter(args.shm, overlay.surface)
+    return OverlaySink(overlay, exporter)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Draw the splits as an image for stream capture')
+    parser.add_argument('route', help='The route file')
+    parser.add_argument('--shm', default='/dev/shm/celeste_overlay',
+        help='Shared memory file to mirror the image into (default: /dev/shm/celeste_overlay)'
+    )
+    parser.add_argument('--png-dir', help='Write a PNG sequence to this directory instead of shared memory')
+    parser.add_argument('--width', type=int, default=360)
+    parser.add_argument('--rows', type=int, default=16, help='Number of split rows to show')
+    parser.add_argument('--row-height', type=int, default=24)
+    parser.add_argument('--font', default='monospace')
+    parser.add_argument('--font-size', type=int, default=15)
+    parser.add_argument('--headless', action='store_true',
+        help='Run without desktop notifications or hotkeys (no D-Bus or X connection)'
+    )
+    stats.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    stats.configure(args)
+    schedule.configure(args)
+    main(args.route, renderer=make_sink(args), headless=args.headless)
@@ -1,14 +1,30 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import shutil
 import struct
+import argparse
+import operator
 import threading
 import time
 import collections
+import collections.abc
+import array
 import random
 import pickle
+import tempfile
 import yaml
 
+try:
+    from . import stats
+    from . import schedule
+    from .watch import FileWatcher, file_identity
+except ImportError:
+    import stats
+    import schedule
+    from watch import FileWatcher, file_identity
+
 # 00 string Level;
 # 08 int Chapter;
 # 0c int Mode;
@@ -39,8 +55,32 @@ def open_pickle_or_yaml(filename):
             raise TypeError("Cannot load this file as either pickle or yaml")
 
 def save_yaml(filename, data):
-    with open(filename, 'w', encoding='utf-8') as fp:
-        yaml.dump(data, fp, Dumper=MyDumper)
+    # written beside the file, synced and renamed over it, so neither a crash mid-save nor a power cut leaves a
+    # truncated file. If the filename is a symlink, the file it points to is the one replaced.
+    target = os.path.realpath(filename)
+    directory = os.path.dirname(target)
+    fp = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, prefix='.%s.' % os.path.basename(target),
+                                     suffix='.tmp', delete=False)
+    try:
+        with fp:
+            yaml.dump(data, fp, Dumper=MyDumper)
+            fp.flush()
+            os.fsync(fp.fileno())
+        try:
+            shutil.copymode(target, fp.name)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(fp.name, 0o666 & ~umask)
+        os.replace(fp.name, target)
+    except BaseException:
+        os.unlink(fp.name)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
 
 class MyDumper(yaml.Dumper):
     def ignore_aliases(self, data):
@@ -140,9 +180,25 @@ def parse_time(string):
     return ms  + se * 1000 + mi * 1000 * 60 + hr * 1000 * 60 * 60
 
 
-class AutoSplitterInfo:
-    def __init__(self, filename=asi_path):
-        self.all_attrs = ('chapter', 'mode', 'timer_active', 'chapter_started', 'chapter_complete', 'chapter_time', 'chapter_strawberries', 'chapter_cassette', 'chapter_heart', 'file_time', 'file_strawberries', 'file_cassettes', 'file_hearts', 'chapter_checkpoints', 'in_cutscene', 'death_count', "level_name")
+# the DumpInfo struct written by the tracer
+DUMP_FORMAT = struct.Struct('Qii???QI??QIIIxxxxI?i100s')
+# the DumpHeader the tracer writes in front of it: magic, version, a sequence number which is odd while the DumpInfo
+# is being rewritten and only moves when it changes, and the CLOCK_MONOTONIC time of the latest capture. Tracers from
+# before the header write the bare DumpInfo at the start of the file.
+DUMP_HEADER = struct.Struct('<4sIQQ')
+DUMP_MAGIC = b'CDMP'
+DUMP_VERSION = 1
+TORN_RETRIES = 10
+# read_frame()'s result when there is nothing new
+UNCHANGED = object()
+
+class GameState:
+    """
+    The game state exported by the tracer. decode() fills it in from one raw DumpInfo record.
+    """
+    all_attrs = ('chapter', 'mode', 'timer_active', 'chapter_started', 'chapter_complete', 'chapter_time', 'chapter_strawberries', 'chapter_cassette', 'chapter_heart', 'file_time', 'file_strawberries', 'file_cassettes', 'file_hearts', 'chapter_checkpoints', 'in_cutscene', 'death_count', "level_name")
+
+    def __init__(self):
         self.chapter = 0
         self.mode = 0
         self.timer_active = False
@@ -163,18 +219,6 @@ class AutoSplitterInfo:
         self.file_cassettes = 0
         self.file_hearts = 0
 
-        if not os.path.exists(filename):
-            print('waiting for', filename, '...')
-            while not os.path.exists(filename):
-                time.sleep(1)
-
-        self.fp = open(filename, 'rb')
-        self.live = True
-
-        self.thread = threading.Thread(target=self.update_loop)
-        self.thread.daemon = True
-        self.thread.start()
-
     @property
     def chapter_name(self):
         if self.chapter == 0:
@@ -201,40 +245,277 @@ class AutoSplitterInfo:
     def dict(self):
         return {x: getattr(self, x) for x in self.all_attrs}
 
+    def decode(self, dat):
+        _, self.chapter, self.mode, self.timer_active, \
+            self.chapter_started, self.chapter_complete, \
+            chapter_time, self.chapter_strawberries, \
+            self.chapter_cassette, self.chapter_heart, file_time, \
+            self.file_strawberries, self.file_cassettes, self.file_hearts, \
+            self.chapter_checkpoints, self.in_cutscene, self.death_count, level_name \
+            = DUMP_FORMAT.unpack(dat)
+
+        self.chapter_time = chapter_time // 10000
+        self.file_time = file_time // 10000
+        self.level_name = level_name.split(b'\0')[0].decode()
+
+    def encode(self):
+        """
+        The inverse of decode(): this state as a raw DumpInfo record, the way the tracer writes it
+        """
+        return DUMP_FORMAT.pack(
+            0, self.chapter, self.mode, self.timer_active,
+            self.chapter_started, self.chapter_complete,
+            int(self.chapter_time * 10000), self.chapter_strawberries,
+            self.chapter_cassette, self.chapter_heart, int(self.file_time * 10000),
+            self.file_strawberries, self.file_cassettes, self.file_hearts,
+            self.chapter_checkpoints, self.in_cutscene, self.death_count, self.level_name.encode(),
+        )
+
+# DeathWatch.step()'s result when the death count changed in a way no death could, i.e. another save was loaded
+NEW_SAVE = object()
+
+class DeathWatch:
+    """
+    Follows the death count frame by frame, for whatever attributes deaths to rooms. Only a count going up by exactly
+    one between two frames is a death; any other change is a different save being loaded.
+    """
+    def __init__(self):
+        self.seen = None
+
+    def step(self, asi):
+        """
+        Take in one frame. Returns the (chapter name, room) of a death on it, NEW_SAVE, or None.
+        """
+        count = asi.death_count
+        seen, self.seen = self.seen, count
+        if seen is None or count == seen:
+            return None
+        if count != seen + 1:
+            return NEW_SAVE
+        if asi.chapter == -1 or not asi.level_name:
+            return None
+        return (asi.chapter_name, asi.level_name)
+
+class AutoSplitterInfo(GameState):
+    """
+    The live game state, kept up to date from the tracer's file. By default a thread of its own reads the file; with
+    thread=False nothing does until poll() is called, which is how a ReaderGroup follows several files at once.
+    """
+    def __init__(self, filename=asi_path, recorder=None, reader_schedule=None, thread=True):
+        super().__init__()
+
+        self.filename = filename
+        self.schedule = reader_schedule if reader_schedule is not None else schedule.default
+        self.watcher = FileWatcher(filename)
+        if file_identity(filename) is None:
+            print('waiting for', filename, '...')
+            self.watcher.wait_exists()
+
+        self.fp = open(filename, 'rb')
+        self.live = True
+        self.connected = True
+        self.recorder = recorder  # if set, every changed frame is passed to recorder.write()
+        self.frame_time = None  # monotonic_ns when the data last changed, tracked only while stats or recording are enabled
+        self.capture_ns = None  # monotonic_ns of the tracer's latest capture, if the tracer writes a header
+        self.seq = None
+        self.last_dat = None
+        self.bad_version = None
+        self.stale = False  # the file was deleted and we're waiting for it to come back
+        self.next_watch = 0
+        self.listeners = []  # each is called with us after every new frame is decoded, on the reader thread
+
+        self.thread = None
+        if thread:
+            self.thread = threading.Thread(target=self.update_loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def reconnect(self, block=True):
+        """
+        Swap to whatever file is now at self.filename, waiting for it to reappear if it was deleted. The field values
+        are left alone in the meantime, so a SplitsManager reading them just sees the game pause. Without block, a
+        missing file marks us stale instead, to be retried on the next check. Returns whether we swapped files.
+        """
+        st = os.fstat(self.fp.fileno())
+        identity = file_identity(self.filename)
+        if identity == (st.st_dev, st.st_ino):
+            self.stale = False
+            return False
+        self.connected = False
+        if identity is None and not block:
+            self.stale = True
+            return False
+        self.watcher.wait_exists()
+        try:
+            fp = open(self.filename, 'rb')
+        except FileNotFoundError:
+            # gone again already
+            self.stale = True
+            return False
+        old_fp = self.fp
+        self.fp = fp
+        old_fp.close()
+        self.seq = None
+        self.last_dat = None
+        self.stale = False
+        return True
+
+    def watch(self, block=True):
+        """
+        Follow the file if it was replaced, looking at most every 50ms. Returns whether we swapped files.
+        """
+        now = time.monotonic_ns()
+        if now < self.next_watch:
+            return False
+        self.next_watch = now + 50000000
+        if not self.watcher.changed() and not self.stale:
+            return False
+        return self.reconnect(block)
+
+    @property
+    def frame_age(self):
+        """
+        Nanoseconds since the tracer last sampled the game, or None if the tracer doesn't say
+        """
+        if self.capture_ns is None:
+            return None
+        return time.monotonic_ns() - self.capture_ns
+
+    def read_frame(self):
+        """
+        Read the tracer's record. Returns the raw DumpInfo if it changed since the last call, UNCHANGED if it didn't
+        (or if every retry caught the tracer mid-write), or None if there is nothing usable in the file yet.
+        """
+        fd = self.fp.fileno()
+        for _ in range(TORN_RETRIES):
+            dat = os.pread(fd, DUMP_HEADER.size + DUMP_FORMAT.size, 0)
+            if dat[:4] != DUMP_MAGIC:
+                # an old tracer: no way to spot a torn read, and change is only visible by comparing
+                if len(dat) < DUMP_FORMAT.size:
+                    return None
+                self.capture_ns = None
+                dat = dat[:DUMP_FORMAT.size]
+                if dat == self.last_dat:
+                    return UNCHANGED
+                self.last_dat = dat
+                return dat
+
+            _, version, seq, self.capture_ns = DUMP_HEADER.unpack_from(dat)
+            if version != DUMP_VERSION:
+                if version != self.bad_version:
+                    self.bad_version = version
+                    sys.stderr.write('%s: unsupported dump version %d - try updating the autosplitter\n' % (self.filename, version))
+                return None
+            if seq == self.seq:
+                return UNCHANGED
+            # an even sequence number which is still there after reading means nothing was written meanwhile
+            if seq % 2 == 0 and len(dat) == DUMP_HEADER.size + DUMP_FORMAT.size \
+                    and DUMP_HEADER.unpack(os.pread(fd, DUMP_HEADER.size, 0))[2] == seq:
+                self.seq = seq
+                return dat[DUMP_HEADER.size:]
+            if stats.enabled:
+                stats.count('torn_reads')
+        return UNCHANGED if self.seq is not None else None
+
+    def read(self):
+        """
+        Take in the tracer's latest frame. Returns whether there was a new one, or None if the file isn't ready.
+        """
+        if stats.enabled:
+            decode_start = time.perf_counter_ns()
+        dat = self.read_frame()
+        if dat is None:
+            # the tracer has created the file but not written to it yet
+            self.connected = False
+            return None
+        self.connected = True
+
+        if dat is not UNCHANGED:
+            self.decode(dat)
+            for listener in self.listeners:
+                listener(self)
+            if stats.enabled or self.recorder is not None:
+                self.frame_time = self.capture_ns if self.capture_ns is not None else time.monotonic_ns()
+                if self.recorder is not None:
+                    self.recorder.write(self.frame_time, dat)
+                if stats.enabled:
+                    stats.count('frames')
+        if stats.enabled:
+            stats.record('decode', time.perf_counter_ns() - decode_start)
+            stats.count('ticks')
+            if self.capture_ns is not None:
+                stats.record('frame_age', self.frame_age)
+        return dat is not UNCHANGED
+
+    def poll(self):
+        """
+        One non-blocking look at the file, for when there is no reader thread. Returns whether there was a new frame.
+        """
+        self.watch(block=False)
+        if self.stale:
+            return False
+        return bool(self.read())
+
     def update_loop(self):
-        fmtstring = struct.Struct('Qii???QI??QIIIxxxxI?i100s')
+        self.schedule.apply()
+        deadlines = self.schedule.deadlines()
         while self.live:
-            last_tick = time.time()
-            self.fp.seek(0)
-            dat = self.fp.raw.read(fmtstring.size)
-            _, self.chapter, self.mode, self.timer_active, \
-                self.chapter_started, self.chapter_complete, \
-                chapter_time, self.chapter_strawberries, \
-                self.chapter_cassette, self.chapter_heart, file_time, \
-                self.file_strawberries, self.file_cassettes, self.file_hearts, \
-                self.chapter_checkpoints, self.in_cutscene, self.death_count, level_name \
-                = fmtstring.unpack(dat)
-
-            self.chapter_time = chapter_time // 10000
-            self.file_time = file_time // 10000
-            self.level_name = level_name.split(b'\0')[0].decode()
-
-            timeout = last_tick + 0.001 - time.time()
-            if timeout > 0:
-                time.sleep(timeout)
+            if self.watch():
+                deadlines.restart()
+            if self.read() is None:
+                time.sleep(0.01)
+                deadlines.restart()
+                continue
+            deadlines.wait()
+
+class ReaderGroup:
+    """
+    A single reader thread for several AutoSplitterInfos made with thread=False. Each pass costs one small read per
+    file, and only files which changed get decoded.
+    """
+    def __init__(self, sources, reader_schedule=None):
+        self.sources = list(sources)
+        self.schedule = reader_schedule if reader_schedule is not None else schedule.default
+        self.live = True
+        self.thread = threading.Thread(target=self.update_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def update_loop(self):
+        self.schedule.apply()
+        deadlines = self.schedule.deadlines()
+        while self.live:
+            for asi in self.sources:
+                asi.poll()
+            deadlines.wait()
+
+_trigger_code = {}
+def compile_trigger(expr):
+    try:
+        return _trigger_code[expr]
+    except KeyError:
+        code = _trigger_code[expr] = compile(expr, '<trigger>', 'eval')
+        return code
 
 class Trigger:
+    stateful = False  # stateful triggers must be stepped every frame and can't share results (see temporal.py)
+
     def __init__(self, name, end_trigger):
         self.name = name
         self.end_trigger = end_trigger
 
+    def arm(self):
+        pass
+
     def check_trigger(self, asi): # pylint: disable=unused-argument
-        return eval(self.end_trigger) # pylint: disable=eval-used
+        return eval(compile_trigger(self.end_trigger)) # pylint: disable=eval-used
 
     def __repr__(self):
         return '<Trigger %s>' % self.name
 
 class Split:
+    __slots__ = ('names', 'level', 'identity')
+
     def __init__(self, names, level=0):
         if type(names) == str:
             names = [names]
@@ -253,48 +534,164 @@ class Split:
             return self.names[-1]
 
     def __eq__(self, other):
-        return hasattr(other, 'identity') and self.identity == other.identity
+        return self is other or (isinstance(other, Split) and self.identity == other.identity)
 
     def __hash__(self):
-        return hash(self.identity)
+        return self.identity
 
     def __repr__(self):
         return '<Split %s>' % self.names[0]
 
     def __getstate__(self):
-        return self.__dict__
+        return {'names': self.names, 'level': self.level, 'identity': self.identity}
 
     def __setstate__(self, state):
         # migration
         if 'name' in state:
             state['names'] = [state.pop('name')]
-        self.__dict__.update(state)
+        for key, value in state.items():
+            setattr(self, key, value)
 yaml.representer.Representer.add_representer(Split, represent_pickle)
 
+class TriggerCache:
+    """
+    Evaluates each distinct trigger expression at most once per frame, sharing the result among every
+    SplitsManager which is waiting on it. Call invalidate() at the start of every frame.
+    """
+    def __init__(self, asi):
+        self.asi = asi
+        self.results = {}
+
+    def invalidate(self):
+        self.results.clear()
+
+    def check(self, trigger):
+        if trigger.stateful:
+            return trigger.check_trigger(self.asi)
+        try:
+            return self.results[trigger.end_trigger]
+        except KeyError:
+            result = self.results[trigger.end_trigger] = trigger.check_trigger(self.asi)
+            return result
+
 class StartTimer:
     def __repr__(self):
         return '<StartTimer>'
 
+# sentinels stored in record arrays. Real times are never this negative.
+NO_TIME = -2**63        # the key is present but has no time (None)
+_ABSENT = -2**63 + 1    # the slot is allocated but the key is not in the record
+
+def _pack_time(time):
+    return NO_TIME if time is None else time
+
+class ArrayRecord(collections.abc.MutableMapping):
+    """
+    A mapping from keys to times (or None) backed by a flat array('q'). Each key owns a slot in the array; keys
+    iterate in slot order. Binding the record to a route with update_identity() allocates one slot per route
+    entry in route order, after which lookups are a single dict probe plus an array index.
+    """
+    def __init__(self, data=(), **kwargs):
+        self._keys = []
+        self._slots = {}
+        self._times = array.array('q')
+        self._len = 0
+        self.update(data, **kwargs)
+
+    def _bind(self, keys):
+        collection = dict(self.items())
+        self._keys = list(keys)
+        self._slots = {key: i for i, key in enumerate(self._keys)}
+        self._times = array.array('q', (_pack_time(collection.get(key, None)) for key in self._keys))
+        self._len = len(self._keys)
+
+    def __getitem__(self, key):
+        value = self._times[self._slots[key]]
+        if value > _ABSENT:
+            return value
+        if value == NO_TIME:
+            return None
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        slot = self._slots.get(key, None)
+        if slot is None:
+            return default
+        value = self._times[slot]
+        if value > _ABSENT:
+            return value
+        if value == NO_TIME:
+            return None
+        return default
+
+    def __contains__(self, key):
+        slot = self._slots.get(key, None)
+        return slot is not None and self._times[slot] != _ABSENT
+
+    def __setitem__(self, key, value):
+        slot = self._slots.get(key, None)
+        if slot is None:
+            slot = self._slots[key] = len(self._keys)
+            self._keys.append(key)
+            self._times.append(_ABSENT)
+        if self._times[slot] == _ABSENT:
+            self._len += 1
+        self._times[slot] = _pack_time(value)
+
+    def __delitem__(self, key):
+        slot = self._slots.get(key, None)
+        if slot is None or self._times[slot] == _ABSENT:
+            raise KeyError(key)
+        self._times[slot] = _ABSENT
+        self._len -= 1
+
+    def __iter__(self):
+        for key, value in zip(self._keys, self._times):
+            if value != _ABSENT:
+                yield key
+
+    def __len__(self):
+        return self._len
+
+    def clear(self):
+        self._keys = []
+        self._slots = {}
+        self._times = array.array('q')
+        self._len = 0
+
+    def copy(self):
+        result = type(self).__new__(type(self))
+        result._keys = list(self._keys)
+        result._slots = dict(self._slots)
+        result._times = array.array('q', self._times)
+        result._len = self._len
+        return result
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self.items()))
+
 notpassed = object()
-class SplitsRecord(collections.OrderedDict):
+class SplitsRecord(ArrayRecord):
     def segment_time(self, split, level=0, fallback=notpassed):
-        found_prev = None
-        for cur in self:
-            if cur == split:
-                break
-            if cur.level <= level:
-                found_prev = cur
-        else:
+        slot = self._slots.get(split, None)
+        if slot is None or self._times[slot] == _ABSENT:
             if fallback is not notpassed:
                 return fallback
             raise KeyError(split)
 
-        if found_prev is None:
-            return self[split]
-        elif self[split] is None or self[found_prev] is None:
-            return None
+        times = self._times
+        keys = self._keys
+        end = times[slot]
+        for i in range(slot - 1, -1, -1):
+            start = times[i]
+            if start != _ABSENT and keys[i].level <= level:
+                break
         else:
-            return self[split] - self[found_prev]
+            return None if end == NO_TIME else end
+
+        if end == NO_TIME or start == NO_TIME:
+            return None
+        return end - start
 
     def __getstate__(self):
         return {
@@ -313,18 +710,26 @@ class SplitsRecord(collections.OrderedDict):
         else:
             raise TypeError("Cannot deserialize this SplitsRecord - try updating the autosplitter")
 
-    def update_identity(self, route):
+    def update_identity(self, route, keep_order=False):
         """
         Replace the splits here with the splits from the route with the same identity
+
+        Normally the record is reordered to match the route. With keep_order, the splits already here keep their
+        recorded order and any others from the route follow them - for routes where runs may take splits in
+        different orders.
         """
-        collection = dict(self)
-        self.clear()
-        for split in route.splits:
-            self[split] = collection.get(split, None)
+        if not keep_order:
+            self._bind(route.splits)
+            return
+        by_identity = {split: split for split in route.splits}
+        order = [by_identity[split] for split in self if split in by_identity]
+        seen = set(order)
+        order.extend(split for split in route.splits if split not in seen)
+        self._bind(order)
 yaml.representer.Representer.add_representer(SplitsRecord, represent_pickle)
 
 
-class GoldsRecord(collections.UserDict):
+class GoldsRecord(ArrayRecord):
     def __getstate__(self):
         return {
             'version': 1,
@@ -340,14 +745,20 @@ class GoldsRecord(collections.UserDict):
         else:
             raise TypeError("Cannot deserialize this GoldsRecord - try updating the autosplitter")
 
-    def update_identity(self, route):
+    def update_identity(self, route, keep_others=False):
         """
         Replace the splits here with the splits from the route with the same identity
+
+        With keep_others, golds of subsegments the route doesn't list are kept after its own, as long as their split
+        is in the route - for routes where runs may take splits in different orders, making other subsegments.
         """
-        collection = dict(self)
-        self.clear()
-        for segment in route.all_subsegments:
-            self[segment] = collection.get(segment, None)
+        keys = list(route.all_subsegments)
+        if keep_others:
+            by_identity = {split: split for split in route.splits}
+            listed = set(keys)
+            keys.extend((by_identity[split], level) for split, level in self
+                        if split in by_identity and (split, level) not in listed)
+        self._bind(keys)
 yaml.representer.Representer.add_representer(GoldsRecord, represent_pickle)
 
 
@@ -408,31 +819,75 @@ class Route(collections.UserList):
             prev = split
 
 class SplitsManager:
-    def __init__(self, asi, route, compare_pb=None, compare_best=None):
+    def __init__(self, asi, route, compare_pb=None, compare_best=None, triggers=None, rooms=None, history=None,
+                 comparisons=None):
         self.asi = asi
         self.route = route
+        self.triggers = triggers
+        self.rooms = rooms  # optional rooms.RoomTracker
+        self.history = history  # optional history.AttemptHistory
+        self.comparisons = comparisons  # optional comparisons.Comparisons
         self.compare_pb = compare_pb if compare_pb is not None else SplitsRecord()
         self.compare_best = compare_best if compare_best is not None else {}
         self.current_times = SplitsRecord()
         self.current_piece_idx = 0
         self.start_time = 0
         self.started = False
+        self.version = 0
+        self.generation = 0  # counts calls to update(), i.e. frames
+        self.render_caches = {}
+        self.armed_idx = None
 
         # migration
         if type(self.compare_best) is dict:
             self.compare_best = GoldsRecord(self.compare_best)
 
+        self.bind_records()
+        if self.comparisons is not None:
+            self.comparisons.update(self)
+
+    def bind_records(self):
         self.compare_pb.update_identity(self.route)
         self.compare_best.update_identity(self.route)
 
-        parents = {}
-        for split in self.route.splits:
-            parents[split.level] = split
+    def changed(self):
+        """
+        Note that the recorded times or comparisons have changed, invalidating anything rendered from them
+        """
+        self.version += 1
+        self.render_caches.clear()
 
-            if split not in self.compare_pb:
-                self.compare_pb[split] = None
-            else:
-                self.compare_pb.move_to_end(split)
+    @property
+    def compare(self):
+        """
+        The record to show times against: the pb, or whichever comparison is selected
+        """
+        if self.comparisons is None:
+            return self.compare_pb
+        return self.comparisons.table(self)
+
+    @property
+    def comparison_name(self):
+        return 'pb' if self.comparisons is None else self.comparisons.name
+
+    def cycle_comparison(self):
+        """
+        Switch to the next available comparison. Returns its name.
+        """
+        if self.comparisons is not None:
+            self.comparisons.cycle()
+            self.changed()
+        return self.comparison_name
+
+    def render_cache(self, name):
+        """
+        A dict for a renderer to memoize output in. It is emptied whenever changed() is called.
+        """
+        try:
+            return self.render_caches[name]
+        except KeyError:
+            cache = self.render_caches[name] = {}
+            return cache
 
     @property
     def done(self):
@@ -506,35 +961,81 @@ class SplitsManager:
             return None
         return self.current_time - split_start
 
+    def check_trigger(self, trigger):
+        if self.triggers is not None:
+            return self.triggers.check(trigger)
+        return trigger.check_trigger(self.asi)
+
+    def check_current_trigger(self):
+        """
+        Check the trigger at the current piece, arming it first if it has just become current
+        """
+        piece = self.current_piece
+        if self.armed_idx != self.current_piece_idx:
+            self.armed_idx = self.current_piece_idx
+            piece.arm()
+        return self.check_trigger(piece)
+
     def best_possible_time(self):
         return None
 
     def split(self, split):
         self.current_times[split] = self.current_time
+        self.changed()
+        if stats.enabled:
+            frame_time = getattr(self.asi, 'frame_time', None)
+            if frame_time is not None:
+                stats.record('split_latency', time.monotonic_ns() - frame_time)
 
     def commit(self):
+        if not len(self.current_times):
+            # nothing was split, as on every frame the reset trigger holds, so the only records which can change are
+            # the rooms visited before the first split
+            if self.rooms is not None:
+                self.rooms.commit(None, False)
+            return
+        cur_time = None
+        new_pb = False
         if self.route.splits[-1] in self.current_times:
             cur_time = self.current_times[self.route.splits[-1]]
             pb_time = self.compare_pb[self.route.splits[-1]]
             if pb_time is None or cur_time < pb_time:
                 self.compare_pb = self.current_times
+                # the run only has the splits it took, which on a graph route isn't all of them
+                self.bind_records()
+                new_pb = True
 
         # TODO: do we care about not mutating this reference?
-        self.compare_best = GoldsRecord(self.compare_best)
+        self.compare_best = self.compare_best.copy()
         for key in self.route.all_subsegments:
             split, level = key
             seg = self.current_times.segment_time(split, level, None)
-            best = self.compare_best[key]
+            best = self.compare_best.get(key)  # graph routes can realize subsegments the golds haven't seen
             if seg is not None and (best is None or seg < best):
                 self.compare_best[key] = seg
+        if self.rooms is not None:
+            self.rooms.commit(cur_time, new_pb)
+        if self.history is not None:
+            self.history.add(self.route, self.current_times)
+        if self.comparisons is not None:
+            self.comparisons.update(self)
+        self.changed()
 
     def reset(self):
+        # the reset trigger usually holds for a while, resetting a run which hasn't started yet on every frame
+        pristine = not self.started and not self.current_piece_idx and not len(self.current_times)
         self.current_piece_idx = 0
+        self.armed_idx = None
         self.current_times = SplitsRecord()
         self.started = False
         self.start_time = 0
+        if self.rooms is not None:
+            self.rooms.reset()
+        if not pristine:
+            self.changed()
 
     def skip(self, n=1):
+        self.changed()
         while not self.done:
             if type(self.current_piece) is Split:
                 self.current_times[self.current_piece] = None
@@ -551,6 +1052,7 @@ class SplitsManager:
                     break
 
     def rewind(self, n=1):
+        self.changed()
         while self.current_piece_idx:
             if type(self.current_piece) is Split:
                 del self.current_times[self.current_piece]
@@ -563,14 +1065,16 @@ class SplitsManager:
                     self.current_piece_idx -= 1
                     n -= 1
                 else:
-                    if self.current_piece.check_trigger(self.asi):
+                    # stepping a stateful trigger here would advance it outside of a frame, so stop at one instead
+                    if not self.current_piece.stateful and self.check_trigger(self.current_piece):
                         self.current_piece_idx -= 1
                     else:
                         break
 
 
     def update(self):
-        if type(self.route.reset_trigger) is Trigger and self.route.reset_trigger.check_trigger(self.asi):
+        self.generation += 1
+        if isinstance(self.route.reset_trigger, Trigger) and self.check_trigger(self.route.reset_trigger):
             self.commit()
             self.reset()
 
@@ -585,12 +1089,15 @@ class SplitsManager:
                 self.start_time = self.asi[self.route.time_field]
                 self.current_piece_idx += 1
             else:
-                if self.current_piece.check_trigger(self.asi):
+                if self.check_current_trigger():
                     self.started = True
                     self.current_piece_idx += 1
                 else:
                     break
 
+        if self.rooms is not None and self.started and not self.done:
+            self.rooms.update(self.asi, self.current_time)
+
 def parse_mapname(line):
     if line.lower() == 'farewell':
         return 10, 0
@@ -609,18 +1116,143 @@ def parse_mapname(line):
         chapter += 1
     return chapter, mode
 
+class Inspector:
+    """
+    Watches every field of a GameState for changes, for working out what a trigger should look for. Each sample takes
+    one snapshot of all the fields; the ones which differ from the last snapshot are timestamped, and changes to
+    anything but the clocks go into a timeline.
+    """
+    def __init__(self, asi, timeline=500):
+        self.asi = asi
+        self.attrs = asi.all_attrs
+        self.snapshot = operator.attrgetter(*self.attrs)
+        self.chapter_time_idx = self.attrs.index('chapter_time')
+        self.values = None
+        self.changed_at = [None] * len(self.attrs)  # time.monotonic() of each field's last change
+        self.timeline = collections.deque(maxlen=timeline)  # (seconds since start, chapter time, attr, old, new)
+        self.start = time.monotonic()
+        self.changes = collections.deque()  # when each change of the last second was seen, for the update rate
+        self.seqs = collections.deque()  # (time.monotonic(), tracer sequence number) over the last second
+
+    def now(self):
+        """
+        Seconds since we started, by the tracer's capture time if it gives one
+        """
+        capture_ns = getattr(self.asi, 'capture_ns', None)
+        if capture_ns is not None:
+            return capture_ns / 1e9 - self.start
+        return time.monotonic() - self.start
+
+    def sample(self):
+        """
+        Returns whether anything changed since the last sample
+        """
+        values = self.snapshot(self.asi)
+        seq = getattr(self.asi, 'seq', None)
+        if seq is not None:
+            self.seqs.append((time.monotonic(), seq))
+        if values == self.values:
+            return False
+        now = self.now()
+        seen = time.monotonic()
+        self.changes.append(seen)
+        if self.values is not None:
+            chapter_time = values[self.chapter_time_idx]
+            for i, (old, new) in enumerate(zip(self.values, values)):
+                if old != new:
+                    self.changed_at[i] = seen
+                    if not self.attrs[i].endswith('_time'):
+                        self.timeline.append((now, chapter_time, self.attrs[i], old, new))
+        self.values = values
+        return True
+
+    @property
+    def rate(self):
+        """
+        Changed frames seen in the last second
+        """
+        cutoff = time.monotonic() - 1
+        while self.changes and self.changes[0] < cutoff:
+            self.changes.popleft()
+        return len(self.changes)
+
+    @property
+    def tracer_rate(self):
+        """
+        Changed frames per second written by the tracer, or None if it doesn't number them
+        """
+        cutoff = time.monotonic() - 1
+        while len(self.seqs) > 1 and self.seqs[0][0] < cutoff:
+            self.seqs.popleft()
+        if len(self.seqs) < 2:
+            return None
+        (t0, seq0), (t1, seq1) = self.seqs[0], self.seqs[-1]
+        if t1 <= t0 or seq1 < seq0:
+            return None
+        return (seq1 - seq0) / 2 / (t1 - t0)
+
+def _fmt_field(attr, val):
+    if attr.endswith('_time'):
+        return fmt_time(val)
+    return repr(val) if type(val) is str else str(val)
+
+def format_fields(attrs, values, highlight=()):
+    max_width = max(len(attr) for attr in attrs)
+    lines = []
+    for i, (attr, val) in enumerate(zip(attrs, values)):
+        line = attr.ljust(max_width) + ': ' + _fmt_field(attr, val)
+        if i in highlight:
+            line = '\x1b[1;33m' + line + '\x1b[0m'
+        lines.append(line)
+    return lines
+
+def format_inspector(inspector, rows, highlight_seconds=1.):
+    now = time.monotonic()
+    recent = {i for i, t in enumerate(inspector.changed_at) if t is not None and now - t < highlight_seconds}
+    lines = format_fields(inspector.attrs, inspector.values, recent)
+    lines.append('')
+    tracer_rate = inspector.tracer_rate
+    if tracer_rate is None:
+        lines.append('%d updates/s seen' % inspector.rate)
+    else:
+        lines.append('%d updates/s seen, %d/s from the tracer' % (inspector.rate, tracer_rate))
+    room = max(0, rows - len(lines) - 1)
+    entries = list(inspector.timeline)[-room:] if room else []
+    for t, chapter_time, attr, old, new in entries:
+        lines.append('%10.3fs  %12s  %s: %s -> %s' % (t, fmt_time(chapter_time), attr, _fmt_field(attr, old), _fmt_field(attr, new)))
+    return lines
+
 def _main():
-    asi = AutoSplitterInfo()
-    max_width = max(len(attr) for attr in asi.all_attrs)
+    parser = argparse.ArgumentParser(description='Show the autosplitter info fields')
+    parser.add_argument('--dump', default=asi_path, help='The autosplitterinfo file path (default: %s)' % asi_path)
+    parser.add_argument('--inspect', action='store_true',
+        help='Highlight fields as they change and keep a timeline of the changes, for writing triggers'
+    )
+    args = parser.parse_args()
+
+    asi = AutoSplitterInfo(args.dump)
+    inspector = Inspector(asi)
+    drawn = None
+    recheck = 0
     while True:
-        data = '\x1b\x5b\x48\x1b\x5b\x4a'
         time.sleep(0.01)
-        for attr in asi.all_attrs:
-            val = asi.dict[attr]
-            if attr.endswith('_time'):
-                val = fmt_time(val)
-            data += attr.ljust(max_width) + ': ' + str(val) + '\n'
-        print(data)
+        now = time.monotonic()
+        if not inspector.sample() and now < recheck:
+            continue
+        # highlights fade, the rate ticks over and the connection can drop without the fields changing
+        recheck = now + (0.1 if args.inspect else 1)
+
+        if args.inspect:
+            _, rows = shutil.get_terminal_size()
+            lines = format_inspector(inspector, rows)
+        else:
+            lines = format_fields(inspector.attrs, inspector.values)
+        if not asi.connected:
+            lines.insert(0, '(reconnecting to %s...)' % asi.filename)
+        data = '\x1b[H' + '\x1b[K\n'.join(lines) + '\x1b[K\x1b[J'  # home, overwrite each line in place, clear the rest
+        if data != drawn:
+            print(data, end='', flush=True)
+            drawn = data
 
 if __name__ == '__main__':
     _main()
@@ -0,0 +1,113 @@
+"""
+Comparisons other than the pb, derived from the golds and the attempt history.
+
+    pb          the personal best, as always
+    average     the mean of every recorded time of each segment
+    median      the median of every recorded time of each segment
+    balanced    the golds scaled up evenly until they add up to the pb
+    latest      the most recent recorded time of each segment
+
+Each is a SplitsRecord of cumulative times bound to the route like the pb, so the displays look times and segment
+times up in it exactly as they do in the pb. They are rebuilt when a run is committed (and on graph routes whenever a
+choice changes the route taken), not while rendering, so switching between them and drawing deltas against them costs
+no more than comparing against the pb. Segments are the finest ones the route has; once a segment has no time, neither
+do the splits after it.
+"""
+
+import statistics
+
+from .celeste_timer import SplitsRecord
+
+NAMES = ('pb', 'average', 'median', 'balanced', 'latest')
+
+def finest_segments(route):
+    """
+    (split, golds key) for every split, the key being the subsegment from the split before it at any level
+    """
+    prev = None
+    for split in route.splits:
+        yield split, (split, split.level if prev is None else max(split.level, prev.level))
+        prev = split
+
+def cumulative(route, segments):
+    """
+    A SplitsRecord of running totals of the given segment times, bound to the route
+    """
+    record = SplitsRecord()
+    total = 0
+    for split in route.splits:
+        seg = segments.get(split)
+        if seg is None or total is None:
+            total = None
+        else:
+            total += seg
+        record[split] = total
+    record.update_identity(route)
+    return record
+
+def balanced(route, pb, golds):
+    final = pb.get(route.splits[-1])
+    segments = {split: golds.get(key) for split, key in finest_segments(route)}
+    if final is None or None in segments.values():
+        return None
+    total = sum(segments.values())
+    if total <= 0:
+        return None
+    return cumulative(route, {split: seg * final // total for split, seg in segments.items()})
+
+def from_history(route, history, summary):
+    segments = {}
+    for split in route.splits:
+        times = history.get(split)
+        if len(times):
+            segments[split] = summary(times)
+    if not segments:
+        return None
+    return cumulative(route, segments)
+
+class Comparisons:
+    """
+    The derived comparisons of one SplitsManager and which one is selected. Give it to the manager as
+    comparisons=; renderers then compare against sm.compare.
+    """
+    def __init__(self, selected='pb'):
+        if selected not in NAMES:
+            raise ValueError("Unknown comparison %s (one of %s)" % (selected, ', '.join(NAMES)))
+        self.selected = selected
+        self.tables = {}
+
+    def update(self, sm):
+        route = sm.route
+        tables = {}
+        table = balanced(route, sm.compare_pb, sm.compare_best)
+        if table is not None:
+            tables['balanced'] = table
+        if sm.history is not None:
+            for name, summary in (
+                    ('average', lambda times: sum(times) // len(times)),
+                    ('median', lambda times: int(statistics.median(times))),
+                    ('latest', lambda times: times[-1])):
+                table = from_history(route, sm.history, summary)
+                if table is not None:
+                    tables[name] = table
+        self.tables = tables
+
+    @property
+    def available(self):
+        return [name for name in NAMES if name == 'pb' or name in self.tables]
+
+    @property
+    def name(self):
+        """
+        The comparison in use: the selected one, or the pb while there's nothing to build that from (yet)
+        """
+        return self.selected if self.selected in self.tables else 'pb'
+
+    def table(self, sm):
+        return self.tables.get(self.selected, sm.compare_pb)
+
+    def cycle(self):
+        available = self.available
+        idx = available.index(self.selected) if self.selected in available else 0
+        self.selected = available[(idx + 1) % len(available)]
+        return self.selected
@@ -1,48 +1,243 @@
+#!/usr/bin/env python3
+"""
+Per-room death statistics, kept across sessions.
+
+A DeathCounter listens to every frame the reader decodes and attributes each increment of the death count to the room
+of the frame where it happened, so no death is missed or blamed on the wrong room however slowly the display is
+polled. Any other change of the count between frames is a different save being loaded, not deaths. The reader thread
+only queues the deaths; update() folds them into a DeathIndex on the caller's thread.
+
+The index counts deaths by route, chapter and room, and is saved as yaml. Each (route) and (route, chapter) scope keeps
+its rooms in a TopCounter, so recording a death costs the same however many rooms there are, and the display's top-N
+queries only look at the N rooms they return.
+"""
+
+import sys
 import time
-from collections import defaultdict
-from .celeste_timer import AutoSplitterInfo
-
-asi = AutoSplitterInfo()
-
-seen_deaths = None
-deaths = None
-
-def reset():
-    global deaths, seen_deaths
-    deaths = defaultdict(list)
-    seen_deaths = asi.death_count
-
-def update():
-    global seen_deaths
-    if asi.chapter == 0 and 1 < asi.file_time < 1000:
-        reset()
-    while asi.death_count > seen_deaths and asi.death_count < seen_deaths + 5:
-        death()
-
-def death():
-    global seen_deaths
-    seen_deaths += 1
-    deaths[asi.chapter_name].append(asi.level_name)
-
-def render(maximum=5):
-    out = ['Deaths:', '']
-
-    for chapter in deaths:
-        lst = deaths[chapter]
-        if lst:
-            prefix = ', '.join(lst[:maximum])
-            suffix = '' if len(lst) <= maximum else ' + %d more' % (len(lst) - maximum)
-            out.append('%s: %s%s' % (chapter, prefix, suffix))
-
-    print('\x1b\x5b\x48\x1b\x5b\x4a' + '\n'.join(out))
-
-try:
-    time.sleep(0.5)
-    reset()
-    while True:
-        time.sleep(0.1)
-        update()
-        render()
-except KeyboardInterrupt:
-    pass
-render(999999999)
+import argparse
+import collections
+import yaml
+
+from .celeste_timer import AutoSplitterInfo, DeathWatch, NEW_SAVE, asi_path, open_pickle_or_yaml, save_yaml, represent_pickle
+
+class _Bucket:
+    __slots__ = ('count', 'keys', 'lower', 'higher')
+
+    def __init__(self, count):
+        self.count = count
+        self.keys = {}  # used as an ordered set
+        self.lower = None
+        self.higher = None
+
+class TopCounter:
+    """
+    Counts of keys, in a linked list of buckets of keys with equal counts ordered by count. Adding one to a key moves
+    it to the next bucket up, so it costs constant time, and the N largest are read off the top of the list.
+    """
+    def __init__(self):
+        self.buckets = {}  # key -> its bucket
+        self.top = None
+        self.bottom = None
+        self.total = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def __getitem__(self, key):
+        bucket = self.buckets.get(key)
+        return 0 if bucket is None else bucket.count
+
+    def add(self, key, n=1):
+        self.total += n
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            count = n
+            lower, higher = None, self.bottom
+        else:
+            count = bucket.count + n
+            lower, higher = bucket, bucket.higher
+            del bucket.keys[key]
+        # with n=1 this takes at most one step
+        while higher is not None and higher.count < count:
+            lower, higher = higher, higher.higher
+        if higher is not None and higher.count == count:
+            target = higher
+        else:
+            target = _Bucket(count)
+            target.lower, target.higher = lower, higher
+            if lower is not None:
+                lower.higher = target
+            else:
+                self.bottom = target
+            if higher is not None:
+                higher.lower = target
+            else:
+                self.top = target
+        target.keys[key] = None
+        self.buckets[key] = target
+        if bucket is not None and not bucket.keys:
+            self._unlink(bucket)
+
+    def _unlink(self, bucket):
+        if bucket.lower is not None:
+            bucket.lower.higher = bucket.higher
+        else:
+            self.bottom = bucket.higher
+        if bucket.higher is not None:
+            bucket.higher.lower = bucket.lower
+        else:
+            self.top = bucket.lower
+
+    def most(self, n):
+        """
+        The n keys with the highest counts as (key, count) pairs, highest first
+        """
+        result = []
+        bucket = self.top
+        while bucket is not None and len(result) < n:
+            for key in bucket.keys:
+                result.append((key, bucket.count))
+                if len(result) == n:
+                    break
+            bucket = bucket.lower
+        return result
+
+class DeathIndex:
+    def __init__(self):
+        self.deaths = {}  # (route, chapter, room) -> count
+        self.scopes = {}  # (route,) -> TopCounter of (chapter, room); (route, chapter) -> TopCounter of room
+        self.dirty = False
+
+    def _scope(self, key):
+        try:
+            return self.scopes[key]
+        except KeyError:
+            counter = self.scopes[key] = TopCounter()
+            return counter
+
+    def add(self, route, chapter, room, n=1):
+        key = (route, chapter, room)
+        self.deaths[key] = self.deaths.get(key, 0) + n
+        self._scope((route,)).add((chapter, room), n)
+        self._scope((route, chapter)).add(room, n)
+        self.dirty = True
+
+    def get(self, route, chapter, room):
+        return self.deaths.get((route, chapter, room), 0)
+
+    def top_rooms(self, route, chapter=None, n=5):
+        """
+        The rooms with the most deaths in a route, or in one chapter of it: ((chapter, room), count) pairs for a
+        route, (room, count) pairs for a chapter
+        """
+        counter = self.scopes.get((route,) if chapter is None else (route, chapter))
+        return [] if counter is None else counter.most(n)
+
+    def __getstate__(self):
+        return {
+            'version': 1,
+            'deaths': [[route, chapter, room, count] for (route, chapter, room), count in self.deaths.items()],
+        }
+
+    def __setstate__(self, state):
+        if type(state) is not dict or state.get('version', 0) != 1:
+            raise TypeError("Cannot deserialize this DeathIndex - try updating the autosplitter")
+        self.__init__()
+        for route, chapter, room, count in state['deaths']:
+            self.add(route, chapter, room, count)
+        self.dirty = False
+yaml.representer.Representer.add_representer(DeathIndex, represent_pickle)
+
+def load_deaths(filename):
+    try:
+        return open_pickle_or_yaml(filename)
+    except FileNotFoundError:
+        return DeathIndex()
+
+def save_deaths(index, filename):
+    if index.dirty:
+        save_yaml(filename, index)
+        index.dirty = False
+
+class DeathCounter:
+    """
+    Feeds a DeathIndex from an AutoSplitterInfo, and keeps this session's counts besides. attach() it to the reader,
+    then call update() from the main loop.
+    """
+    def __init__(self, index, route=''):
+        self.index = index
+        self.route = route
+        self.session = TopCounter()  # (chapter, room) -> deaths since the current save was loaded
+        self.watch = DeathWatch()
+        self.pending = collections.deque()  # appended to by the reader thread
+
+    def attach(self, asi):
+        asi.listeners.append(self.frame)
+
+    def frame(self, asi):
+        """
+        Called on the reader thread with every new frame
+        """
+        death = self.watch.step(asi)
+        if death is NEW_SAVE:
+            self.pending.append(None)
+        elif death is not None:
+            self.pending.append(death)
+
+    def update(self):
+        """
+        Record the deaths seen since the last call. Returns whether there were any.
+        """
+        if not self.pending:
+            return False
+        while self.pending:
+            death = self.pending.popleft()
+            if death is None:
+                self.session = TopCounter()
+                continue
+            chapter, room = death
+            self.index.add(self.route, chapter, room)
+            self.session.add(death)
+        return True
+
+def render(counter, maximum=5):
+    out = ['Deaths this session: %d' % counter.session.total, '']
+    for (chapter, room), count in counter.session.most(maximum):
+        out.append('  %s %s: %d (%d all time)' % (chapter, room, count, counter.index.get(counter.route, chapter, room)))
+    out.extend(['', 'Most deaths all time:', ''])
+    for (chapter, room), count in counter.index.top_rooms(counter.route, n=maximum):
+        out.append('  %s %s: %d' % (chapter, room, count))
+    return '\n'.join(out)
+
+def main():
+    parser = argparse.ArgumentParser(description='Count deaths per room, across sessions')
+    parser.add_argument('--index', default='deaths.yaml', help='Where to keep the death counts (default: deaths.yaml)')
+    parser.add_argument('--route', default='', help='Count deaths separately under this name, e.g. per category')
+    parser.add_argument('--dump', default=asi_path, help='The autosplitterinfo file path (default: %s)' % asi_path)
+    parser.add_argument('--top', type=int, default=5, help='How many rooms to show (default: 5)')
+    args = parser.parse_args()
+
+    index = load_deaths(args.index)
+    counter = DeathCounter(index, args.route)
+    asi = AutoSplitterInfo(args.dump)
+    counter.attach(asi)
+    print('\x1b[H\x1b[J' + render(counter, args.top))
+    next_save = time.monotonic() + 60
+    try:
+        while True:
+            time.sleep(0.1)
+            if counter.update():
+                print('\x1b[H\x1b[J' + render(counter, args.top))
+            if time.monotonic() >= next_save:
+                save_deaths(index, args.index)
+                next_save = time.monotonic() + 60
+    except KeyboardInterrupt:
+        pass
+    finally:
+        counter.update()
+        save_deaths(index, args.index)
+    print(render(counter, 999999999))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
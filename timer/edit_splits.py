@@ -1,10 +1,158 @@
 #!/usr/bin/env python3
 
+import re
+import ast
 import sys
+import copy
 import pickle
 import traceback
 
 from .celeste_timer import *  # pylint: disable=wildcard-import,unused-wildcard-import
+from .temporal import TemporalTrigger
+
+FIELDS = frozenset(GameState.all_attrs + ('chapter_name',))
+
+class _Fields(ast.NodeTransformer):
+    def visit_Name(self, node):
+        if node.id not in FIELDS:
+            return node
+        return ast.copy_location(ast.Attribute(value=ast.Name(id='asi', ctx=ast.Load()), attr=node.id, ctx=node.ctx), node)
+
+def field_expr(text):
+    """
+    Let temporal commands name game state fields like level_name without the asi. in front, anywhere in the expression
+    """
+    tree = _Fields().visit(ast.parse(text.strip(), mode='eval'))
+    return ast.unparse(ast.fix_missing_locations(tree))
+
+def temporal_trigger(name, expr):
+    """
+    A TemporalTrigger, tried once on a blank game state so that a bad expression is refused here instead of when the
+    route runs
+    """
+    trigger = TemporalTrigger(name, expr)
+    trigger.check_trigger(GameState())
+    trigger.arm()
+    return trigger
+
+class EditLog:
+    """
+    The pieces being edited, changed only through insert/delete/set so that every change is logged with its inverse.
+    The changes made by one command form a group which undo() reverts, instead of keeping a copy of the whole list.
+    """
+    def __init__(self, pieces, level_names=None):
+        self.pieces = pieces
+        self.level_names = level_names
+        self.undo_groups = []
+        self.current = None
+        self.version = 0  # counts changes, to tell whether there's anything to save
+
+    def begin(self):
+        self.current = []
+
+    def end(self):
+        if self.current:
+            self.undo_groups.append(self.current)
+        self.current = None
+
+    def rollback(self):
+        """
+        Revert the changes of the command in progress. Returns where the earliest of them happened.
+        """
+        group, self.current = self.current, None
+        return self._revert(group)
+
+    def undo(self):
+        if not self.undo_groups:
+            raise ValueError("Nothing to undo")
+        return self._revert(self.undo_groups.pop())
+
+    def _revert(self, group):
+        where = None
+        for op in reversed(group):
+            if op[0] == 'insert':
+                _, idx, n = op
+                del self.pieces[idx:idx + n]
+            elif op[0] == 'delete':
+                _, idx, removed = op
+                self.pieces[idx:idx] = removed
+            else:
+                _, idx, obj, attr, value = op
+                setattr(obj, attr, value)
+            if idx is not None:
+                where = idx if where is None else min(where, idx)
+            self.version += 1
+        return where
+
+    def insert(self, idx, new):
+        self.pieces[idx:idx] = new
+        self.current.append(('insert', idx, len(new)))
+        self.version += 1
+        return idx + len(new)
+
+    def delete(self, start, end):
+        removed = self.pieces[start:end]
+        del self.pieces[start:end]
+        self.current.append(('delete', start, removed))
+        self.version += 1
+
+    def set(self, obj, attr, value, idx=None):
+        self.current.append(('set', idx, obj, attr, getattr(obj, attr)))
+        setattr(obj, attr, value)
+        self.version += 1
+
+def parse_range(text, length):
+    """
+    A 1-based inclusive range like 5-12, or a single index, as a slice (start, end) of a list of that length
+    """
+    first, _, last = text.partition('-')
+    start = int(first) - 1
+    end = int(last) if last else start + 1
+    if not 0 <= start < end <= length:
+        raise ValueError("Bad range")
+    return start, end
+
+def describe(piece):
+    if isinstance(piece, Split):
+        return ' / '.join(piece.names)
+    return '%s %s' % (piece.name, getattr(piece, 'end_trigger', ''))
+
+ROOM_TRIGGER = re.compile(r'asi\.level_name == ([\'"])(.*?)\1')
+
+def room_before(pieces, idx):
+    """
+    The room the player is in at idx, if the last trigger before it is entering a room
+    """
+    for piece in reversed(pieces[:idx]):
+        if isinstance(piece, Trigger):
+            match = ROOM_TRIGGER.match(piece.end_trigger)
+            return None if match is None else match.group(2)
+    return None
+
+def find(pieces, text, start):
+    """
+    The index of the next piece after start whose names or trigger mention text, wrapping around
+    """
+    text = text.lower()
+    n = len(pieces)
+    for k in range(1, n + 1):
+        i = (start + k) % n
+        if text in describe(pieces[i]).lower():
+            return i
+    raise ValueError("Nothing matches %s" % text)
+
+def show(pieces, cursor, window):
+    start = max(0, min(cursor - window // 2, len(pieces) + 1 - window))
+    end = min(len(pieces) + 1, start + window)
+    lines = []
+    if start > 0:
+        lines.append('   ... %d above' % start)
+    for i in range(start, end):
+        prefix = '->' if i == cursor else '  '
+        lines.append('%s %02d. %s' % (prefix, i + 1, pieces[i] if i < len(pieces) else ''))
+    if end < len(pieces) + 1:
+        lines.append('   ... %d below' % (len(pieces) + 1 - end))
+    print('\n'.join(lines))
 
 def main():
     if len(sys.argv) != 2:
@@ -29,99 +177,177 @@ def main():
             reset_trigger = Trigger('Start chapter', 'asi.chapter == %d and asi.mode == %d and asi.chapter_time < 1000' % (chapter, mode))
         level_names = ['Split', 'Subsplit', 'Subsubsplit']
 
-    pieces, level_names_maybe = edit(pieces)
-    if level_names_maybe is not None:
-        level_names = level_names_maybe
+    def save(pieces, level_names_maybe):
+        route = Route(name, time_field, list(pieces), level_names if level_names_maybe is None else level_names_maybe, reset_trigger)
+        save_yaml(filename, route)
+
+    edit(pieces, save)
 
-    route = Route(name, time_field, pieces, level_names, reset_trigger)
-    save_yaml(filename, route)
+def check_route(pieces):
+    if len(pieces) == 0 or type(pieces[-1]) is not Split or pieces[-1].level != 0:
+        raise TypeError("Last piece of route must be a split")
 
-def edit(pieces):
+def edit(pieces, save=None, window=20):
+    log = EditLog(pieces)
     cursor = len(pieces)
     inhibit = False
-    level_names = None
+    saved_version = log.version
+    query = None
     while True:
         if not inhibit:
-            for i, piece in enumerate(pieces + ['']):
-                prefix = '->' if i == cursor else '  '
-                print('%s %02d. %s' % (prefix, i + 1, piece))
+            show(pieces, cursor, window)
         else:
             inhibit = False
 
         cmd = input('> ')
         args = cmd.split()
-        rollback = list(pieces)
+        if not args:
+            continue
+        log.begin()
+        before = cursor
+
+        def add(*new):
+            return log.insert(cursor, list(new))
+
         try:
             if args[0] == 'goto':
                 idx = int(args[1]) - 1
                 if not 0 <= idx <= len(pieces):
                     raise ValueError("Bad index")
                 cursor = idx
+            elif args[0] == 'find':
+                query = ' '.join(args[1:])
+                cursor = find(pieces, query, cursor)
+            elif args[0] == 'next':
+                if query is None:
+                    raise ValueError("Nothing to find yet")
+                cursor = find(pieces, query, cursor)
+            elif args[0] == 'window':
+                window = max(3, int(args[1]))
+            elif args[0] == 'list':
+                inhibit = True
+                show(pieces, cursor, len(pieces) + 1)
             elif args[0] == 'delete':
-                pieces.pop(cursor)
+                start, end = parse_range(args[1], len(pieces)) if len(args) > 1 else (cursor, cursor + 1)
+                if start >= len(pieces):
+                    raise ValueError("Nothing to delete")
+                log.delete(start, end)
+                if cursor >= end:
+                    cursor -= end - start
+                elif cursor > start:
+                    cursor = start
+            elif args[0] == 'copy':
+                start, end = parse_range(args[1], len(pieces))
+                cursor = add(*(Split(list(piece.names), piece.level) if isinstance(piece, Split) else copy.deepcopy(piece)
+                               for piece in pieces[start:end]))
+            elif args[0] == 'level':
+                start, end = parse_range(args[1], len(pieces))
+                level = int(args[2])
+                if level < 0:
+                    raise ValueError("Bad level")
+                for i in range(start, end):
+                    if isinstance(pieces[i], Split):
+                        log.set(pieces[i], 'level', level, i)
+            elif args[0] == 'rooms':
+                rooms = args[1:]
+                current = room_before(pieces, cursor)
+                if current is None:
+                    current, rooms = rooms[0], rooms[1:]
+                for room in rooms:
+                    # entering a room ends the segment spent in the one before it
+                    cursor = add(Trigger('Room %s' % room, 'asi.level_name == %r' % room), Split([current], level=0))
+                    current = room
             elif args[0] == 'split':
                 names = [x.strip() for x in ' '.join(args[1:]).split('/')]
-                pieces.insert(cursor, Split(names, level=0))
-                cursor += 1
+                cursor = add(Split(names, level=0))
             elif args[0] == 'subsplit':
-                pieces.insert(cursor, Split([' '.join(args[1:])], level=1))
-                cursor += 1
+                cursor = add(Split([' '.join(args[1:])], level=1))
             elif args[0] == 'rename':
                 if isinstance(pieces[cursor], Split):
                     names = [x.strip() for x in ' '.join(args[1:]).split('/')]
-                    pieces[cursor].names = names
+                    log.set(pieces[cursor], 'names', names, cursor)
                 else:
-                    pieces[cursor].name = ' '.join(args[1:])
+                    log.set(pieces[cursor], 'name', ' '.join(args[1:]), cursor)
             elif args[0] == 'overworld':
-                pieces.insert(cursor, Trigger('Return to map', 'asi.chapter == -1'))
-                cursor += 1
+                cursor = add(Trigger('Return to map', 'asi.chapter == -1'))
             elif args[0] == 'chapter':
                 chapter, mode = parse_mapname(args[1])
-                pieces.insert(cursor, Trigger('Enter %s' % args[1], 'asi.chapter == %d and asi.mode == %d' % (chapter, mode)))
-                cursor += 1
+                cursor = add(Trigger('Enter %s' % args[1], 'asi.chapter == %d and asi.mode == %d' % (chapter, mode)))
             elif args[0] == 'complete':
-                pieces.insert(cursor, Trigger("Chapter complete", 'asi.chapter_complete'))
-                cursor += 1
+                cursor = add(Trigger("Chapter complete", 'asi.chapter_complete'))
             elif args[0] == 'cassette':
-                pieces.insert(cursor, Trigger('Get cassette', 'asi.chapter_cassette'))
-                cursor += 1
+                cursor = add(Trigger('Get cassette', 'asi.chapter_cassette'))
             elif args[0] == 'heart':
-                pieces.insert(cursor, Trigger('Get heart', 'asi.chapter_heart'))
-                cursor += 1
+                cursor = add(Trigger('Get heart', 'asi.chapter_heart'))
             elif args[0] == 'berries':
                 berries = int(args[1])
-                pieces.insert(cursor, Trigger('%d berries' % berries, 'asi.file_strawberries == %d' % berries))
-                cursor += 1
+                cursor = add(Trigger('%d berries' % berries, 'asi.file_strawberries == %d' % berries))
             elif args[0] == 'room':
-                pieces.insert(cursor, Trigger('Room %s' % args[1], 'asi.level_name == %r' % args[1]))
-                cursor += 1
+                cursor = add(Trigger('Room %s' % args[1], 'asi.level_name == %r' % args[1]))
             elif args[0] == 'checkpoint':
                 cp = int(args[1])
-                pieces.insert(cursor, Trigger('Reach checkpoint %d' % cp, 'asi.chapter_checkpoints == %d' % cp))
-                cursor += 1
+                cursor = add(Trigger('Reach checkpoint %d' % cp, 'asi.chapter_checkpoints == %d' % cp))
+            elif args[0] == 'when':
+                expr = field_expr(' '.join(args[1:]))
+                cursor = add(temporal_trigger(expr, expr))
+            elif args[0] in ('rose', 'fell', 'changed'):
+                expr = field_expr(' '.join(args[1:]))
+                cursor = add(temporal_trigger('%s %s' % (expr, args[0]), '%s(%s)' % (args[0], expr)))
+            elif args[0] == 'held':
+                ms = int(args[1])
+                expr = field_expr(' '.join(args[2:]))
+                cursor = add(temporal_trigger('%s held %dms' % (expr, ms), 'held(%s, %d)' % (expr, ms)))
+            elif args[0] == 'seq':
+                steps = [field_expr(x) for x in ' '.join(args[1:]).split(';')]
+                cursor = add(temporal_trigger(' then '.join(steps), 'seq(%s)' % ', '.join(steps)))
             elif args[0] == 'kinds':
-                level_names = [x.strip() for x in ' '.join(args[1:]).split('/')]
-
+                log.set(log, 'level_names', [x.strip() for x in ' '.join(args[1:]).split('/')])
+            elif args[0] == 'undo':
+                where = log.undo()
+                if where is not None:
+                    cursor = min(where, len(pieces))
+            elif args[0] == 'save':
+                check_route(pieces)
+                if save is not None and log.version != saved_version:
+                    save(pieces, log.level_names)
+                saved_version = log.version
             elif args[0] == 'quit':
-                if len(pieces) == 0 or type(pieces[-1]) is not Split or pieces[-1].level != 0:
-                    raise TypeError("Last piece of route must be a split")
-                return pieces, level_names
+                check_route(pieces)
+                if save is not None and log.version != saved_version:
+                    save(pieces, log.level_names)
+                return pieces, log.level_names
             elif args[0] == 'help':
                 inhibit = True
                 print("""Commands:
 - goto <idx>: move your cursor to the given index
-- delete: delete the item under your cursor
+- find <text>: move your cursor to the next split or trigger whose name or condition mentions the text
+- next: find the same text again
+- window <rows>: show this many rows around the cursor (default 20)
+- list: show the whole route
+- delete [<idx>-<idx>]: delete the item under your cursor, or a range of items
+- copy <idx>-<idx>: insert a copy of a range of items (with new splits)
+- level <idx>-<idx> <level>: set the level of every split in a range (0 for splits, 1 for subsplits...)
+- undo: undo the last command
+- save: save without quitting
 - split <name>: add a split with the given name
 - subsplit <name>: add a subsplit with the given name
 - rename <name>: rename the split under the cursor
 - overworld: trigger on loading the overworld
 - chapter <numberletter>: trigger on entering the given chapter
 - room <levelname>: trigger on entering the given room
+- rooms <levelname> <levelname> ...: for each room, a trigger on entering it and a split for the room being left,
+  which at first is the room of the room trigger before the cursor (or if there isn't one, the first room given)
 - checkpoint <number>: trigger on unlocking the given checkpoint (only works in full-game splits)
 - complete: trigger on completing the current chapter
 - cassette: trigger on collecting the chapter's cassette
 - heart: trigger on collecting the chapter's heart
 - berries <number>: trigger on reaching n berries
+- rose <expr>: trigger on the frame the expression becomes true, e.g. rose chapter_complete
+- fell <expr>: trigger on the frame the expression becomes false
+- changed <expr>: trigger on the frame the expression's value changes, e.g. changed level_name
+- held <ms> <expr>: trigger once the expression has been true for the given number of milliseconds
+- seq <expr>; <expr>; ...: trigger once each expression has been true in turn, e.g. seq chapter_checkpoints >= 2; level_name == "b-07"
+- when <expr>: trigger on a raw temporal expression using rose/fell/changed/held/seq (see temporal.py)
 - kinds <name>: name how your "segment" and "subsegment" titles appear, separated by a slash
 - quit: save and quit the editor
 
@@ -132,10 +358,12 @@ See README.md for a discussion of how splits and triggers work
             else:
                 print("Bad command. Type help for help.")
                 inhibit = True
+            log.end()
 
         except:  # pylint: disable=bare-except
             traceback.print_exc()
-            pieces = rollback
+            log.rollback()
+            cursor = min(before, len(pieces))
             inhibit = True
 
 
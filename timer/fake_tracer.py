@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+A stand-in for the tracer, for testing the timer without Celeste.
+
+Writes DumpInfo records to the autosplitterinfo file exactly as the tracer does (overwriting the start of the file
+in place, behind the same sequence-numbered header, or bare with --legacy like older tracers), either following a scripted scenario or replaying a session recorded with record.py. The write rate is
+configurable, including rates well above the tracer's 1 kHz and 0 for as fast as possible, so it doubles as a load
+generator for the reader and whatever displays are attached to it.
+
+Game time advances by speed * 1000 / rate milliseconds per write (1 ms * speed per write when the rate is
+unlimited), so --speed 10 plays a scenario ten times faster than real time while still writing at the same rate.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+from .celeste_timer import GameState, asi_path, DUMP_HEADER, DUMP_MAGIC, DUMP_VERSION
+from .record import read_session
+
+class FakeTracer:
+    def __init__(self, filename=asi_path, rate=1000.0, speed=1.0, legacy=False):
+        self.filename = filename
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        self.legacy = legacy
+        self.last_dat = None
+        # like the tracer, carry on from the sequence number already in the file
+        header = os.pread(self.fd, DUMP_HEADER.size, 0)
+        self.seq = DUMP_HEADER.unpack(header)[2] if header[:4] == DUMP_MAGIC else 0
+        self.seq += self.seq % 2
+        self.state = GameState()
+        self.state.chapter = -1
+        self.rate = rate
+        self.speed = speed
+        self.interval = 1 / rate if rate else 0
+        self.step_ms = speed * 1000 / rate if rate else speed
+        self.writes = 0
+        self.started = time.monotonic()
+        self.next_write = self.started
+
+    def write(self, dat):
+        if self.legacy:
+            os.pwrite(self.fd, dat, 0)
+        else:
+            capture_ns = time.monotonic_ns()
+            if dat != self.last_dat:
+                self.seq += 1
+                os.pwrite(self.fd, DUMP_HEADER.pack(DUMP_MAGIC, DUMP_VERSION, self.seq, capture_ns), 0)
+                os.pwrite(self.fd, dat, DUMP_HEADER.size)
+                self.seq += 1
+                self.last_dat = dat
+            os.pwrite(self.fd, DUMP_HEADER.pack(DUMP_MAGIC, DUMP_VERSION, self.seq, capture_ns), 0)
+        self.writes += 1
+        if self.interval:
+            self.next_write += self.interval
+            delay = self.next_write - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.1:
+                # too far behind to catch up; don't burst
+                self.next_write = time.monotonic()
+
+    def hold(self, ms):
+        """
+        Keep writing the current state for ms of game time, running the clocks as the game would
+        """
+        state = self.state
+        elapsed = 0
+        while elapsed < ms:
+            step = min(self.step_ms, ms - elapsed)
+            elapsed += step
+            if state.timer_active:
+                state.file_time += step
+                if state.chapter_started and not state.chapter_complete:
+                    state.chapter_time += step
+            self.write(state.encode())
+
+    def close(self):
+        os.close(self.fd)
+
+    @property
+    def achieved_rate(self):
+        return self.writes / max(time.monotonic() - self.started, 1e-9)
+
+def menu(t, ms=1500):
+    s = t.state
+    s.chapter = -1
+    s.mode = 0
+    s.level_name = ''
+    s.chapter_started = False
+    s.chapter_complete = False
+    s.chapter_checkpoints = 0
+    s.in_cutscene = False
+    t.hold(ms)
+
+def new_file(t):
+    s = t.state
+    s.file_time = 0
+    s.death_count = 0
+    s.file_strawberries = 0
+    s.file_cassettes = 0
+    s.file_hearts = 0
+    s.timer_active = True
+
+def chapter(t, rng, number, mode=0, rooms=8, checkpoints=2, room_ms=2500, death_rate=0.2, reset_after=None):
+    """
+    Play through a chapter: rooms named <section>-<nn> spread evenly over checkpoints + 1 sections, some deaths in each
+    room, then the chapter complete screen and back to the menu. With reset_after, give up after that many rooms.
+    """
+    s = t.state
+    s.chapter = number
+    s.mode = mode
+    s.chapter_started = True
+    s.chapter_complete = False
+    s.chapter_time = 0
+    s.chapter_checkpoints = 0
+    s.chapter_strawberries = 0
+    s.chapter_cassette = False
+    s.chapter_heart = False
+    s.in_cutscene = False
+    per_section = max(1, rooms // (checkpoints + 1))
+
+    for i in range(rooms):
+        section = min(i // per_section, checkpoints)
+        if section > s.chapter_checkpoints:
+            s.chapter_checkpoints = section
+        s.level_name = '%s-%02d' % (chr(ord('a') + section), i)
+        deaths = sum(1 for _ in range(3) if rng.random() < death_rate)
+        dwell = room_ms * rng.uniform(0.5, 1.5)
+        for _ in range(deaths):
+            t.hold(dwell / (deaths + 1))
+            s.death_count += 1
+        t.hold(dwell / (deaths + 1))
+        if reset_after is not None and i + 1 >= reset_after:
+            menu(t)
+            return False
+
+    s.chapter_complete = True
+    s.in_cutscene = True
+    t.hold(1000)
+    menu(t)
+    return True
+
+# rough checkpoint counts of the a-sides
+CHECKPOINTS = {0: 0, 1: 2, 2: 2, 3: 3, 4: 3, 5: 4, 6: 5, 7: 6}
+
+def scenario_chapter(t, rng, runs):
+    """
+    Repeated runs of Forsaken City, occasionally resetting partway
+    """
+    for _ in range(runs):
+        reset_after = rng.randrange(2, 8) if rng.random() < 0.3 else None
+        new_file(t)
+        chapter(t, rng, 1, rooms=9, checkpoints=2, reset_after=reset_after)
+
+def scenario_fullgame(t, rng, runs):
+    """
+    Fresh files through the prologue and every a-side, with a reset somewhere in about half of them
+    """
+    for _ in range(runs):
+        new_file(t)
+        give_up = rng.randrange(0, 8) if rng.random() < 0.5 else None
+        for number, checkpoints in CHECKPOINTS.items():
+            rooms = 3 if number == 0 else 4 * (checkpoints + 1)
+            if not chapter(t, rng, number, rooms=rooms, checkpoints=checkpoints,
+                           reset_after=rng.randrange(1, rooms) if number == give_up else None):
+                break
+
+def scenario_deaths(t, rng, runs):
+    """
+    One long chapter with lots of dying, for anything counting deaths per room
+    """
+    for _ in range(runs):
+        new_file(t)
+        chapter(t, rng, 1, rooms=20, checkpoints=2, room_ms=4000, death_rate=0.8)
+
+SCENARIOS = {
+    'chapter': scenario_chapter,
+    'fullgame': scenario_fullgame,
+    'deaths': scenario_deaths,
+}
+
+def replay(t, filename):
+    """
+    Write the frames of a recorded session with their original spacing (scaled by speed), repeating each frame at
+    the write rate until the next one is due
+    """
+    start = time.monotonic()
+    first = None
+    prev = None
+    for timestamp, dat in read_session(filename):
+        if first is None:
+            first = timestamp
+        if t.interval and prev is not None:
+            due = start + (timestamp - first) / 1e9 / t.speed
+            while time.monotonic() < due:
+                t.write(prev)
+        t.write(dat)
+        prev = dat
+
+def main():
+    parser = argparse.ArgumentParser(description='Write fake autosplitter info, like the tracer does')
+    parser.add_argument('scenario', nargs='?', default='chapter', choices=sorted(SCENARIOS) + ['replay'],
+        help='What to play (default: chapter)'
+    )
+    parser.add_argument('--session', help='The session file to play with the replay scenario')
+    parser.add_argument('--dump', default=asi_path, help='The autosplitterinfo file to write (default: %s)' % asi_path)
+    parser.add_argument('--rate', type=float, default=1000, help='Writes per second, or 0 for unlimited (default: 1000)')
+    parser.add_argument('--speed', type=float, default=1, help='Game time per real time (default: 1)')
+    parser.add_argument('--runs', type=int, default=5, help='How many times to play the scenario (default: 5)')
+    parser.add_argument('--seed', type=int, help='Random seed, for repeatable scenarios')
+    parser.add_argument('--legacy', action='store_true', help='Write the bare DumpInfo without a header, like older tracers')
+    args = parser.parse_args()
+
+    if args.scenario == 'replay' and not args.session:
+        parser.error('replay needs --session')
+
+    t = FakeTracer(args.dump, args.rate, args.speed, args.legacy)
+    try:
+        if args.scenario == 'replay':
+            replay(t, args.session)
+        else:
+            SCENARIOS[args.scenario](t, random.Random(args.seed), args.runs)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        t.close()
+    print('%d writes, %.0f/s' % (t.writes, t.achieved_rate))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,76 +1,48 @@
 #!/usr/bin/env python3
 
 from .celeste_timer import * # pylint: disable=wildcard-import,unused-wildcard-import
+from . import stats
+from . import schedule
 
 import os
+import sys
 import time
+import argparse
 import functools
-import gi
+import shutil
 import subprocess
 import yaml
-gi.require_version('Notify', '0.7')
-from gi.repository import Notify
-Notify.init("celeste_timer")
-berry = os.path.join(os.path.dirname(__file__), 'Celeste.png')
-n = Notify.Notification.new('', '', berry)
-n.set_urgency(2)
-cancel_show_at = None
+
+from .ui import make_ui
+from .route_graph import GraphRoute, GraphSplitsManager
+from .rooms import load_rooms, save_rooms, format_room
+from .history import load_history, save_history
+from .comparisons import Comparisons, NAMES as COMPARISONS
+from .view import build_view, cached_stats, sum_of_best
+
+ui = None
 def notify(title, body, timeout):
-    n.update(title, body, berry)
-    n.show()
-    global cancel_show_at
-    cancel_show_at = time.time() + timeout
+    if ui is not None:
+        ui.notify(title, body, timeout)
 
 notify_level = int(os.environ.get('NOTIFY_SPLIT_LEVEL', 0))
 
-import pynput
-action_queue = []
-ctrled = shifted = False
-def should_handle_key():
-    try:
-        res = subprocess.check_output(['xdotool', 'getactivewindow', 'getwindowname']).strip().decode()
-    except subprocess.CalledProcessError:
-        return False
-    return res in ('Celeste', 'streamdisplay')
-
-def handle_key(key):
-    global ctrled, shifted
-    if key == pynput.keyboard.Key.ctrl:
-        ctrled = True
-    elif key == pynput.keyboard.Key.shift:
-        shifted = True
-    elif should_handle_key():
-        if key == pynput.keyboard.KeyCode(char='\\'):
-            action_queue.append('skip')
-        elif key == pynput.keyboard.Key.backspace:
-            if ctrled:
-                action_queue.append('reset')
-            elif shifted:
-                action_queue.append('rewind')
-
-def handle_release(key):
-    global ctrled, shifted
-    if key == pynput.keyboard.Key.ctrl:
-        ctrled = False
-    elif key == pynput.keyboard.Key.shift:
-        shifted = False
-listener = pynput.keyboard.Listener(on_press=handle_key, on_release=handle_release)
-
 class NotifSplitsManager(SplitsManager):
     def split(self, split):
         super().split(split)
+        compare = self.compare
         time_top = self.current_times[split]
-        comp_top = self.compare_pb[split]
+        comp_top = compare[split]
         try:
             time_0 = self.current_times.segment_time(split, 0)
-            comp_0 = self.compare_pb.segment_time(split, 0)
-            gold_0 = self.compare_best[(split, 0)]
+            comp_0 = compare.segment_time(split, 0)
+            gold_0 = self.compare_best.get((split, 0))
         except KeyError:
             time_0 = comp_0 = gold_0 = None
         try:
             time_1 = self.current_times.segment_time(split, 1)
-            comp_1 = self.compare_pb.segment_time(split, 1)
-            gold_1 = self.compare_best[(split, 1)]
+            comp_1 = compare.segment_time(split, 1)
+            gold_1 = self.compare_best.get((split, 1))
         except KeyError:
             time_1 = comp_1 = gold_1 = None
 
@@ -127,6 +99,9 @@ class NotifSplitsManager(SplitsManager):
         if split.level <= notify_level:
             notify('Split', out_str, 10)
 
+class NotifGraphSplitsManager(NotifSplitsManager, GraphSplitsManager):
+    pass
+
 
 def show_splits(route, splits):
     if type(route) is str:
@@ -138,38 +113,12 @@ def show_splits(route, splits):
         ttime = splits[split]
         print('%20s: %s -> %s' % (split.names[-1], '--' if stime is None else fmt_time(stime, sign=True), '--' if ttime is None else fmt_time(ttime)))
 
-def sum_of_best(splits, sob, level=0):
-    if len(splits) == 1:
-        return None
-    last_start = 0
-    best = 0
-    for i, split in enumerate(splits):
-        if split.level <= level:
-            sub_sob = sum_of_best(splits[last_start:i+1], sob, level+1)
-            last_start = i + 1
-            out_sob = sob[(split, level)]
-            if sub_sob is not None and out_sob is not None and sub_sob < out_sob:
-                out_sob = sub_sob
-            if out_sob is None:
-                return None
-            best += out_sob
-    return best
-
 
 RED = '\x1b[31m'
 GREEN = '\x1b[32m'
 GOLD = '\x1b[33m'
 NORMAL = '\x1b[0m'
 
-def pb_stats(sm, split, level):
-    if sm.compare_pb is not None:
-        pb_time = sm.compare_pb.segment_time(split, level)
-        pb_tot = sm.compare_pb[split]
-    else:
-        pb_time = None
-        pb_tot = None
-    return pb_time, pb_tot
-
 def render_column(col, width, left=True):
     curlen = len(col[0] % (('',)*(len(col)-1)))
     result = col[0] % col[1:]
@@ -183,10 +132,9 @@ def render_column(col, width, left=True):
 def render_line(cols, level, widths):
     return '  '*level + ''.join(render_column(col, width - (0 if i == 0 else 0)) for i, (col, width) in enumerate(zip(cols, widths))) + '\n'
 
-def render_current_split(sm, split, level):
-    pb_time, _ = pb_stats(sm, split, level)
-
-    cur_time = sm.current_segment_time(level)
+def render_current_split(split, level, stat):
+    pb_time = stat['ptime']
+    cur_time = stat['atime']
     if cur_time is not None:
         cur_time_str = fmt_time(cur_time, ms_decimals=1)
     else:
@@ -208,8 +156,9 @@ def render_current_split(sm, split, level):
     col_2 = ('',)
     return col_0, col_1, col_2
 
-def render_upcoming_split(sm, split, level):
-    pb_time, pb_tot = pb_stats(sm, split, level)
+def render_upcoming_split(split, level, stat):
+    pb_time = stat['ptime']
+    pb_tot = stat['pmark']
 
     if pb_time is None:
         col_1 = '--'
@@ -222,13 +171,12 @@ def render_upcoming_split(sm, split, level):
     col_0 = split.level_name(level) + ':'
     return (col_0,), (col_1,), (col_2,)
 
-def render_past_split(sm, split, level):
-    pb_time, pb_tot = pb_stats(sm, split, level)
-
-    cur_time = sm.current_times.segment_time(split, level)
-    cur_tot = sm.current_times[split]
-
-    best_time = None if sm.compare_best is None else sm.compare_best[(split, level)]
+def render_past_split(split, level, stat):
+    pb_time = stat['ptime']
+    pb_tot = stat['pmark']
+    cur_time = stat['atime']
+    cur_tot = stat['amark']
+    best_time = stat['gtime']
 
     if cur_time is None:
         seg_time_str = '--'
@@ -277,32 +225,40 @@ def render_past_split(sm, split, level):
     col_2 = (tot_time_str + '/%s' + tot_diff_str + '%s', tot_color, NORMAL)
     return col_0, col_1, col_2
 
-def render_split(sm, split, level):
-    refsplit = sm.current_split(level)
-    if refsplit == split:
-        cols = render_current_split(sm, split, level)
-    elif split in sm.current_times:
-        cols = render_past_split(sm, split, level)
-    else:
-        cols = render_upcoming_split(sm, split, level)
-    return render_line(cols, level, [35, 20, 20])
+def render_split(sm, view, split, level):
+    """
+    One row of the splits table, from the same stats as the view model's
+    """
+    if level < view.num_levels and view.splits_cur[level] is split:
+        return render_line(render_current_split(split, level, view.stats_cur[level]), level, [35, 20, 20])
 
-def format_splits(sm, termsize=True):
-    if termsize:
-        _, term_rows = os.get_terminal_size()
+    # past and upcoming rows only change when the manager reports a change
+    cache = sm.render_cache('splits_rows')
+    try:
+        return cache[(split, level)]
+    except KeyError:
+        pass
+    stat = cached_stats(sm, split, level)
+    if stat['status'] == 'present':
+        return render_line(render_current_split(split, level, stat), level, [35, 20, 20])
+    if stat['status'] == 'past':
+        cols = render_past_split(split, level, stat)
     else:
-        _, term_rows = 100000, 100000
+        cols = render_upcoming_split(split, level, stat)
+    line = cache[(split, level)] = render_line(cols, level, [35, 20, 20])
+    return line
 
+def split_rows(route):
     rows = []
     last_level = 0
-    for i, split in enumerate(sm.route.splits):
+    for i, split in enumerate(route.splits):
         if split.level > last_level:
             target_level = last_level
             while target_level < split.level:
                 j = i + 1
                 while True:
-                    if sm.route.splits[j].level == target_level:
-                        rows.append((sm.route.splits[j], target_level))
+                    if route.splits[j].level == target_level:
+                        rows.append((route.splits[j], target_level))
                         break
                     j += 1
                 target_level += 1
@@ -312,6 +268,38 @@ def format_splits(sm, termsize=True):
         else:
             rows.append((split, split.level))
         last_level = split.level
+    return rows
+
+def format_splits(sm, termsize=True, rows=None):
+    if rows is not None:
+        term_rows = rows
+    elif termsize:
+        _, term_rows = shutil.get_terminal_size()
+    else:
+        _, term_rows = 100000, 100000
+    if sm.rooms is not None:
+        term_rows -= 1
+    view = build_view(sm)
+    if view.comparison != 'pb':
+        term_rows -= 1
+
+    render_rows = visible_rows(sm, term_rows)
+    data = ''.join(render_split(sm, view, split, level) if split is not None else '\n' for split, level in render_rows)
+    if view.comparison != 'pb':
+        data = 'Comparing against %s\n' % view.comparison + data
+    if sm.rooms is not None and view.started and not view.done:
+        return data.rstrip() + '\n' + format_room(sm.rooms, view.current_time)
+    return data.rstrip()
+
+def visible_rows(sm, term_rows):
+    """
+    The (split, level) rows to show in a window of term_rows rows: the current split and the final split, then as many
+    earlier and later rows as fit. Blank padding rows are (None, None).
+    """
+    cache = sm.render_cache('splits_layout')
+    rows = cache.get('rows')
+    if rows is None:
+        rows = cache['rows'] = split_rows(sm.route)
 
     refsplit = sm.current_split(1000)
     current_idx = len(rows) - 1
@@ -336,22 +324,28 @@ def format_splits(sm, termsize=True):
         later_rows_added += 1
     while len(render_rows) < term_rows:
         render_rows.insert(-1, (None, None))
-
-
-    data = ''.join(render_split(sm, split, level) if split is not None else '\n' for split, level in render_rows)
-    return data.rstrip()
+    return render_rows
 
 def print_splits(sm, formatter):
-    print('\x1b[H\x1b[J' + formatter(sm), end='')  # move to origin; erase screen
-
-def main(route, pb=None, best=None, renderer=None):
+    data = '\x1b[H\x1b[J' + formatter(sm)  # move to origin; erase screen
+    if not getattr(sm.asi, 'connected', True):
+        data += '\n(reconnecting to %s...)' % sm.asi.filename
+    if stats.overlay:
+        data += '\n' + stats.overlay_line()
+    print(data, end='')
+    return len(data)
+
+def load_route_files(route, pb=None, best=None):
+    """
+    Load a route along with its pb and golds records. Any argument may be a filename or an already-loaded object.
+    If only a route filename is given, the records are looked up next to it as <name>.pb and <name>.best.
+    Returns the loaded route, pb, and golds, followed by the filenames the records should be saved back to.
+    """
     if pb is None and best is None and type(route) is str:
         pb = '.'.join(route.split('.')[:-1]) + '.pb'
         best = '.'.join(route.split('.')[:-1]) + '.best'
-    asi = AutoSplitterInfo()
     pb_filename = None
-    if renderer is None:
-        renderer = functools.partial(print_splits, formatter=format_splits)
+    best_filename = None
 
     if type(route) is str:
         route = open_pickle_or_yaml(route)
@@ -368,15 +362,40 @@ def main(route, pb=None, best=None, renderer=None):
         except FileNotFoundError:
             best = None
 
-    sm = NotifSplitsManager(asi, route, pb, best)
-    listener.start()
+    return route, pb, best, pb_filename, best_filename
+
+def save_route_files(sm, pb_filename, best_filename, rooms_filename=None, history_filename=None):
+    if pb_filename is not None and sm.compare_pb.get(sm.route.splits[-1]) is not None:
+        print('saving', pb_filename)
+        show_splits(sm.route, sm.compare_pb)
+        save_yaml(pb_filename, sm.compare_pb)
+    if best_filename is not None:
+        print('saving', best_filename)
+        sob = sum_of_best(sm.route.splits, sm.compare_best)
+        if sob is not None:
+            print('sum of best:', fmt_time(sob))
+        save_yaml(best_filename, sm.compare_best)
+    if sm.rooms is not None:
+        save_rooms(sm.rooms, rooms_filename)
+    if sm.history is not None:
+        save_history(sm.history, history_filename)
+
+def run(sm, renderer, headless=False):
+    """
+    Drive the given manager until interrupted. Anything with the SplitsManager update/skip/rewind/commit/reset interface works.
+    In headless mode there are no notifications or hotkeys, and nothing connects to D-Bus or X.
+    """
+    global ui
+    ui = make_ui(headless)
+    ui.start()
+    interactive = sys.stdin.isatty()
     try:
         print('\x1b[?25l')  # hide cursor
-        subprocess.check_call('stty -echo', shell=True)
+        if interactive:
+            subprocess.check_call('stty -echo', shell=True)
         while True:
             try:
-                while action_queue:
-                    action = action_queue.pop(0)
+                for action in ui.take_actions():
                     if action == 'skip':
                         old_piece = sm.current_piece
                         sm.skip()
@@ -389,33 +408,62 @@ def main(route, pb=None, best=None, renderer=None):
                         sm.commit()
                         sm.reset()
                         notify('Reset', '', 3)
-
-
-                sm.update()
-                renderer(sm)
-
-                global cancel_show_at
-                if cancel_show_at is not None and time.time() >= cancel_show_at:
-                    n.close()
-                    cancel_show_at = None
-
+                    elif action == 'comparison' and hasattr(sm, 'cycle_comparison'):
+                        notify('Comparing against %s' % sm.cycle_comparison(), '', 3)
+
+
+                if stats.enabled:
+                    update_start = time.perf_counter_ns()
+                    sm.update()
+                    render_start = time.perf_counter_ns()
+                    written = renderer(sm)
+                    render_end = time.perf_counter_ns()
+                    stats.record('update', render_start - update_start)
+                    stats.record('render', render_end - render_start)
+                    if written is not None:
+                        stats.record('render_bytes', written, 'B')
+                    stats.tick()
+                else:
+                    sm.update()
+                    renderer(sm)
+
+                ui.poll()
                 time.sleep(0.010)
             except KeyboardInterrupt:
                 sm.commit()
                 break
     finally:
-        subprocess.check_call('stty echo', shell=True)
+        ui.stop()
+        if interactive:
+            subprocess.check_call('stty echo', shell=True)
         print('\x1b[34h\x1b[?25h')  # restore cursor
-        if pb_filename is not None and len(sm.compare_pb) == len(sm.route.splits):
-            print('saving', pb_filename)
-            show_splits(sm.route, sm.compare_pb)
-            save_yaml(pb_filename, sm.compare_pb)
-        if best_filename is not None:
-            print('saving', best_filename)
-            sob = sum_of_best(sm.route.splits, sm.compare_best)
-            if sob is not None:
-                print('sum of best:', fmt_time(sob))
-            save_yaml(best_filename, sm.compare_best)
+
+def open_manager(asi, route, pb=None, best=None, comparison='pb', triggers=None):
+    """
+    Load a route with everything kept next to it and make its manager. Returns the manager and the (pb, best, rooms,
+    history) filenames to save it back to, as save_route_files(sm, *filenames).
+    """
+    route, pb, best, pb_filename, best_filename = load_route_files(route, pb, best)
+    base = None if pb_filename is None else '.'.join(pb_filename.split('.')[:-1])
+    rooms_filename = None if base is None else base + '.rooms'
+    history_filename = None if base is None else base + '.history'
+    cls = NotifGraphSplitsManager if isinstance(route, GraphRoute) else NotifSplitsManager
+    rooms = load_rooms(rooms_filename)
+    rooms.attach(asi)
+    sm = cls(asi, route, pb, best, triggers=triggers, rooms=rooms,
+             history=load_history(history_filename), comparisons=Comparisons(comparison))
+    return sm, (pb_filename, best_filename, rooms_filename, history_filename)
+
+def main(route, pb=None, best=None, renderer=None, headless=False, comparison='pb'):
+    asi = AutoSplitterInfo()
+    if renderer is None:
+        renderer = functools.partial(print_splits, formatter=format_splits)
+
+    sm, filenames = open_manager(asi, route, pb, best, comparison)
+    try:
+        run(sm, renderer, headless)
+    finally:
+        save_route_files(sm, *filenames)
 
 # finished:
 # Segment name:  1.23/+1.23  1:32.45/+1.23
@@ -430,8 +478,19 @@ def main(route, pb=None, best=None, renderer=None):
 # that's pb time and pb cum time
 
 if __name__ == '__main__':
-    import sys
-    if sys.argv == 1:
-        main('anypercent.route')
-    else:
-        main(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Track pb and gold splits for a route')
+    parser.add_argument('route', nargs='?', default='anypercent.route',
+        help='The route file. pb and gold data are kept next to it (default: anypercent.route)'
+    )
+    parser.add_argument('--headless', action='store_true',
+        help='Run without desktop notifications or hotkeys (no D-Bus or X connection)'
+    )
+    parser.add_argument('--comparison', choices=COMPARISONS, default='pb',
+        help='What to compare against at first; the comparison hotkey cycles through them (default: pb)'
+    )
+    stats.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    stats.configure(args)
+    schedule.configure(args)
+    main(args.route, headless=args.headless, comparison=args.comparison)
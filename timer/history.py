@@ -0,0 +1,65 @@
+"""
+The history of every attempt at a route, one time per segment per attempt.
+
+Segments here are the finest ones the route has: from each split to the split before it at any level, which is
+what SplitsRecord.segment_time(split, 999) gives. Skipped or unreached segments are simply not recorded, so the
+number of samples differs between segments. The history is kept next to the pb and golds as <name>.history.
+"""
+
+import array
+import yaml
+
+from .celeste_timer import open_pickle_or_yaml, save_yaml, represent_pickle
+
+class AttemptHistory:
+    def __init__(self):
+        self.segments = {}
+        self.attempts = 0
+
+    def add(self, route, times):
+        """
+        Record the segments of one attempt
+        """
+        if not len(times):
+            return
+        self.attempts += 1
+        for split in route.splits:
+            seg = times.segment_time(split, 999, None)
+            if seg is not None:
+                try:
+                    self.segments[split].append(seg)
+                except KeyError:
+                    self.segments[split] = array.array('q', [seg])
+
+    def get(self, split):
+        """
+        Every recorded time of the segment ending at split, oldest first
+        """
+        return self.segments.get(split, ())
+
+    def __getstate__(self):
+        return {
+            'version': 1,
+            'attempts': self.attempts,
+            'segments': {split: list(times) for split, times in self.segments.items()},
+        }
+
+    def __setstate__(self, state):
+        if type(state) is not dict or state.get('version', 0) != 1:
+            raise TypeError("Cannot deserialize this AttemptHistory - try updating the autosplitter")
+        self.attempts = state['attempts']
+        self.segments = {split: array.array('q', times) for split, times in state['segments'].items()}
+yaml.representer.Representer.add_representer(AttemptHistory, represent_pickle)
+
+def load_history(filename):
+    if filename is None:
+        return AttemptHistory()
+    try:
+        return open_pickle_or_yaml(filename)
+    except FileNotFoundError:
+        return AttemptHistory()
+
+def save_history(history, filename):
+    if filename is not None and history.attempts:
+        print('saving', filename)
+        save_yaml(filename, history)
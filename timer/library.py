@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+A library of routes which picks the one being played by itself.
+
+Every .route file in a directory is indexed by its reset trigger, which is also what starts it, and by its first
+trigger. The index is kept in the directory as .route_index.yaml and only the routes whose files changed since are
+parsed again, so starting up with dozens of routes doesn't load any of them.
+
+While no run is in progress, each distinct start condition in the index is checked every frame (once, however many
+routes share it). When one holds, the route it starts is loaded along with its pb, golds, rooms and history, and
+replaces the previous route, whose records are saved. If several routes' start conditions hold at once, the first of
+them whose first trigger then fires is the one loaded - loading it then loses nothing, since its run starts on that
+trigger. Only the route in use is ever in memory.
+"""
+
+import os
+import sys
+import functools
+import argparse
+
+from .celeste_timer import AutoSplitterInfo, Trigger, TriggerCache, Split, StartTimer, open_pickle_or_yaml, save_yaml
+from .temporal import TemporalTrigger
+from .full_splits import open_manager, save_route_files, print_splits, format_splits, run
+from .comparisons import NAMES as COMPARISONS
+from . import stats
+from . import schedule
+
+INDEX_FILE = '.route_index.yaml'
+INDEX_VERSION = 1
+
+def describe_trigger(trigger):
+    """
+    A trigger as index data: its expression and whether it's temporal, or None if it can't be rebuilt from those
+    """
+    if type(trigger) is Trigger:
+        return {'expr': trigger.end_trigger, 'temporal': False}
+    if type(trigger) is TemporalTrigger:
+        return {'expr': trigger.end_trigger, 'temporal': True}
+    return None
+
+def make_trigger(name, desc):
+    if desc['temporal']:
+        trigger = TemporalTrigger(name, desc['expr'])
+        trigger.arm()
+        return trigger
+    return Trigger(name, desc['expr'])
+
+def index_route(filename):
+    route = open_pickle_or_yaml(filename)
+    first = next((piece for piece in route if type(piece) not in (Split, StartTimer)), None)
+    return {
+        'name': route.name,
+        'start': describe_trigger(route.reset_trigger),
+        'first': describe_trigger(first),
+    }
+
+class RouteIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}  # filename -> {'mtime', 'size', 'name', 'start', 'first'}
+
+    @property
+    def cache_filename(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def refresh(self):
+        """
+        Bring the index up to date with the directory, parsing only new or changed routes. Returns whether anything
+        changed.
+        """
+        try:
+            cached = open_pickle_or_yaml(self.cache_filename)
+            if type(cached) is not dict or cached.get('version') != INDEX_VERSION:
+                cached = None
+        except (FileNotFoundError, TypeError):
+            cached = None
+        known = {} if cached is None else cached['routes']
+        known.update(self.entries)
+
+        entries = {}
+        changed = cached is None
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.route') or not entry.is_file():
+                continue
+            st = entry.stat()
+            old = known.get(entry.name)
+            if old is not None and old['mtime'] == st.st_mtime_ns and old['size'] == st.st_size:
+                entries[entry.name] = old
+                continue
+            try:
+                data = index_route(entry.path)
+            except Exception as e: # pylint: disable=broad-except
+                print('skipping %s: %s' % (entry.path, e))
+                continue
+            data['mtime'] = st.st_mtime_ns
+            data['size'] = st.st_size
+            entries[entry.name] = data
+            changed = True
+        changed = changed or entries.keys() != known.keys()
+        self.entries = entries
+        if changed:
+            save_yaml(self.cache_filename, {'version': INDEX_VERSION, 'routes': entries})
+        return changed
+
+    def by_start(self):
+        """
+        The routes grouped by start condition: {expression: (start description, [filenames])}. Routes which can't
+        be started automatically are left out.
+        """
+        groups = {}
+        for filename, data in sorted(self.entries.items()):
+            start = data['start']
+            if start is None:
+                continue
+            groups.setdefault(start['expr'], (start, []))[1].append(filename)
+        return groups
+
+class Library:
+    """
+    Runs whichever route of the index is being played, with the SplitsManager update/skip/rewind/commit/reset
+    interface for full_splits.run()
+    """
+    idle = Trigger('waiting for a route to start', 'False')
+
+    def __init__(self, asi, index, comparison='pb'):
+        self.asi = asi
+        self.index = index
+        self.comparison = comparison
+        self.triggers = TriggerCache(asi)
+        self.sm = None
+        self.filename = None
+        self.filenames = None
+        self.pending = None  # routes sharing the start condition which just held, until one's first trigger fires
+        self.version_base = 0
+        self.starts = []
+        for desc, filenames in index.by_start().values():
+            self.starts.append((make_trigger('start', desc), filenames))
+        self.firsts = {}
+        for filename, data in index.entries.items():
+            if data['first'] is not None:
+                self.firsts[filename] = make_trigger('first', data['first'])
+
+    @property
+    def route(self):
+        return None if self.sm is None else self.sm.route
+
+    @property
+    def current_piece(self):
+        return self.idle if self.sm is None else self.sm.current_piece
+
+    @property
+    def version(self):
+        return (self.version_base, None if self.sm is None else self.sm.version)
+
+    @property
+    def running(self):
+        return self.sm is not None and self.sm.started and not self.sm.done
+
+    def load(self, filename):
+        if filename == self.filename:
+            return
+        if self.sm is not None:
+            if len(self.sm.current_times):
+                self.sm.commit()
+            self.save()
+            self.sm.rooms.detach(self.asi)
+        self.sm, self.filenames = open_manager(self.asi, os.path.join(self.index.directory, filename),
+                                               comparison=self.comparison, triggers=self.triggers)
+        self.filename = filename
+        self.version_base += 1
+
+    def save(self):
+        if self.sm is not None:
+            save_route_files(self.sm, *self.filenames)
+
+    def select(self):
+        """
+        Look for a route starting, while none is running
+        """
+        candidates = [filename for trigger, filenames in self.starts if self.triggers.check(trigger)
+                      for filename in filenames]
+        if len(candidates) == 1:
+            self.pending = None
+            self.load(candidates[0])
+            return
+        if candidates and candidates != self.pending:
+            for filename in candidates:
+                if filename in self.firsts and (self.pending is None or filename not in self.pending):
+                    self.firsts[filename].arm()
+            self.pending = candidates
+        if self.pending is not None:
+            for filename in self.pending:
+                trigger = self.firsts.get(filename)
+                if trigger is not None and self.triggers.check(trigger):
+                    self.pending = None
+                    self.load(filename)
+                    return
+
+    def update(self):
+        self.triggers.invalidate()
+        if not self.running:
+            self.select()
+        if self.sm is not None:
+            self.sm.update()
+            if self.running:
+                self.pending = None
+
+    def skip(self, n=1):
+        if self.sm is not None:
+            self.sm.skip(n)
+
+    def rewind(self, n=1):
+        if self.sm is not None:
+            self.sm.rewind(n)
+
+    def commit(self):
+        if self.sm is not None:
+            self.sm.commit()
+
+    def reset(self):
+        if self.sm is not None:
+            self.sm.reset()
+
+    def cycle_comparison(self):
+        if self.sm is None:
+            return self.comparison
+        self.comparison = self.sm.cycle_comparison()
+        return self.comparison
+
+def format_library(library):
+    if library.sm is None:
+        return 'Waiting for one of %d routes to start' % len(library.index.entries)
+    return format_splits(library.sm)
+
+def main(directory, comparison='pb', renderer=None, headless=False):
+    if renderer is None:
+        renderer = functools.partial(print_splits, formatter=format_library)
+    index = RouteIndex(directory)
+    index.refresh()
+    library = Library(AutoSplitterInfo(), index, comparison)
+    try:
+        run(library, renderer, headless)
+    finally:
+        library.save()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time whichever route from a directory of routes is being played')
+    parser.add_argument('directory', nargs='?', default='../timer_data',
+        help='Where the route files are, with their pb and gold data next to them (default: ../timer_data)'
+    )
+    parser.add_argument('--comparison', choices=COMPARISONS, default='pb',
+        help='What to compare against at first; the comparison hotkey cycles through them (default: pb)'
+    )
+    parser.add_argument('--headless', action='store_true',
+        help='Run without desktop notifications or hotkeys (no D-Bus or X connection)'
+    )
+    stats.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    stats.configure(args)
+    schedule.configure(args)
+    main(args.directory, args.comparison, headless=args.headless)
+    sys.exit(0)
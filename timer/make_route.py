@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Build a route from a playthrough, instead of playing it live under one of the make_*_splits.py scripts.
+
+A Scanner is fed every frame of a recorded session (or of a live capture, on the reader thread) and notes each
+chapter playthrough: the rooms in the order they were first entered, the chapter time of each entry, the checkpoint
+count then, and when the chapter was completed. Restarting a chapter or leaving it unfinished drops what was seen of
+it. The route is then built from those exact transitions: a split whenever a new room is entered, grouped into
+checkpoints and chapters as levels of the route, with runs of short rooms optionally merged into one segment.
+"""
+
+import sys
+import time
+import argparse
+
+from .celeste_timer import AutoSplitterInfo, Trigger, Split, Route, asi_path, save_yaml
+from .record import ReplayInfo
+
+# from coarsest to finest
+LEVELS = ('chapters', 'checkpoints', 'rooms')
+LEVEL_NAMES = {'chapters': 'Chapter', 'checkpoints': 'Checkpoint', 'rooms': 'Room'}
+
+class Room:
+    __slots__ = ('name', 'entered', 'checkpoint')
+
+    def __init__(self, name, entered, checkpoint):
+        self.name = name
+        self.entered = entered
+        self.checkpoint = checkpoint
+
+class Play:
+    """
+    One playthrough of one chapter
+    """
+    def __init__(self, state):
+        self.chapter = state.chapter
+        self.mode = state.mode
+        self.name = state.chapter_name
+        self.file_time = state.file_time  # when it was entered
+        self.rooms = []
+        self.seen = set()
+        self.end = None  # the chapter time it was completed at
+
+    @property
+    def key(self):
+        return (self.chapter, self.mode)
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    @property
+    def ctx(self):
+        return 'asi.chapter == %d and asi.mode == %d' % (self.chapter, self.mode)
+
+    def duration(self, i):
+        """
+        How long was spent from first entering the ith room until the next room was first entered
+        """
+        end = self.rooms[i + 1].entered if i + 1 < len(self.rooms) else self.end
+        return end - self.rooms[i].entered
+
+class Scanner:
+    def __init__(self):
+        self.plays = []  # every completed play, in order
+        self.play = None
+        self.last_time = None
+
+    def feed(self, state):
+        if state.chapter == -1:
+            self.play = None
+            return
+        if self.play is None or self.play.key != (state.chapter, state.mode) or state.chapter_time < self.last_time:
+            self.play = Play(state)
+        self.last_time = state.chapter_time
+        play = self.play
+        if play.complete:
+            return
+        if state.chapter_complete:
+            if play.rooms and play.rooms[0].entered < 1000:  # not joined partway through
+                play.end = state.chapter_time
+                self.plays.append(play)
+            return
+        if state.level_name and state.level_name not in play.seen:
+            play.seen.add(state.level_name)
+            play.rooms.append(Room(state.level_name, state.chapter_time, state.chapter_checkpoints))
+
+    def scan(self, filename):
+        asi = ReplayInfo()
+        for _ in asi.frames(filename):
+            self.feed(asi)
+
+    def runs(self):
+        """
+        The completed plays split into runs, a new run beginning whenever a chapter comes up again
+        """
+        runs = []
+        keys = None
+        for play in self.plays:
+            if keys is None or play.key in keys:
+                runs.append([])
+                keys = set()
+            runs[-1].append(play)
+            keys.add(play.key)
+        return runs
+
+    def best_run(self):
+        """
+        The run covering the most chapters, the latest of them if there's a tie
+        """
+        runs = self.runs()
+        if not runs:
+            return None
+        return max(reversed(runs), key=len)
+
+def _segment_name(level, leaves, start, end):
+    play, i = leaves[start]
+    if level == 'chapters':
+        last_play = leaves[end][0]
+        return play.name if last_play is play else '%s to %s' % (play.name, last_play.name)
+    if level == 'checkpoints':
+        checkpoint = play.rooms[i].checkpoint
+        return '%s %s' % (play.name, 'start' if checkpoint == 0 else 'checkpoint %d' % checkpoint)
+    last_play, j = leaves[end]
+    first, last = play.rooms[i].name, last_play.rooms[j].name
+    return first if start == end else '%s to %s' % (first, last)
+
+def build_route(name, plays, levels=('rooms',), merge=0):
+    """
+    Make a route out of consecutive chapter plays. levels are the kinds of segment to split on, coarsest first, each
+    becoming a level of the route. Segments of the finest level shorter than merge milliseconds are joined with the
+    next one, though never across a coarser segment's end.
+    """
+    levels = sorted(set(levels), key=LEVELS.index)
+    if not levels:
+        raise ValueError("Need at least one level")
+    if not plays:
+        raise ValueError("No completed chapters to build a route from")
+    whole_file = len(plays) > 1
+
+    leaves = [(play, i) for play in plays for i in range(len(play.rooms))]
+    pieces = []
+    starts = [0] * len(levels)  # the first leaf of the current segment at each level
+    elapsed = 0
+    for n, (play, i) in enumerate(leaves):
+        elapsed += play.duration(i)
+        if i + 1 == len(play.rooms):
+            boundary = LEVELS.index('chapters')
+            triggers = [Trigger('finish %s' % play.name, 'asi.chapter_complete and %s' % play.ctx)]
+            if whole_file:
+                triggers.append(Trigger('exit chapter', 'asi.chapter == -1'))
+        else:
+            nxt = play.rooms[i + 1]
+            boundary = LEVELS.index('checkpoints') if nxt.checkpoint > play.rooms[i].checkpoint else LEVELS.index('rooms')
+            triggers = [Trigger('enter %s' % nxt.name, 'asi.level_name == "%s" and %s' % (nxt.name, play.ctx))]
+
+        # the coarsest chosen level which ends a segment here
+        level = next((k for k, kind in enumerate(levels) if LEVELS.index(kind) >= boundary), None)
+        if level is None:
+            continue
+        if level == len(levels) - 1 and boundary != 0 and elapsed < merge:
+            continue
+        pieces.extend(triggers)
+        pieces.append(Split([_segment_name(levels[k], leaves, starts[k], n) for k in range(level, len(levels))], level))
+        for k in range(level, len(levels)):
+            starts[k] = n + 1
+        elapsed = 0
+
+    first = plays[0]
+    if whole_file:
+        if first.chapter == 0 and first.file_time < 1000:
+            start_trigger = Trigger('start', 'asi.chapter == 0 and 0 < asi.file_time < 1000')
+        else:
+            start_trigger = Trigger('start', '%s and asi.chapter_time < 1000' % first.ctx)
+        time_field = 'file_time'
+    else:
+        start_trigger = Trigger('start', '%s and asi.chapter_time < 1000' % first.ctx)
+        time_field = 'chapter_time'
+    level_names = [LEVEL_NAMES[kind] for kind in levels]
+    if merge and levels[-1] == 'rooms':
+        level_names[-1] = 'Segment'
+    return Route(name, time_field, pieces, level_names, start_trigger)
+
+def capture(dump):
+    """
+    Scan the game live until ctrl-c
+    """
+    scanner = Scanner()
+    asi = AutoSplitterInfo(dump)
+    asi.listeners.append(scanner.feed)
+    print('capturing - play through the chapters and press ctrl-c when done')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    asi.listeners.remove(scanner.feed)
+    time.sleep(0.1)  # let a frame in progress finish
+    return scanner
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a route from a recorded session or a live playthrough')
+    parser.add_argument('sessions', nargs='*', help='Session files recorded with record.py, in the order they were played')
+    parser.add_argument('--live', action='store_true', help='Capture a playthrough from the game instead')
+    parser.add_argument('--dump', default=asi_path, help='The autosplitterinfo file path (default: %s)' % asi_path)
+    parser.add_argument('--name', required=True, help='The route name')
+    parser.add_argument('--output', help='Where to save the route (default: ../timer_data/<name>.route)')
+    parser.add_argument('--levels', type=lambda s: s.split(','), default=['rooms'],
+        help='Comma-separated segment kinds to split on, one route level each: any of %s (default: rooms)' % ', '.join(LEVELS)
+    )
+    parser.add_argument('--merge', type=float, default=0,
+        help='Merge rooms into segments of at least this many seconds (default: no merging)'
+    )
+    parser.add_argument('--each', action='store_true',
+        help='Save a separate route for every chapter, e.g. room splits for every IL at once'
+    )
+    args = parser.parse_args()
+
+    for kind in args.levels:
+        if kind not in LEVELS:
+            parser.error('unknown level %s' % kind)
+    if args.live == bool(args.sessions):
+        parser.error('give either session files or --live')
+
+    if args.live:
+        scanner = capture(args.dump)
+    else:
+        scanner = Scanner()
+        for filename in args.sessions:
+            scanner.scan(filename)
+
+    output = args.output or '../timer_data/%s.route' % args.name
+    if args.each:
+        latest = {}
+        for play in scanner.plays:
+            latest[play.key] = play
+        routes = [(build_route('%s %s' % (args.name, play.name), [play], args.levels, args.merge * 1000),
+                   '%s-%s.route' % (output[:-len('.route')] if output.endswith('.route') else output, play.name))
+                  for play in latest.values()]
+    else:
+        run = scanner.best_run()
+        routes = [(build_route(args.name, run or [], args.levels, args.merge * 1000), output)]
+
+    for route, filepath in routes:
+        save_yaml(filepath, route)
+        print('saved %s (%d splits) to %s' % (route.name, len(route.splits), filepath))
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except ValueError as e:
+        sys.exit(str(e))
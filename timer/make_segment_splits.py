@@ -14,7 +14,7 @@ while not asi.chapter_complete:
     if asi.chapter_complete:
         trigger = Trigger('done', 'asi.chapter_complete and %s' % ctx)
     else:
-        trigger = Trigger('room %s', 'asi.level_name == "%s" and %s' % (asi.level_name, ctx))
+        trigger = Trigger('room %s' % asi.level_name, 'asi.level_name == "%s" and %s' % (asi.level_name, ctx))
     pieces.append(trigger)
     pieces.append(Split(seg_name))
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import shutil
+import argparse
+import functools
+
+from .celeste_timer import AutoSplitterInfo, SplitsManager, TriggerCache, fmt_time
+from .full_splits import NotifSplitsManager, load_route_files, save_route_files, run, print_splits, format_splits
+from . import stats
+from . import schedule
+
+class MultiSplitsManager:
+    """
+    Hosts several SplitsManagers over a single AutoSplitterInfo, e.g. a full-game route alongside per-chapter IL
+    routes. Trigger expressions shared between routes are evaluated once per frame.
+
+    The first route added is the primary one - skip and rewind apply only to it, while commit and reset apply to all.
+    """
+    def __init__(self, asi):
+        self.asi = asi
+        self.triggers = TriggerCache(asi)
+        self.managers = []
+
+    def add(self, route, compare_pb=None, compare_best=None, cls=SplitsManager):
+        sm = cls(self.asi, route, compare_pb, compare_best, triggers=self.triggers)
+        self.managers.append(sm)
+        return sm
+
+    @property
+    def primary(self):
+        return self.managers[0]
+
+    @property
+    def current_piece(self):
+        return self.primary.current_piece
+
+    def skip(self, n=1):
+        self.primary.skip(n)
+
+    def rewind(self, n=1):
+        self.triggers.invalidate()
+        self.primary.rewind(n)
+
+    def commit(self):
+        for sm in self.managers:
+            sm.commit()
+
+    def reset(self):
+        for sm in self.managers:
+            sm.reset()
+
+    def update(self):
+        self.triggers.invalidate()
+        for sm in self.managers:
+            sm.update()
+
+def format_secondary(sm):
+    if not sm.started:
+        status = 'waiting'
+    elif sm.done:
+        final = sm.route.splits[-1]
+        cur_tot = sm.current_times.get(final)
+        pb_tot = sm.compare_pb.get(final)
+        if cur_tot is None:
+            status = 'done'
+        elif pb_tot is None:
+            status = 'done in %s' % fmt_time(cur_tot, ms_decimals=1)
+        else:
+            status = 'done in %s (%s)' % (fmt_time(cur_tot, ms_decimals=1), fmt_time(cur_tot - pb_tot, ms_decimals=1, sign=True))
+    else:
+        split = sm.current_split()
+        seg_time = sm.current_segment_time()
+        status = '%s %s' % (split.level_name(split.level), '--' if seg_time is None else fmt_time(seg_time, ms_decimals=1))
+    return '%s: %s' % (sm.route.name, status)
+
+def format_multi(msm, termsize=True):
+    lines = [format_secondary(sm) for sm in msm.managers[1:]]
+    if termsize:
+        _, term_rows = shutil.get_terminal_size()
+    else:
+        term_rows = 100000
+    rows = max(1, term_rows - len(lines) - 1)
+    return format_splits(msm.primary, rows=rows) + '\n\n' + '\n'.join(lines)
+
+def main(routes, renderer=None, headless=False):
+    asi = AutoSplitterInfo()
+    if renderer is None:
+        renderer = functools.partial(print_splits, formatter=format_multi)
+
+    msm = MultiSplitsManager(asi)
+    filenames = []
+    for route in routes:
+        route, pb, best, pb_filename, best_filename = load_route_files(route)
+        msm.add(route, pb, best, cls=NotifSplitsManager if not msm.managers else SplitsManager)
+        filenames.append((pb_filename, best_filename))
+
+    try:
+        run(msm, renderer, headless)
+    finally:
+        for sm, (pb_filename, best_filename) in zip(msm.managers, filenames):
+            save_route_files(sm, pb_filename, best_filename)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time several routes at once from one autosplitter stream')
+    parser.add_argument('routes', nargs='+',
+        help='The route files. The first is the primary route, which is displayed in full and receives hotkeys'
+    )
+    parser.add_argument('--headless', action='store_true',
+        help='Run without desktop notifications or hotkeys (no D-Bus or X connection)'
+    )
+    stats.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    stats.configure(args)
+    schedule.configure(args)
+    main(args.routes, headless=args.headless)
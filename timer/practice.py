@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Segment practice: time one segment of a route over and over.
+
+The segment ending at a split starts when the previous split is made, i.e. when the trigger before the previous split
+fires (or the route's reset trigger, for the first split), and ends when the triggers up to the split have fired in
+order. Practice arms itself whenever the start trigger fires, so re-entering the room or loading a savestate begins
+a new attempt. An attempt fails on a death, or on a reset: the route's reset trigger or the time going backwards
+(restarting the chapter). Going back to the menu is not a reset by itself, since routes commonly finish a chapter's
+segment on returning to the map. After a failure the next attempt begins as soon as the start trigger holds, e.g. on respawning
+in the room; after a success or picking a segment, the start trigger has to stop and start holding again first.
+
+Every attempt of every segment is appended to a log next to the route as <name>.practice: a short header followed by
+fixed-size entries, so a log of many thousands of attempts loads with a single read. The statistics shown are kept
+incrementally, each attempt costing the same no matter how many came before.
+"""
+
+import sys
+import time
+import struct
+import argparse
+import functools
+import collections
+
+from .celeste_timer import AutoSplitterInfo, Split, StartTimer, TriggerCache, fmt_time, open_pickle_or_yaml
+from .full_splits import run, print_splits
+from . import stats
+from . import schedule
+
+SUCCESS = 0
+DEATH = 1
+RESET = 2
+RESULT_NAMES = {SUCCESS: 'done', DEATH: 'death', RESET: 'reset'}
+
+MAGIC = b'CMTPRA\x01\n'
+# wall clock ms, split identity, result, time (the segment time, or how long the attempt lasted)
+_entry = struct.Struct('<qQbq')
+
+class PracticeLog:
+    def __init__(self, filename):
+        self.filename = filename
+        self.fp = None
+
+    def read(self):
+        """
+        Every (timestamp, identity, result, time) entry in the log, oldest first
+        """
+        try:
+            with open(self.filename, 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return []
+        if not data.startswith(MAGIC):
+            raise TypeError("%s is not a practice log" % self.filename)
+        end = len(MAGIC) + (len(data) - len(MAGIC)) // _entry.size * _entry.size  # drop an entry cut off by a crash
+        return list(_entry.iter_unpack(memoryview(data)[len(MAGIC):end]))
+
+    def append(self, identity, result, time_ms):
+        if self.fp is None:
+            self.fp = open(self.filename, 'ab')
+            if self.fp.tell() == 0:
+                self.fp.write(MAGIC)
+        self.fp.write(_entry.pack(int(time.time() * 1000), identity, result, time_ms))
+        self.fp.flush()
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+class SegmentStats:
+    """
+    Running statistics over one segment's attempts, overall and over the last `window` of them
+    """
+    def __init__(self, window=10):
+        self.attempts = 0
+        self.successes = 0
+        self.best = None
+        self.streak = 0
+        self.last = None
+        self.recent = collections.deque(maxlen=window)
+        self.recent_successes = 0
+        self.recent_total = 0
+
+    def add(self, result, time_ms):
+        if len(self.recent) == self.recent.maxlen:
+            old_result, old_time = self.recent[0]
+            if old_result == SUCCESS:
+                self.recent_successes -= 1
+                self.recent_total -= old_time
+        self.recent.append((result, time_ms))
+        self.attempts += 1
+        self.last = (result, time_ms)
+        if result == SUCCESS:
+            self.successes += 1
+            self.recent_successes += 1
+            self.recent_total += time_ms
+            self.streak += 1
+            if self.best is None or time_ms < self.best:
+                self.best = time_ms
+        else:
+            self.streak = 0
+
+    @property
+    def recent_average(self):
+        if not self.recent_successes:
+            return None
+        return self.recent_total // self.recent_successes
+
+def segment_triggers(route, split):
+    """
+    The trigger which starts the segment ending at split, and the triggers which finish it, in order
+    """
+    pieces = list(route)
+    end = pieces.index(split)
+    prev = None
+    for i in range(end - 1, -1, -1):
+        if type(pieces[i]) is Split:
+            prev = i
+            break
+    if prev is None:
+        start = route.reset_trigger
+        body = pieces[:end]
+    else:
+        start = None
+        for piece in reversed(pieces[:prev]):
+            if type(piece) not in (Split, StartTimer):
+                start = piece
+                break
+        body = pieces[prev + 1:end]
+    if start is None:
+        raise ValueError("Nothing starts the segment ending at %s" % split.names[0])
+    return start, [piece for piece in body if type(piece) not in (Split, StartTimer)]
+
+class SegmentPractice:
+    """
+    Times attempts at one segment of a route. Offers the SplitsManager update/skip/rewind/commit/reset interface for
+    full_splits.run(): skip and rewind move to the next or previous segment, and reset abandons the current attempt.
+    """
+    def __init__(self, asi, route, split, log=None, window=10, allow_deaths=False):
+        self.asi = asi
+        self.route = route
+        self.log = log
+        self.window = window
+        self.allow_deaths = allow_deaths
+        self.triggers = TriggerCache(asi)
+        self.stats = {}
+        self.version = 0
+        self.last_time = None
+        if log is not None:
+            for _, identity, result, time_ms in log.read():
+                self.segment_stats(identity).add(result, time_ms)
+        self.select(split)
+
+    def segment_stats(self, identity):
+        try:
+            return self.stats[identity]
+        except KeyError:
+            stat = self.stats[identity] = SegmentStats(self.window)
+            return stat
+
+    def select(self, split):
+        self.split = split
+        self.start_trigger, self.body = segment_triggers(self.route, split)
+        self.current = self.segment_stats(split.identity)
+        self.wait(need_edge=True)
+
+    def wait(self, need_edge=False):
+        self.attempt_start = None
+        self.need_edge = need_edge  # only begin once the start trigger has been false
+        self.start_trigger.arm()
+        self.version += 1
+
+    def begin(self, now):
+        self.attempt_start = now
+        self.deaths = self.asi.death_count
+        self.body_idx = 0
+        if self.body:
+            self.body[0].arm()
+
+    def finish(self, result, now):
+        time_ms = now - self.attempt_start
+        if result != RESET or time_ms > 0:
+            self.current.add(result, time_ms)
+            if self.log is not None:
+                self.log.append(self.split.identity, result, time_ms)
+        self.wait(need_edge=result == SUCCESS)
+
+    @property
+    def running(self):
+        return self.attempt_start is not None
+
+    @property
+    def current_time(self):
+        return self.asi[self.route.time_field] - self.attempt_start
+
+    @property
+    def current_piece(self):
+        if self.running and self.body_idx < len(self.body):
+            return self.body[self.body_idx]
+        return self.start_trigger
+
+    def check_trigger(self, trigger):
+        return self.triggers.check(trigger)
+
+    def update(self):
+        self.triggers.invalidate()
+        now = self.asi[self.route.time_field]
+        # the first segment starts with the reset trigger, so there only going back in time counts
+        reset = self.route.reset_trigger is not None and self.route.reset_trigger is not self.start_trigger \
+            and self.check_trigger(self.route.reset_trigger)
+        went_back = self.last_time is not None and now < self.last_time
+
+        if self.running:
+            if reset or went_back:
+                self.finish(RESET, self.last_time)
+            elif not self.allow_deaths and self.asi.death_count > self.deaths:
+                self.finish(DEATH, now)
+            else:
+                while self.body_idx < len(self.body) and self.check_trigger(self.body[self.body_idx]):
+                    self.body_idx += 1
+                    if self.body_idx < len(self.body):
+                        self.body[self.body_idx].arm()
+                if self.body_idx == len(self.body):
+                    self.finish(SUCCESS, now)
+        if not self.running:
+            if not self.check_trigger(self.start_trigger):
+                self.need_edge = False
+            elif not self.need_edge:
+                self.begin(now)
+        self.last_time = now
+
+    def move(self, n):
+        idx = self.route.splits.index(self.split)
+        while 0 <= idx + n < len(self.route.splits):
+            idx += n
+            try:
+                self.select(self.route.splits[idx])
+                return
+            except ValueError:
+                continue
+
+    def skip(self, n=1):
+        self.move(n)
+
+    def rewind(self, n=1):
+        self.move(-n)
+
+    def commit(self):
+        pass
+
+    def reset(self):
+        if self.running:
+            self.finish(RESET, self.asi[self.route.time_field])
+
+def format_result(result, time_ms):
+    if result == SUCCESS:
+        return fmt_time(time_ms, ms_decimals=2)
+    return '%s at %s' % (RESULT_NAMES[result], fmt_time(time_ms, ms_decimals=1))
+
+def format_practice(p):
+    stat = p.current
+    name = ' / '.join([p.route.name, p.split.names[0]])
+    lines = ['Practicing %s' % name]
+    if p.running:
+        lines.append('  %s' % fmt_time(p.current_time, ms_decimals=2))
+    else:
+        lines.append('  waiting for %s' % p.start_trigger.name)
+    lines.append('')
+    if stat.last is not None:
+        lines.append('Last:     %s' % format_result(*stat.last))
+    lines.append('Best:     %s' % ('--' if stat.best is None else fmt_time(stat.best, ms_decimals=2)))
+    if stat.attempts:
+        lines.append('Success:  %d/%d (%d%%)' % (stat.successes, stat.attempts, 100 * stat.successes // stat.attempts))
+        average = stat.recent_average
+        lines.append('Last %d:  %d/%d, average %s' % (stat.recent.maxlen, stat.recent_successes, len(stat.recent),
+                                                      '--' if average is None else fmt_time(average, ms_decimals=2)))
+        lines.append('Streak:   %d' % stat.streak)
+        lines.append('          ' + ' '.join('o' if result == SUCCESS else 'x' for result, _ in stat.recent))
+    return '\n'.join(lines)
+
+def find_split(route, name):
+    for split in route.splits:
+        if name in split.names:
+            return split
+    try:
+        return route.splits[int(name)]
+    except (ValueError, IndexError):
+        raise ValueError("No split named %s in %s" % (name, route.name)) from None
+
+def main(route_filename, segment=None, window=10, allow_deaths=False, renderer=None, headless=False):
+    route = open_pickle_or_yaml(route_filename)
+    split = route.splits[0] if segment is None else find_split(route, segment)
+    log = PracticeLog('.'.join(route_filename.split('.')[:-1]) + '.practice')
+    if renderer is None:
+        renderer = functools.partial(print_splits, formatter=format_practice)
+
+    p = SegmentPractice(AutoSplitterInfo(), route, split, log, window, allow_deaths)
+    try:
+        run(p, renderer, headless)
+    finally:
+        log.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Practice one segment of a route over and over')
+    parser.add_argument('route', help='The route file. Attempts are logged next to it')
+    parser.add_argument('segment', nargs='?',
+        help='The name or index of the split which ends the segment (default: the first). Skip and rewind change it'
+    )
+    parser.add_argument('--window', type=int, default=10, help='How many recent attempts to summarize (default: 10)')
+    parser.add_argument('--allow-deaths', action='store_true', help="Don't count dying as failing the attempt")
+    parser.add_argument('--headless', action='store_true',
+        help='Run without desktop notifications or hotkeys (no D-Bus or X connection)'
+    )
+    stats.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    stats.configure(args)
+    schedule.configure(args)
+    try:
+        main(args.route, args.segment, args.window, args.allow_deaths, headless=args.headless)
+    except ValueError as e:
+        sys.exit(str(e))
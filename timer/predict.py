@@ -0,0 +1,117 @@
+"""
+Live finish time prediction by Monte Carlo simulation over the attempt history.
+
+Each time the run splits (or is otherwise changed), the predictor takes a snapshot of where the run is and hands it to
+a background thread. That thread simulates the rest of the run in batches: every remaining segment's time is drawn
+from that segment's history, with the segment in progress only drawing from times longer than what has already been
+spent on it. Batches continue until a compute budget or sample cap is reached, or the run splits again. The display
+thread only ever reads the latest finished result, so prediction never holds up split detection.
+"""
+
+import time
+import threading
+
+import numpy
+
+from . import stats
+
+class Prediction:
+    def __init__(self, finals, pb):
+        self.samples = len(finals)
+        self.p10, self.median, self.p90 = (int(x) for x in numpy.percentile(finals, [10, 50, 90]))
+        self.pb_probability = float(numpy.mean(finals < pb)) if pb is not None else None
+
+class _Job:
+    """
+    Everything a simulation needs, copied out of the SplitsManager so the worker never touches it
+    """
+    def __init__(self, sm):
+        self.pb = sm.compare_pb.get(sm.route.splits[-1])
+        self.base = None
+        if sm.done or not sm.started or sm.history is None:
+            return
+        current = sm.current_split(1000)
+        elapsed = sm.current_segment_time(1000)
+        if elapsed is None:
+            elapsed = 0
+        idx = sm.route.splits.index(current)
+
+        pools = []
+        for i, split in enumerate(sm.route.splits[idx:]):
+            pool = numpy.asarray(sm.history.get(split), dtype=numpy.int64)
+            if i == 0:
+                pool = pool[pool >= elapsed]
+            if not len(pool):
+                fallback = sm.compare_pb.segment_time(split, 999, None)
+                if fallback is None:
+                    return
+                pool = numpy.array([max(fallback, elapsed if i == 0 else 0)], dtype=numpy.int64)
+            pools.append(pool)
+        self.base = sm.current_time - elapsed
+        self.pools = pools
+
+    def sample(self, rng, n):
+        total = numpy.full(n, self.base, dtype=numpy.int64)
+        for pool in self.pools:
+            total += pool[rng.integers(0, len(pool), n)]
+        return total
+
+class Predictor:
+    def __init__(self, budget=0.05, batch=4096, max_samples=200000, seed=None):
+        self.budget = budget            # seconds of compute per split
+        self.batch = batch
+        self.max_samples = max_samples
+        self.rng = numpy.random.default_rng(seed)
+        self.key = None
+        self.job = None
+        self.result = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, sm):
+        """
+        The latest prediction for the manager's run, or None if there isn't one (yet). Cheap enough to call every frame.
+        """
+        key = (id(sm), sm.version)
+        if key != self.key:
+            self.key = key
+            job = _Job(sm)
+            with self.lock:
+                self.job = job
+                self.result = None
+            self.wake.set()
+        return self.result
+
+    def worker(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            with self.lock:
+                job = self.job
+            if job is None or job.base is None:
+                continue
+            try:
+                self.simulate(job)
+            except Exception: # pylint: disable=broad-except
+                # a bad job mustn't end the thread, and the terminal is the display so there's nowhere to print it
+                if stats.enabled:
+                    stats.count('prediction_errors')
+
+    def simulate(self, job):
+        deadline = time.perf_counter() + self.budget
+        batches = []
+        samples = 0
+        while samples < self.max_samples and self.job is job:
+            batches.append(job.sample(self.rng, self.batch))
+            samples += self.batch
+            if time.perf_counter() >= deadline:
+                break
+        if not batches:
+            return  # replaced by a newer job before it started
+        result = Prediction(numpy.concatenate(batches), job.pb)
+        with self.lock:
+            if self.job is job:
+                self.result = result
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Local races: several game instances, each with its own tracer and autosplitterinfo file, timed against one route.
+
+Every runner gets a SplitsManager and a copy of the route of their own, and a single ReaderGroup thread reads all of
+the files, so adding a runner adds one small read per tick and decoding only when their game changed. The display is one table of the
+route's splits with a column per runner: whoever reached a split first shows their time there and everyone else
+their delta to it, counting up live for runners still on their way once they fall behind.
+
+The first runner is the local player. Hotkey skips and rewinds apply to them, and only their pb and golds are saved;
+the others compare against copies of the same records. Resets apply to everyone.
+"""
+
+import copy
+import shutil
+import argparse
+import functools
+
+from .celeste_timer import AutoSplitterInfo, ReaderGroup, SplitsManager, TriggerCache, fmt_time
+from .full_splits import NotifSplitsManager, load_route_files, save_route_files, run, print_splits, visible_rows
+from . import stats
+from . import schedule
+
+class Runner:
+    def __init__(self, name, asi, sm):
+        self.name = name
+        self.asi = asi
+        self.sm = sm
+
+class Race:
+    """
+    Drives one SplitsManager per runner with the SplitsManager update/skip/rewind/commit/reset interface, so
+    full_splits.run() can run a race like a single route
+    """
+    def __init__(self, route):
+        self.route = route
+        self.runners = []
+        self.group = None
+        self.cells = {}
+        self.cells_version = None
+
+    def add(self, name, asi, compare_pb=None, compare_best=None, cls=SplitsManager):
+        # temporal triggers keep state between frames, so every runner past the first waits on copies of them. The
+        # copied splits are equal to the route's, which is what the records and the display look them up by.
+        route = self.route if not self.runners else copy.deepcopy(self.route)
+        sm = cls(asi, route, compare_pb, compare_best, triggers=TriggerCache(asi))
+        self.runners.append(Runner(name, asi, sm))
+        return sm
+
+    def start(self):
+        self.group = ReaderGroup([runner.asi for runner in self.runners])
+
+    @property
+    def primary(self):
+        return self.runners[0].sm
+
+    @property
+    def asi(self):
+        return self.primary.asi
+
+    @property
+    def current_piece(self):
+        return self.primary.current_piece
+
+    def skip(self, n=1):
+        self.primary.skip(n)
+
+    def rewind(self, n=1):
+        self.primary.triggers.invalidate()
+        self.primary.rewind(n)
+
+    def commit(self):
+        for runner in self.runners:
+            runner.sm.commit()
+
+    def reset(self):
+        for runner in self.runners:
+            runner.sm.reset()
+
+    def update(self):
+        for runner in self.runners:
+            runner.sm.triggers.invalidate()
+            runner.sm.update()
+
+    @property
+    def version(self):
+        return tuple(runner.sm.version for runner in self.runners)
+
+    def leader(self):
+        """
+        The manager furthest along the route
+        """
+        def progress(sm):
+            if sm.done:
+                return len(self.route.splits)
+            return self.route.splits.index(sm.current_split(1000))
+        return max((runner.sm for runner in self.runners), key=progress)
+
+    def split_cells(self, split):
+        """
+        The recorded cells of a split's row: the first runner there gets their time, the rest their delta to it.
+        Runners who haven't reached it get None. Returns the cells and the first time, if anyone has one. These only
+        change when someone's times do, so they're kept until then.
+        """
+        version = self.version
+        if version != self.cells_version:
+            self.cells_version = version
+            self.cells = {}
+        try:
+            return self.cells[split]
+        except KeyError:
+            pass
+
+        times = [runner.sm.current_times.get(split) for runner in self.runners]
+        reached = [t for t in times if t is not None]
+        if not reached:
+            result = self.cells[split] = [None] * len(times), None
+            return result
+        first = min(reached)
+        cells = []
+        for t in times:
+            if t is None:
+                cells.append(None)
+            elif t == first:
+                cells.append(fmt_time(t, ms_decimals=1))
+            else:
+                cells.append(fmt_time(t - first, ms_decimals=1, sign=True))
+        result = self.cells[split] = cells, first
+        return result
+
+def format_race(race, termsize=True, width=12):
+    if termsize:
+        cols, term_rows = shutil.get_terminal_size()
+    else:
+        cols, term_rows = 100000, 100000
+    name_width = max(20, min(35, cols - width * len(race.runners)))
+    rows = max(1, term_rows - len(race.runners) - 3)
+
+    lines = [race.route.name[:name_width].ljust(name_width) + ''.join(r.name[:width - 1].rjust(width) for r in race.runners)]
+    for split, level in visible_rows(race.leader(), rows):
+        if split is None:
+            lines.append('')
+            continue
+        cells, first = race.split_cells(split)
+        cells = list(cells)
+        if first is not None:
+            # live deltas for whoever is still on their way to this split, once they're behind
+            for i, runner in enumerate(race.runners):
+                sm = runner.sm
+                if cells[i] is None and sm.started and not sm.done and sm.current_split(level) == split \
+                        and sm.current_time > first:
+                    cells[i] = fmt_time(sm.current_time - first, ms_decimals=1, sign=True)
+        name = ('  ' * level + split.level_name(level))[:name_width]
+        lines.append(name.ljust(name_width) + ''.join((cell or '').rjust(width) for cell in cells))
+
+    lines.append('')
+    for runner in race.runners:
+        sm = runner.sm
+        if not runner.asi.connected:
+            status = '(reconnecting to %s...)' % runner.asi.filename
+        elif not sm.started:
+            status = 'waiting'
+        elif sm.done:
+            final = sm.current_times.get(race.route.splits[-1])
+            status = 'done' if final is None else 'done in %s' % fmt_time(final, ms_decimals=1)
+        else:
+            split = sm.current_split()
+            status = '%s %s' % (fmt_time(sm.current_time, ms_decimals=1), split.level_name(split.level))
+        lines.append('%s: %s' % (runner.name, status))
+    return '\n'.join(lines)
+
+def main(route, dumps, names=None, renderer=None, headless=False):
+    if names is None:
+        names = []
+    names = list(names) + ['runner %d' % (i + 1) for i in range(len(names), len(dumps))]
+    if renderer is None:
+        renderer = functools.partial(print_splits, formatter=format_race)
+
+    route, pb, best, pb_filename, best_filename = load_route_files(route)
+    race = Race(route)
+    for i, (name, dump) in enumerate(zip(names, dumps)):
+        asi = AutoSplitterInfo(dump, thread=False)
+        if i == 0:
+            race.add(name, asi, pb, best, cls=NotifSplitsManager)
+        else:
+            race.add(name, asi, copy.deepcopy(pb), copy.deepcopy(best))
+    race.start()
+
+    try:
+        run(race, renderer, headless)
+    finally:
+        save_route_files(race.primary, pb_filename, best_filename)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Race several local game instances on one route')
+    parser.add_argument('route', help='The route file. pb and gold data for the first runner are kept next to it')
+    parser.add_argument('dumps', nargs='+', help="Each runner's autosplitterinfo file")
+    parser.add_argument('--names', type=lambda s: s.split(','), help='Comma-separated runner names, in the same order')
+    parser.add_argument('--headless', action='store_true',
+        help='Run without desktop notifications or hotkeys (no D-Bus or X connection)'
+    )
+    stats.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    stats.configure(args)
+    schedule.configure(args)
+    main(args.route, args.dumps, args.names, headless=args.headless)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Recording and replaying autosplitter sessions.
+
+A session file is a short header followed by one entry per changed frame: a little-endian (int64 monotonic
+nanoseconds, uint16 length) pair and then the raw DumpInfo bytes exactly as the tracer wrote them. Frames which
+didn't change are not stored, so a multi-hour session stays small.
+"""
+
+import sys
+import time
+import struct
+import argparse
+
+from .celeste_timer import AutoSplitterInfo, GameState, asi_path
+from . import schedule
+
+MAGIC = b'CMTREC\x01\n'
+_entry = struct.Struct('<qH')
+
+class Recorder:
+    def __init__(self, filename):
+        self.fp = open(filename, 'wb')
+        self.fp.write(MAGIC)
+
+    def write(self, timestamp, dat):
+        self.fp.write(_entry.pack(timestamp, len(dat)))
+        self.fp.write(dat)
+
+    def close(self):
+        self.fp.close()
+
+def read_session(filename):
+    """
+    Yield (timestamp_ns, raw frame) for every frame in a session file
+    """
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    if not data.startswith(MAGIC):
+        raise TypeError("%s is not a recorded session" % filename)
+    offset = len(MAGIC)
+    end = len(data)
+    while offset + _entry.size <= end:
+        timestamp, length = _entry.unpack_from(data, offset)
+        offset += _entry.size
+        if offset + length > end:
+            break  # truncated by a crash mid-write
+        yield timestamp, data[offset:offset + length]
+        offset += length
+
+class ReplayInfo(GameState):
+    """
+    A GameState which is fed frames from a recording instead of a live tracer
+    """
+    def __init__(self):
+        super().__init__()
+        self.connected = True
+        self.timestamp = 0
+        self.frame_time = None
+
+    def frames(self, filename):
+        """
+        Step through a session, yielding once each frame has been decoded into self
+        """
+        for timestamp, dat in read_session(filename):
+            self.timestamp = timestamp
+            self.decode(dat)
+            yield self
+
+def main():
+    parser = argparse.ArgumentParser(description='Record the autosplitter info stream to a session file')
+    parser.add_argument('output', help='The session file to write')
+    parser.add_argument('--dump', type=str, default=asi_path,
+        help='The autosplitterinfo file path (default: %s)' % asi_path
+    )
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    schedule.configure(args)
+
+    recorder = Recorder(args.output)
+    asi = AutoSplitterInfo(args.dump, recorder=recorder)
+    print('recording to', args.output, '- press ctrl-c to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        asi.recorder = None
+        recorder.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Re-time recorded sessions against a route, e.g. after adding subsplits with edit_splits.py.
+
+Each session is replayed through a SplitsManager as fast as the frames can be decoded, one worker process per core.
+Every attempt becomes a SplitsRecord, and the pb and golds are rebuilt from them with the same rules as a live run.
+"""
+
+import os
+import sys
+import argparse
+import multiprocessing
+
+from .celeste_timer import SplitsManager, open_pickle_or_yaml, save_yaml, fmt_time
+from .record import ReplayInfo
+from .full_splits import show_splits, sum_of_best
+
+class RetimeSplitsManager(SplitsManager):
+    """
+    Collects every attempt instead of comparing it against the pb
+    """
+    def __init__(self, asi, route):
+        super().__init__(asi, route)
+        self.attempts = []
+
+    def commit(self):
+        if len(self.current_times):
+            self.attempts.append(self.current_times)
+
+def retime_session(route, filename):
+    asi = ReplayInfo()
+    sm = RetimeSplitsManager(asi, route)
+    for _ in asi.frames(filename):
+        sm.update()
+    sm.commit()
+    return sm.attempts
+
+_worker_route = None
+def _init_worker(route):
+    global _worker_route
+    _worker_route = route
+
+def _retime_worker(filename):
+    return filename, retime_session(_worker_route, filename)
+
+def retime_sessions(route, filenames, jobs=None):
+    """
+    Replay every session in parallel. Returns the attempts from all of them, in the order the sessions were given.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(filenames)))
+    if jobs == 1:
+        results = dict((filename, retime_session(route, filename)) for filename in filenames)
+    else:
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(route,)) as pool:
+            results = dict(pool.imap_unordered(_retime_worker, filenames))
+    return [attempt for filename in filenames for attempt in results[filename]]
+
+def rebuild_records(route, attempts, compare_pb=None, compare_best=None):
+    """
+    Fold attempts into a pb and golds, optionally starting from existing ones
+    """
+    sm = SplitsManager(None, route, compare_pb, compare_best)
+    for attempt in attempts:
+        sm.current_times = attempt
+        sm.commit()
+    return sm.compare_pb, sm.compare_best
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-time recorded sessions against a route')
+    parser.add_argument('route', help='The route file')
+    parser.add_argument('sessions', nargs='+', help='Session files recorded with record.py')
+    parser.add_argument('-j', '--jobs', type=int, help='Worker processes (default: one per core)')
+    parser.add_argument('--merge', action='store_true',
+        help='Start from the existing pb and golds instead of rebuilding them from scratch'
+    )
+    parser.add_argument('--write', action='store_true', help='Save the rebuilt pb and golds next to the route')
+    args = parser.parse_args()
+
+    route = open_pickle_or_yaml(args.route)
+    base = '.'.join(args.route.split('.')[:-1])
+    pb_filename = base + '.pb'
+    best_filename = base + '.best'
+
+    compare_pb = compare_best = None
+    if args.merge:
+        try:
+            compare_pb = open_pickle_or_yaml(pb_filename)
+        except FileNotFoundError:
+            pass
+        try:
+            compare_best = open_pickle_or_yaml(best_filename)
+        except FileNotFoundError:
+            pass
+
+    attempts = retime_sessions(route, args.sessions, args.jobs)
+    complete = sum(1 for attempt in attempts if attempt.get(route.splits[-1]) is not None)
+    print('%d attempts, %d complete' % (len(attempts), complete))
+
+    compare_pb, compare_best = rebuild_records(route, attempts, compare_pb, compare_best)
+    show_splits(route, compare_pb)
+    sob = sum_of_best(route.splits, compare_best)
+    if sob is not None:
+        print('sum of best:', fmt_time(sob))
+
+    if args.write:
+        if compare_pb.get(route.splits[-1]) is not None:
+            print('saving', pb_filename)
+            save_yaml(pb_filename, compare_pb)
+        print('saving', best_filename)
+        save_yaml(best_filename, compare_best)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""
+Per-room dwell time and death tracking.
+
+Every run automatically logs each room visit (room, time entered, time left, deaths) into compact per-run arrays,
+without the route needing a split per room. Rooms are interned to small integer ids, and per-room totals for the
+run are kept up to date as each visit ends, so a transition costs constant work no matter how long the run is.
+
+At the end of a run the totals are folded into a RoomsRecord, which holds per-room pb and gold comparisons and is
+saved next to the route's pb and golds as <name>.rooms. A room's time is the total time spent in it over the whole
+run, so revisits add up.
+"""
+
+import array
+import collections
+import yaml
+
+from .celeste_timer import NO_TIME, DeathWatch, NEW_SAVE, fmt_time, parse_time, open_pickle_or_yaml, save_yaml, represent_pickle
+
+def room_key(asi):
+    return '%s/%s' % (asi.chapter_name, asi.level_name)
+
+class RoomsRecord:
+    """
+    Per-room comparisons, indexed by interned room id: time and deaths in the pb run, and the best time and fewest
+    deaths seen in any run
+    """
+    def __init__(self):
+        self.keys = []
+        self.ids = {}
+        self.pb_time = array.array('q')
+        self.pb_deaths = array.array('i')
+        self.gold_time = array.array('q')
+        self.gold_deaths = array.array('i')
+
+    def intern(self, key):
+        try:
+            return self.ids[key]
+        except KeyError:
+            room = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            self.pb_time.append(NO_TIME)
+            self.pb_deaths.append(-1)
+            self.gold_time.append(NO_TIME)
+            self.gold_deaths.append(-1)
+            return room
+
+    def pb(self, room):
+        value = self.pb_time[room]
+        return None if value == NO_TIME else value
+
+    def gold(self, room):
+        value = self.gold_time[room]
+        return None if value == NO_TIME else value
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getstate__(self):
+        def opt_time(value):
+            return None if value == NO_TIME else fmt_time(value, full_width=True)
+        def opt_deaths(value):
+            return None if value < 0 else value
+        return {
+            'version': 1,
+            'rooms': {
+                key: {
+                    'pb': opt_time(self.pb_time[i]),
+                    'pb_deaths': opt_deaths(self.pb_deaths[i]),
+                    'gold': opt_time(self.gold_time[i]),
+                    'gold_deaths': opt_deaths(self.gold_deaths[i]),
+                } for i, key in enumerate(self.keys)
+            },
+        }
+
+    def __setstate__(self, state):
+        if type(state) is not dict or state.get('version', 0) != 1:
+            raise TypeError("Cannot deserialize this RoomsRecord - try updating the autosplitter")
+        self.__init__()
+        for key, entry in state['rooms'].items():
+            room = self.intern(key)
+            if entry.get('pb') is not None:
+                self.pb_time[room] = parse_time(entry['pb'])
+            if entry.get('gold') is not None:
+                self.gold_time[room] = parse_time(entry['gold'])
+            if entry.get('pb_deaths') is not None:
+                self.pb_deaths[room] = entry['pb_deaths']
+            if entry.get('gold_deaths') is not None:
+                self.gold_deaths[room] = entry['gold_deaths']
+yaml.representer.Representer.add_representer(RoomsRecord, represent_pickle)
+
+class RoomRun:
+    """
+    The room visits of one run, one entry per visit, plus the running per-room totals of the visits which have ended
+    """
+    def __init__(self):
+        self.room = array.array('i')
+        self.enter = array.array('q')
+        self.exit = array.array('q')
+        self.deaths = array.array('i')
+        self.total_time = collections.defaultdict(int)
+        self.total_deaths = collections.defaultdict(int)
+
+    def __len__(self):
+        return len(self.room)
+
+    @property
+    def open(self):
+        return len(self.room) and self.exit[-1] == NO_TIME
+
+    def begin(self, room, time):
+        self.room.append(room)
+        self.enter.append(time)
+        self.exit.append(NO_TIME)
+        self.deaths.append(0)
+
+    def end(self, time):
+        room = self.room[-1]
+        self.exit[-1] = time
+        self.total_time[room] += time - self.enter[-1]
+        self.total_deaths[room] += self.deaths[-1]
+
+class RoomTracker:
+    """
+    Logs the room visits of the run in progress. attach() it to the reader so that deaths are attributed to the room
+    of the frame they happened on, however slowly update() is called; unattached, deaths are only seen as update()
+    samples them.
+    """
+    def __init__(self, record=None):
+        self.record = record if record is not None else RoomsRecord()
+        self.attached = False
+        self.deaths = DeathWatch()
+        self.pending = collections.deque()  # rooms died in, appended to by the reader thread
+        self.reset()
+
+    def reset(self):
+        self.run = RoomRun()
+        self.location = None
+        self.last_time = 0
+        self.pending.clear()
+
+    def attach(self, asi):
+        asi.listeners.append(self.frame)
+        self.attached = True
+
+    def detach(self, asi):
+        asi.listeners.remove(self.frame)
+        self.attached = False
+
+    def frame(self, asi):
+        """
+        Called on the reader thread with every new frame
+        """
+        death = self.deaths.step(asi)
+        if death is not None and death is not NEW_SAVE:
+            self.pending.append('%s/%s' % death)
+
+    @property
+    def current_room(self):
+        if not self.run.open:
+            return None
+        return self.run.room[-1]
+
+    def current_time(self, now):
+        """
+        Time spent in the current room so far this run, including earlier visits
+        """
+        room = self.current_room
+        if room is None:
+            return None
+        return self.run.total_time[room] + now - self.run.enter[-1]
+
+    def current_deaths(self):
+        room = self.current_room
+        if room is None:
+            return None
+        return self.run.total_deaths[room] + self.run.deaths[-1]
+
+    def update(self, asi, time):
+        if self.location is None:
+            self.pending.clear()  # died before the run started
+        location = (asi.chapter, asi.mode, asi.level_name)
+        if location != self.location:
+            self.location = location
+            if self.run.open:
+                self.run.end(time)
+            if asi.level_name:
+                self.run.begin(self.record.intern(room_key(asi)), time)
+
+        if not self.attached:
+            self.frame(asi)
+        while self.pending:
+            room = self.record.intern(self.pending.popleft())
+            if self.run.open and self.run.room[-1] == room:
+                self.run.deaths[-1] += 1
+            else:
+                # a room passed through between two updates
+                self.run.total_deaths[room] += 1
+        self.last_time = time
+
+    def commit(self, end_time, new_pb):
+        """
+        Fold this run into the record. end_time is when the run finished, or None if it was reset partway, in which
+        case the room it was reset in doesn't count.
+        """
+        run = self.run
+        if run.open and end_time is not None:
+            run.end(end_time)
+
+        record = self.record
+        for room, time in run.total_time.items():
+            deaths = run.total_deaths[room]
+            if record.gold_time[room] == NO_TIME or time < record.gold_time[room]:
+                record.gold_time[room] = time
+            if record.gold_deaths[room] < 0 or deaths < record.gold_deaths[room]:
+                record.gold_deaths[room] = deaths
+
+        if new_pb:
+            for room in range(len(record)):
+                record.pb_time[room] = NO_TIME
+                record.pb_deaths[room] = -1
+            for room, time in run.total_time.items():
+                record.pb_time[room] = time
+                record.pb_deaths[room] = run.total_deaths[room]
+
+def load_rooms(filename):
+    if filename is None:
+        return RoomTracker()
+    try:
+        return RoomTracker(open_pickle_or_yaml(filename))
+    except FileNotFoundError:
+        return RoomTracker()
+
+def save_rooms(tracker, filename):
+    if filename is not None and len(tracker.record):
+        print('saving', filename)
+        save_yaml(filename, tracker.record)
+
+def format_room(tracker, now):
+    room = tracker.current_room
+    if room is None:
+        return ''
+    record = tracker.record
+    time = tracker.current_time(now)
+    pb = record.pb(room)
+    gold = record.gold(room)
+    cols = ['%s: %s' % (record.keys[room], fmt_time(time, ms_decimals=1))]
+    if pb is not None:
+        cols.append('pb ' + fmt_time(time - pb, ms_decimals=1, sign=True))
+    if gold is not None:
+        cols.append('gold ' + fmt_time(gold, ms_decimals=1))
+    deaths = tracker.current_deaths()
+    cols.append('deaths %d' % deaths + ('' if record.pb_deaths[room] < 0 else '/%d' % record.pb_deaths[room]))
+    return '  '.join(cols)
@@ -0,0 +1,238 @@
+"""
+Routes with alternatives and unordered sections.
+
+A GraphRoute is a Route whose pieces may also include:
+
+    Branch(name, options)   exactly one of several sequences of pieces
+    AnyOrder(name, groups)  every one of several sequences of pieces, in any order
+
+Options and groups are lists of pieces and may nest further Branch/AnyOrder pieces. Each one must start with a
+trigger, since that is how the matcher tells which way the runner went.
+
+GraphSplitsManager matches runs against the graph NFA-style. Whenever it reaches a Branch or AnyOrder it keeps a
+cursor for every alternative alive, advancing each on its own triggers (every distinct trigger is evaluated once
+per frame, shared between cursors). The first cursor to reach a split decides the branch. From then on the route
+is linear again until the next Branch or AnyOrder, so all the normal SplitsManager logic and the displays work on
+`sm.route`, the realization of the path taken so far followed by a default expansion of the rest.
+
+PB and gold records stay keyed by Split identity, and pbs keep the order their own run took the splits in.
+"""
+
+from .celeste_timer import Route, Split, StartTimer, Trigger, SplitsManager, SplitsRecord, TriggerCache
+
+class Branch:
+    def __init__(self, name, options):
+        if not options:
+            raise ValueError("Need at least one option")
+        for option in options:
+            if not option or not isinstance(option[0], (Trigger, Branch, AnyOrder)):
+                raise TypeError("Each option of %s must start with a trigger" % name)
+        self.name = name
+        self.options = options
+
+    def alternatives(self):
+        return [list(option) for option in self.options]
+
+    def __repr__(self):
+        return '<Branch %s>' % self.name
+
+class AnyOrder:
+    def __init__(self, name, groups):
+        if not groups:
+            raise ValueError("Need at least one group")
+        for group in groups:
+            if not group or not isinstance(group[0], (Trigger, Branch, AnyOrder)):
+                raise TypeError("Each group of %s must start with a trigger" % name)
+        self.name = name
+        self.groups = groups
+
+    def alternatives(self):
+        result = []
+        for i, group in enumerate(self.groups):
+            rest = self.groups[:i] + self.groups[i+1:]
+            result.append(list(group) + ([AnyOrder(self.name, rest)] if rest else []))
+        return result
+
+    def __repr__(self):
+        return '<AnyOrder %s>' % self.name
+
+def is_node(piece):
+    return isinstance(piece, (Branch, AnyOrder))
+
+def expand(pieces):
+    """
+    The default linearization: the first option of every Branch, and AnyOrder groups in the order listed
+    """
+    result = []
+    for piece in pieces:
+        if isinstance(piece, Branch):
+            result.extend(expand(piece.options[0]))
+        elif isinstance(piece, AnyOrder):
+            for group in piece.groups:
+                result.extend(expand(group))
+        else:
+            result.append(piece)
+    return result
+
+def all_splits(pieces):
+    """
+    Every split reachable on any path through the graph
+    """
+    result = []
+    for piece in pieces:
+        if isinstance(piece, Branch):
+            for option in piece.options:
+                result.extend(all_splits(option))
+        elif isinstance(piece, AnyOrder):
+            for group in piece.groups:
+                result.extend(all_splits(group))
+        elif type(piece) is Split:
+            result.append(piece)
+    return result
+
+class GraphRoute(Route):
+    def __init__(self, name, time_field, pieces, level_names, reset_trigger):
+        if is_node(pieces[-1]):
+            raise TypeError("Last piece of route must be top-level Split")
+        self.graph = list(pieces)
+        super().__init__(name, time_field, expand(pieces), level_names, reset_trigger)
+        self.splits = all_splits(pieces)
+        self.levels = max(split.level for split in self.splits) + 1
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['pieces'] = self.graph
+        return state
+
+class GraphSplitsManager(SplitsManager):
+    def __init__(self, asi, route, compare_pb=None, compare_best=None, triggers=None, rooms=None, history=None,
+                 comparisons=None):
+        self.graph = route
+        self.own_triggers = triggers is None
+        if triggers is None:
+            triggers = TriggerCache(asi)
+        super().__init__(asi, route, compare_pb, compare_best, triggers, rooms, history)
+        # the comparisons are tables over the realized route, so they're built by rebuild() rather than over the graph
+        self.comparisons = comparisons
+        self.restart()
+
+    def bind_records(self):
+        self.compare_pb.update_identity(self.graph, keep_order=True)
+        self.compare_best.update_identity(self.graph, keep_others=True)
+
+    def restart(self):
+        self.resolved = []
+        self.remaining = list(self.graph.graph)
+        self.candidates = None
+        self.choices = []
+        self.advance_linear()
+        self.rebuild()
+
+    def advance_linear(self):
+        while self.remaining and not is_node(self.remaining[0]):
+            self.resolved.append(self.remaining.pop(0))
+
+    def rebuild(self):
+        g = self.graph
+        self.route = Route(g.name, g.time_field, self.resolved + expand(self.remaining), g.level_names, g.reset_trigger)
+        if self.comparisons is not None:
+            self.comparisons.update(self)
+        self.changed()
+
+    @property
+    def at_choice(self):
+        return self.current_piece_idx >= len(self.resolved) and bool(self.remaining)
+
+    def live_positions(self):
+        """
+        The pieces each live cursor is waiting on, for display
+        """
+        if self.candidates is None:
+            return []
+        return [pieces[pos] for pieces, pos in self.candidates if pos < len(pieces)]
+
+    def spawn_candidates(self, pieces, pos):
+        """
+        Expand any Branch/AnyOrder at pos into one cursor per alternative
+        """
+        if pos < len(pieces) and is_node(pieces[pos]):
+            result = []
+            for alternative in pieces[pos].alternatives():
+                result.extend(self.spawn_candidates(pieces[:pos] + alternative + pieces[pos+1:], pos))
+            return result
+        if pos < len(pieces) and isinstance(pieces[pos], Trigger):
+            pieces[pos].arm()
+        return [[pieces, pos]]
+
+    def realize(self, pieces, pos):
+        """
+        Commit to a cursor: its passed triggers join the resolved prefix and its remaining pieces replace the node
+        """
+        self.choices.append((len(self.resolved), list(self.remaining)))
+        self.resolved.extend(pieces[:pos])
+        self.remaining = pieces[pos:] + self.remaining[1:]
+        self.candidates = None
+        self.advance_linear()
+        self.rebuild()
+
+    def match(self):
+        if self.candidates is None:
+            self.candidates = self.spawn_candidates([self.remaining[0]], 0)
+
+        advanced = []
+        for pieces, pos in self.candidates:
+            while pos < len(pieces) and isinstance(pieces[pos], Trigger) and self.check_trigger(pieces[pos]):
+                pos += 1
+                if pos < len(pieces) and isinstance(pieces[pos], Trigger):
+                    pieces[pos].arm()
+            advanced.extend(self.spawn_candidates(pieces, pos))
+        self.candidates = advanced
+
+        for pieces, pos in self.candidates:
+            if pos and (pos == len(pieces) or type(pieces[pos]) in (Split, StartTimer)):
+                start = len(self.resolved)
+                self.realize(pieces, pos)
+                # SplitsManager.update steps past one piece when we return True
+                self.current_piece_idx = start + pos - 1
+                return True
+        return False
+
+    def check_current_trigger(self):
+        if not self.at_choice:
+            return super().check_current_trigger()
+        return self.match()
+
+    def update(self):
+        if self.own_triggers:
+            self.triggers.invalidate()
+        super().update()
+
+    def skip(self, n=1):
+        for _ in range(n):
+            if self.at_choice:
+                # take the default path
+                self.realize(self.remaining[0].alternatives()[0], 0)
+            super().skip(1)
+
+    def rewind(self, n=1):
+        super().rewind(n)
+        self.candidates = None
+        # rewound splits would keep their old place in current_times, but they may be retaken in another order
+        self.current_times = SplitsRecord(self.current_times.items())
+        # undo any choice we've gone back to or past, so it is matched afresh
+        undone = False
+        while self.choices and self.choices[-1][0] >= self.current_piece_idx:
+            start, remaining = self.choices.pop()
+            del self.resolved[start:]
+            self.remaining = remaining
+            undone = True
+        if undone:
+            self.rebuild()
+
+    def reset(self):
+        super().reset()
+        if self.choices:
+            self.restart()
+        else:
+            # nothing was realized, so the route is still the default expansion
+            self.candidates = None
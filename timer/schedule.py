@@ -0,0 +1,128 @@
+"""
+Scheduling for the autosplitter info reader thread.
+
+The reader samples on absolute deadlines from time.monotonic_ns(), so a late wakeup doesn't push every later sample
+back, and a stall skips the missed samples instead of bursting to catch up. Optionally the reader thread can be
+pinned to CPUs and given a nice value or real-time priority, where the system permits; these apply only to the
+reader thread, not the rest of the process. The interpreter's GIL switch interval can also be shortened to match the
+sample rate so a busy render loop can't hold the reader off for long, though that one affects the whole process.
+
+With stats enabled, how late each sample is compared to its deadline is recorded as reader_jitter.
+"""
+
+import os
+import sys
+import time
+import threading
+
+try:
+    from . import stats
+except ImportError:
+    import stats
+
+class ReaderSchedule:
+    def __init__(self, interval=0.001, affinity=None, nice=None, realtime=None, spin=0., switch_interval=False):
+        self.interval = interval    # seconds between samples
+        self.affinity = affinity    # set of CPU numbers to run on
+        self.nice = nice            # nice value for the reader thread
+        self.realtime = realtime    # SCHED_FIFO priority for the reader thread
+        self.spin = spin            # seconds before each deadline to stop sleeping and spin instead
+        self.switch_interval = switch_interval  # shorten the process-wide GIL switch interval to half the interval
+
+    def apply(self):
+        """
+        Apply the thread settings to the calling thread. Settings the system refuses are reported and skipped.
+        """
+        # a busy main thread only hands the GIL over every switch interval (5ms by default), which would otherwise
+        # dominate how late samples are. This one is process-wide.
+        if self.switch_interval and sys.getswitchinterval() > self.interval / 2:
+            sys.setswitchinterval(self.interval / 2)
+        tid = threading.get_native_id()
+        if self.affinity:
+            _attempt('CPU affinity', os.sched_setaffinity, tid, self.affinity)
+        if self.nice is not None:
+            _attempt('nice value', os.setpriority, os.PRIO_PROCESS, tid, self.nice)
+        if self.realtime is not None:
+            _attempt('real-time priority', os.sched_setscheduler, tid, os.SCHED_FIFO, os.sched_param(self.realtime))
+
+    def deadlines(self):
+        return Deadlines(int(self.interval * 1e9), int(self.spin * 1e9))
+
+def _attempt(what, func, *args):
+    try:
+        func(*args)
+    except (OSError, AttributeError) as e:
+        sys.stderr.write('reader: could not set %s: %s\n' % (what, e))
+
+class Deadlines:
+    def __init__(self, interval_ns, spin_ns=0):
+        self.interval_ns = interval_ns
+        self.spin_ns = spin_ns
+        self.deadline = time.monotonic_ns()
+
+    def restart(self):
+        self.deadline = time.monotonic_ns()
+
+    def wait(self):
+        """
+        Sleep until the next deadline. Returns how late we woke up, in nanoseconds.
+        """
+        self.deadline += self.interval_ns
+        now = time.monotonic_ns()
+        if now >= self.deadline + self.interval_ns:
+            # a whole sample late: drop the missed ones rather than hurrying through them
+            if stats.enabled:
+                stats.count('reader_missed', (now - self.deadline) // self.interval_ns)
+            self.deadline = now
+            return 0
+
+        remaining = self.deadline - now - self.spin_ns
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+        now = time.monotonic_ns()
+        while now < self.deadline:
+            now = time.monotonic_ns()
+
+        late = now - self.deadline
+        if stats.enabled:
+            stats.record('reader_jitter', late)
+        return late
+
+default = ReaderSchedule()
+
+def parse_cpus(text):
+    """
+    '0,2-3' -> {0, 2, 3}
+    """
+    cpus = set()
+    for part in text.split(','):
+        if '-' in part:
+            lo, hi = part.split('-')
+            cpus.update(range(int(lo), int(hi) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+def add_arguments(parser):
+    parser.add_argument('--reader-hz', type=float, default=1000,
+        help='How often to sample the autosplitter info (default: 1000)'
+    )
+    parser.add_argument('--reader-cpus', type=parse_cpus,
+        help='Pin the reader thread to these CPUs, e.g. 3 or 2-3'
+    )
+    parser.add_argument('--reader-nice', type=int, help='Nice value for the reader thread (negative needs privileges)')
+    parser.add_argument('--reader-realtime', type=int, metavar='PRIORITY',
+        help='Run the reader thread with SCHED_FIFO at this priority (needs privileges)'
+    )
+    parser.add_argument('--reader-spin', type=float, default=0, metavar='MICROSECONDS',
+        help='Busy-wait this long before each sample instead of sleeping, for less jitter at the cost of CPU'
+    )
+    parser.add_argument('--reader-switch-interval', action='store_true',
+        help="Shorten the interpreter's thread switch interval to half the sample interval, so a busy display hands "
+             "over to the reader sooner (affects the whole process)"
+    )
+
+def configure(args):
+    global default
+    default = ReaderSchedule(1 / args.reader_hz, args.reader_cpus, args.reader_nice, args.reader_realtime,
+                             args.reader_spin / 1e6, args.reader_switch_interval)
@@ -0,0 +1,216 @@
+"""
+Optional latency and throughput instrumentation for the timing pipeline.
+
+Everything here is off unless enable() is called (the --stats family of command line flags). Call sites guard on
+`stats.enabled`, so when disabled the only cost is that one check.
+"""
+
+import os
+import sys
+import time
+import signal
+import cProfile
+
+enabled = False
+overlay = False
+histograms = {}
+counters = {}
+
+_log_path = None
+_log_interval = 10.
+_next_log = None
+_profile_seconds = 0
+_profiler = None
+_profile_end = None
+
+class Histogram:
+    """
+    Log2-bucketed histogram of non-negative integer samples. Bucket i counts samples whose bit length is i,
+    so recording is constant time and memory is fixed no matter how long the process runs.
+    """
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.buckets = [0] * 65
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        value = max(0, int(value))
+        self.buckets[min(value.bit_length(), 64)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        Upper bound of the bucket containing the given fraction of samples
+        """
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return min((1 << i) - 1, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        if not self.count:
+            return '%s: no samples' % self.name
+        return '%s: n=%d mean=%s p50<=%s p99<=%s max=%s' % (
+            self.name, self.count, fmt_value(self.mean, self.unit), fmt_value(self.percentile(.5), self.unit),
+            fmt_value(self.percentile(.99), self.unit), fmt_value(self.max, self.unit))
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._rate = None
+
+    def add(self, n=1):
+        self.count += n
+
+    def rate(self):
+        """
+        Events per second, measured over windows of at least one second
+        """
+        now = time.monotonic()
+        if now - self._window_start >= 1:
+            self._rate = (self.count - self._window_count) / (now - self._window_start)
+            self._window_start = now
+            self._window_count = self.count
+        return self._rate
+
+    def summary(self):
+        rate = self.rate()
+        return '%s: %d total, %s/s' % (self.name, self.count, '?' if rate is None else '%.1f' % rate)
+
+def fmt_value(value, unit):
+    if value is None:
+        return '?'
+    if unit == 'ns':
+        if value >= 1000000:
+            return '%.1fms' % (value / 1000000)
+        if value >= 1000:
+            return '%.1fus' % (value / 1000)
+        return '%dns' % value
+    if unit == 'B':
+        if value >= 1024:
+            return '%.1fkB' % (value / 1024)
+        return '%dB' % value
+    return '%d%s' % (value, unit)
+
+def histogram(name, unit='ns'):
+    try:
+        return histograms[name]
+    except KeyError:
+        result = histograms[name] = Histogram(name, unit)
+        return result
+
+def counter(name):
+    try:
+        return counters[name]
+    except KeyError:
+        result = counters[name] = Counter(name)
+        return result
+
+def record(name, value, unit='ns'):
+    histogram(name, unit).add(value)
+
+def count(name, n=1):
+    counter(name).add(n)
+
+def overlay_line():
+    pieces = []
+    for name, label in (('decode', 'decode'), ('reader_jitter', 'jitter'), ('frame_age', 'age'), ('update', 'update'), ('render', 'render'), ('split_latency', 'split lag')):
+        hist = histograms.get(name)
+        if hist is not None and hist.count:
+            pieces.append('%s %s' % (label, fmt_value(hist.percentile(.5), hist.unit)))
+    hist = histograms.get('render_bytes')
+    if hist is not None and hist.count:
+        pieces.append(fmt_value(hist.percentile(.5), hist.unit))
+    for name, label in (('ticks', 'ticks'), ('frames', 'frames')):
+        ctr = counters.get(name)
+        if ctr is not None:
+            rate = ctr.rate()
+            pieces.append('%s %s/s' % (label, '?' if rate is None else '%d' % rate))
+    return ' | '.join(pieces)
+
+def dump(fp=None):
+    if fp is None:
+        fp = sys.stderr
+    fp.write('=== stats @ %s ===\n' % time.strftime('%H:%M:%S'))
+    for hist in histograms.values():
+        fp.write(hist.summary() + '\n')
+    for ctr in counters.values():
+        fp.write(ctr.summary() + '\n')
+    fp.flush()
+
+def _dump_to_log():
+    if _log_path is None:
+        dump()
+    else:
+        with open(_log_path, 'a', encoding='utf-8') as fp:
+            dump(fp)
+
+def _handle_sigusr1(signum, frame): # pylint: disable=unused-argument
+    global _profiler, _profile_end
+    _dump_to_log()
+    if _profile_seconds and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+        _profile_end = time.monotonic() + _profile_seconds
+
+def enable(show_overlay=False, log_path=None, log_interval=10., profile_seconds=0):
+    global enabled, overlay, _log_path, _log_interval, _next_log, _profile_seconds
+    enabled = True
+    overlay = show_overlay
+    _log_path = log_path
+    _log_interval = log_interval
+    _next_log = time.monotonic() + log_interval if log_path is not None else None
+    _profile_seconds = profile_seconds
+    signal.signal(signal.SIGUSR1, _handle_sigusr1)
+
+def tick():
+    """
+    Housekeeping for the periodic log and the profile capture window. Call from the main loop.
+    """
+    global _next_log, _profiler, _profile_end
+    now = time.monotonic()
+    if _next_log is not None and now >= _next_log:
+        _dump_to_log()
+        _next_log = now + _log_interval
+    if _profiler is not None and now >= _profile_end:
+        _profiler.disable()
+        filename = 'celeste_timer.%d.%d.prof' % (os.getpid(), int(time.time()))
+        _profiler.dump_stats(filename)
+        _profiler = None
+        _profile_end = None
+
+def add_arguments(parser):
+    parser.add_argument('--stats', action='store_true',
+        help='Collect timing pipeline statistics and show them on an overlay line. Send SIGUSR1 to dump them.'
+    )
+    parser.add_argument('--stats-log', type=str,
+        help='Collect statistics and append a summary to this file periodically and on SIGUSR1'
+    )
+    parser.add_argument('--stats-interval', type=float, default=10.,
+        help='Seconds between periodic statistics log entries (default: 10)'
+    )
+    parser.add_argument('--profile-seconds', type=float, default=0,
+        help='On SIGUSR1, also capture a cProfile of the main loop for this many seconds'
+    )
+
+def configure(args):
+    if args.stats or args.stats_log is not None or args.profile_seconds:
+        enable(args.stats, args.stats_log, args.stats_interval, args.profile_seconds)
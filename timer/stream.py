@@ -1,19 +1,13 @@
 #!/usr/bin/env python3
 
 import sys
+import argparse
 import functools
-from .celeste_timer import fmt_time
-from .full_splits import main, print_splits
-
-def fmt_time_ex(time, meaningful, sign=False):
-    if meaningful is None:
-        return '----'
-    elif time is None:
-        return '??.?'
-    elif time < 60 * 1000:
-        return fmt_time(time, ms_decimals=1, sign=sign)
-    else:
-        return fmt_time(time, ms_decimals=0, sign=sign)
+from .full_splits import main
+from .comparisons import NAMES as COMPARISONS
+from .view import fmt_time_ex, generate_stats, cached_stats, build_view, TerminalSink, FileSink, JsonSink, fanout # pylint: disable=unused-import
+from . import stats
+from . import schedule
 
 RED = '\x1b[31m'
 GREEN = '\x1b[32m'
@@ -40,91 +34,40 @@ def color_mark(stats):
     else:
         return RED
 
-def generate_stats(sm, split, level):
-    if split is not None:
-        if sm.current_split(level) is split:
-            status = 'present'
-            atime = sm.current_segment_time(level)
-            amark = sm.current_time
-        elif sm.is_segment_done(split):
-            status = 'past'
-            atime = sm.current_times.segment_time(split, level)
-            amark = sm.current_times[split]
-        else:
-            status = 'future'
-            atime = None
-            amark = None
-
-        ptime = sm.compare_pb.segment_time(split, level)
-        gtime = sm.compare_best[(split, level)]
-        possible_timesave = ptime - gtime if ptime is not None and gtime is not None else None
-        pb_delta = atime - ptime if atime is not None and ptime is not None else None
-        gold = atime < gtime if atime is not None and gtime is not None else False
-
-        pmark = sm.compare_pb[split]
-        pb_diff = amark - pmark if amark is not None and pmark is not None else None
-    else:
-        status = None
-        atime = None
-        ptime = None
-        gtime = None
-        possible_timesave = None
-        pb_delta = None
-        gold = False
-        amark = None
-        pmark = None
-        pb_diff = None
-
-    return {
-        'status': status,
-        'atime': atime,
-        'ptime': ptime,
-        'gtime': gtime,
-        'possible_timesave': possible_timesave,
-        'pb_delta': pb_delta,
-        'gold': gold,
-        'amark': amark,
-        'pmark': pmark,
-        'pb_diff': pb_diff,
-    }
-
-
-def format_stream(sm):
-    num_levels = max(1, len(sm.route.level_names))
-    splits_cur = [sm.current_split(i) for i in range(num_levels)]
-    splits_prev = [sm.previous_split(i) for i in range(num_levels)]
-    for lvl in range(1, num_levels):
-        if not any(subseg == (splits_cur[lvl], lvl) for subseg in sm.route.all_subsegments):
-            splits_cur[lvl] = None
-        if not any(subseg == (splits_prev[lvl], lvl) for subseg in sm.route.all_subsegments):
-            splits_prev[lvl] = None
-
-    stats_cur = [generate_stats(sm, splits_cur[lvl], lvl) for lvl in range(num_levels)]
-    stats_prev = [generate_stats(sm, splits_prev[lvl], lvl) for lvl in range(num_levels)]
+def format_stream(sm, predictor=None):
+    view = build_view(sm)
+    s = view.mark
+    sp = view.mark_split
 
     result = []
 
-    result.append(sm.route.name)
+    result.append(view.route_name)
     result.append('')
 
-    for split, stat in zip(splits_prev, stats_prev):
-        if split is not None or split is splits_prev[0]:
-            s = stat
-            sp = split
     result.append('Timer: %s%s' % (
-        NORMAL if not sm.done else GREEN if s['pb_diff'] is None else color_mark(s),
-        fmt_time_ex(sm.current_time, True),
+        NORMAL if not view.done else GREEN if s['pb_diff'] is None else color_mark(s),
+        fmt_time_ex(view.current_time, True),
     ))
-    result.append('%s PB by %s%s%s' % (
+    result.append('%s %s by %s%s%s' % (
         'Ahead of' if s['pb_diff'] is None or s['pb_diff'] < 0 else 'Behind',
+        'PB' if view.comparison == 'pb' else view.comparison,
         color_mark(s),
         fmt_time_ex(s['pb_diff'], sp),
         NORMAL,
     ))
+    if predictor is not None:
+        prediction = predictor.request(sm)
+        if prediction is not None:
+            result.append('Predicted: %s (%s-%s)%s' % (
+                fmt_time_ex(prediction.median, True),
+                fmt_time_ex(prediction.p10, True),
+                fmt_time_ex(prediction.p90, True),
+                '' if prediction.pb_probability is None else ', PB %d%%' % round(prediction.pb_probability * 100),
+            ))
     #result.append('Could maybe get: %s' % fmt_time_ex(sm.best_possible_time(), True))
     result.append('')
 
-    for name, split, stat in zip(sm.route.level_names, splits_cur, stats_cur):
+    for name, split, stat in zip(view.level_names, view.splits_cur, view.stats_cur):
         result.append('%s: %s%s%s/%s' % (
             name,
             color_split(stat),
@@ -135,7 +78,7 @@ def format_stream(sm):
         result.append('Can save: %s' % fmt_time_ex(stat['possible_timesave'], split))
         result.append('')
 
-    for name, split, stat in zip(sm.route.level_names, splits_prev, stats_prev):
+    for name, split, stat in zip(view.level_names, view.splits_prev, view.stats_prev):
         result.append('Prev. %s:\nCould save %s\n%s %s%s%s%s\n' % (
             name,
             fmt_time_ex(stat['possible_timesave'], split),
@@ -153,5 +96,31 @@ if __name__ == '__main__':
     if len(sys.argv) == 1:
         print("Please make sure to specify your route file as a command line argument!")
         sys.exit(1)
+    parser = argparse.ArgumentParser(description='Stream-friendly splits display')
+    parser.add_argument('route', help='The route file')
+    parser.add_argument('--headless', action='store_true',
+        help='Run without desktop notifications or hotkeys (no D-Bus or X connection)'
+    )
+    parser.add_argument('--obs-dir', help='Also write each field of the display to a text file in this directory')
+    parser.add_argument('--json-port', type=int, help='Also serve the display as JSON lines on this local TCP port')
+    parser.add_argument('--no-predict', action='store_true', help="Don't predict the final time from your attempt history")
+    parser.add_argument('--comparison', choices=COMPARISONS, default='pb',
+        help='What to compare against at first; the comparison hotkey cycles through them (default: pb)'
+    )
+    stats.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    stats.configure(args)
+    schedule.configure(args)
+    if args.no_predict:
+        formatter = format_stream
     else:
-        main(sys.argv[1], renderer=functools.partial(print_splits, formatter=format_stream))
+        from .predict import Predictor
+        formatter = functools.partial(format_stream, predictor=Predictor())
+    sinks = [TerminalSink(formatter)]
+    if args.obs_dir:
+        sinks.append(FileSink(args.obs_dir))
+    if args.json_port:
+        sinks.append(JsonSink(args.json_port))
+    main(args.route, renderer=fanout(*sinks) if len(sinks) > 1 else sinks[0], headless=args.headless,
+         comparison=args.comparison)
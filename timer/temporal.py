@@ -0,0 +1,171 @@
+"""
+Stateful trigger expressions.
+
+A temporal trigger is an ordinary trigger expression which may also use these operators:
+
+    rose(expr)          true on the frame expr goes from false to true
+    fell(expr)          true on the frame expr goes from true to false
+    changed(expr)       true on the frame expr's value differs from the previous frame
+    held(expr, ms)      true once expr has been continuously true for at least ms milliseconds
+    seq(a, b, ...)      true once a, then b, then ... have each been true, in that order (stays true)
+
+For example, `seq(asi.chapter_checkpoints >= 2, rose(asi.level_name == "b-07"))` or
+`held(asi.chapter_complete, 500)`. Operators nest freely and mix with and/or/not.
+
+The expression is compiled once into a flat list of operator nodes, children before parents. Every frame each node
+is evaluated exactly once and keeps only a constant amount of state, so the cost per frame doesn't depend on how
+long the trigger has been waiting. Edges and durations are measured from the frame the trigger is armed, which
+SplitsManager does when the trigger becomes the current piece.
+"""
+
+import ast
+import time
+
+from .celeste_timer import Trigger
+
+class _Rose:
+    nargs = 1
+
+    def __init__(self):
+        self.prev = None
+
+    def reset(self):
+        self.prev = None
+
+    def step(self, args, now): # pylint: disable=unused-argument
+        value = bool(args[0])
+        result = self.prev is not None and value and not self.prev
+        self.prev = value
+        return result
+
+class _Fell(_Rose):
+    def step(self, args, now): # pylint: disable=unused-argument
+        value = bool(args[0])
+        result = self.prev is not None and not value and self.prev
+        self.prev = value
+        return result
+
+class _Changed(_Rose):
+    primed = False
+
+    def reset(self):
+        self.prev = None
+        self.primed = False
+
+    def step(self, args, now): # pylint: disable=unused-argument
+        value = args[0]
+        result = self.primed and value != self.prev
+        self.prev = value
+        self.primed = True
+        return result
+
+class _Held:
+    nargs = 2
+
+    def __init__(self):
+        self.since = None
+
+    def reset(self):
+        self.since = None
+
+    def step(self, args, now):
+        if not args[0]:
+            self.since = None
+            return False
+        if self.since is None:
+            self.since = now
+        return now - self.since >= args[1]
+
+class _Seq:
+    nargs = None
+
+    def __init__(self):
+        self.stage = 0
+
+    def reset(self):
+        self.stage = 0
+
+    def step(self, args, now): # pylint: disable=unused-argument
+        # advance at most one stage per frame so "a then b" needs b to hold after a has
+        if self.stage < len(args) and args[self.stage]:
+            self.stage += 1
+        return self.stage == len(args)
+
+OPERATORS = {
+    'rose': _Rose,
+    'fell': _Fell,
+    'changed': _Changed,
+    'held': _Held,
+    'seq': _Seq,
+}
+
+class _Compiler(ast.NodeTransformer):
+    def __init__(self, machine):
+        self.machine = machine
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in OPERATORS:
+            return self.generic_visit(node)
+        cls = OPERATORS[node.func.id]
+        if node.keywords or (cls.nargs is not None and len(node.args) != cls.nargs) or not node.args:
+            raise SyntaxError('wrong arguments to %s()' % node.func.id)
+        # children are compiled (and so appended) before their parent
+        codes = [self.machine.compile_expr(self.visit(arg)) for arg in node.args]
+        index = len(self.machine.nodes)
+        self.machine.nodes.append((cls(), codes))
+        return ast.copy_location(ast.Subscript(
+            value=ast.Name(id='_v', ctx=ast.Load()),
+            slice=ast.Constant(value=index),
+            ctx=ast.Load(),
+        ), node)
+
+class TemporalMachine:
+    def __init__(self, expr):
+        self.expr = expr
+        self.nodes = []
+        tree = ast.parse(expr, mode='eval')
+        self.code = self.compile_expr(_Compiler(self).visit(tree.body))
+        self.values = [False] * len(self.nodes)
+        self.env = {'asi': None, '_v': self.values}
+
+    @staticmethod
+    def compile_expr(body):
+        return compile(ast.fix_missing_locations(ast.Expression(body=body)), '<temporal trigger>', 'eval')
+
+    def reset(self):
+        for node, _ in self.nodes:
+            node.reset()
+
+    def step(self, asi):
+        timestamp = getattr(asi, 'timestamp', None)
+        now = (time.monotonic_ns() if timestamp is None else timestamp) // 1000000
+        env = self.env
+        env['asi'] = asi
+        values = self.values
+        for i, (node, codes) in enumerate(self.nodes):
+            values[i] = node.step([eval(code, env) for code in codes], now) # pylint: disable=eval-used
+        return eval(self.code, env) # pylint: disable=eval-used
+
+class TemporalTrigger(Trigger):
+    stateful = True
+
+    def __init__(self, name, end_trigger):
+        super().__init__(name, end_trigger)
+        self.machine = TemporalMachine(end_trigger)
+
+    def arm(self):
+        self.machine.reset()
+
+    def check_trigger(self, asi):
+        return self.machine.step(asi)
+
+    def __repr__(self):
+        return '<TemporalTrigger %s>' % self.name
+
+    def __getstate__(self):
+        return {'name': self.name, 'end_trigger': self.end_trigger}
+
+    def __setstate__(self, state):
+        self.name = state['name']
+        self.end_trigger = state['end_trigger']
+        self.machine = TemporalMachine(self.end_trigger)
@@ -0,0 +1,104 @@
+"""
+The desktop side of the autosplitter: split notifications and global hotkeys.
+
+Nothing here touches GTK, D-Bus or X until a DesktopUI is constructed, so scripts which only want the formatting or
+record helpers from full_splits don't pay for any of it. HeadlessUI has the same interface and does nothing.
+"""
+
+import os
+import time
+import subprocess
+
+berry = os.path.join(os.path.dirname(__file__), 'Celeste.png')
+
+class HeadlessUI:
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def notify(self, title, body, timeout):
+        pass
+
+    def poll(self):
+        pass
+
+    def take_actions(self):
+        return []
+
+class DesktopUI(HeadlessUI):
+    def __init__(self):
+        import gi # pylint: disable=import-outside-toplevel
+        gi.require_version('Notify', '0.7')
+        from gi.repository import Notify # pylint: disable=import-outside-toplevel
+        import pynput # pylint: disable=import-outside-toplevel
+        self.pynput = pynput
+
+        Notify.init("celeste_timer")
+        self.notification = Notify.Notification.new('', '', berry)
+        self.notification.set_urgency(2)
+        self.cancel_show_at = None
+
+        self.action_queue = []
+        self.ctrled = self.shifted = False
+        self.listener = pynput.keyboard.Listener(on_press=self.handle_key, on_release=self.handle_release)
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+    def notify(self, title, body, timeout):
+        self.notification.update(title, body, berry)
+        self.notification.show()
+        self.cancel_show_at = time.time() + timeout
+
+    def poll(self):
+        if self.cancel_show_at is not None and time.time() >= self.cancel_show_at:
+            self.notification.close()
+            self.cancel_show_at = None
+
+    def take_actions(self):
+        actions = []
+        while self.action_queue:
+            actions.append(self.action_queue.pop(0))
+        return actions
+
+    @staticmethod
+    def should_handle_key():
+        try:
+            res = subprocess.check_output(['xdotool', 'getactivewindow', 'getwindowname']).strip().decode()
+        except subprocess.CalledProcessError:
+            return False
+        return res in ('Celeste', 'streamdisplay')
+
+    def handle_key(self, key):
+        keyboard = self.pynput.keyboard
+        if key == keyboard.Key.ctrl:
+            self.ctrled = True
+        elif key == keyboard.Key.shift:
+            self.shifted = True
+        elif self.should_handle_key():
+            if key == keyboard.KeyCode(char='\\'):
+                self.action_queue.append('skip')
+            elif key == keyboard.KeyCode(char='='):
+                self.action_queue.append('comparison')
+            elif key == keyboard.Key.backspace:
+                if self.ctrled:
+                    self.action_queue.append('reset')
+                elif self.shifted:
+                    self.action_queue.append('rewind')
+
+    def handle_release(self, key):
+        keyboard = self.pynput.keyboard
+        if key == keyboard.Key.ctrl:
+            self.ctrled = False
+        elif key == keyboard.Key.shift:
+            self.shifted = False
+
+def make_ui(headless=False):
+    if headless:
+        return HeadlessUI()
+    return DesktopUI()
@@ -0,0 +1,287 @@
+"""
+A per-frame view model of a SplitsManager, and output sinks which consume it.
+
+build_view() works out everything a display might want to show - the current and previous split at every level,
+their times, deltas against the pb, golds and possible timesave, plus run totals - once per frame. Any number of
+sinks can then render the same ViewModel without recomputing it. A sink is called with the SplitsManager, like any
+other renderer passed to full_splits.run(), so they can be mixed freely with the existing formatters:
+
+    TerminalSink(formatter)     print to the terminal, as print_splits does
+    FileSink(directory)         one text file per field, for OBS text sources
+    JsonSink(port)              newline-delimited JSON to every client connected to a local TCP port
+"""
+
+import os
+import json
+import socket
+import tempfile
+
+from .celeste_timer import fmt_time
+
+def fmt_time_ex(time, meaningful, sign=False):
+    if meaningful is None:
+        return '----'
+    elif time is None:
+        return '??.?'
+    elif time < 60 * 1000:
+        return fmt_time(time, ms_decimals=1, sign=sign)
+    else:
+        return fmt_time(time, ms_decimals=0, sign=sign)
+
+def sum_of_best(splits, sob, level=0):
+    if len(splits) == 1:
+        return None
+    last_start = 0
+    best = 0
+    for i, split in enumerate(splits):
+        if split.level <= level:
+            sub_sob = sum_of_best(splits[last_start:i+1], sob, level+1)
+            last_start = i + 1
+            out_sob = sob.get((split, level))
+            if sub_sob is not None and out_sob is not None and sub_sob < out_sob:
+                out_sob = sub_sob
+            if out_sob is None:
+                return None
+            best += out_sob
+    return best
+
+def generate_stats(sm, split, level):
+    if split is not None:
+        if sm.current_split(level) is split:
+            status = 'present'
+            atime = sm.current_segment_time(level)
+            amark = sm.current_time
+        elif sm.is_segment_done(split):
+            status = 'past'
+            atime = sm.current_times.segment_time(split, level)
+            amark = sm.current_times[split]
+        else:
+            status = 'future'
+            atime = None
+            amark = None
+
+        compare = sm.compare
+        ptime = compare.segment_time(split, level)
+        gtime = sm.compare_best.get((split, level))
+        possible_timesave = ptime - gtime if ptime is not None and gtime is not None else None
+        pb_delta = atime - ptime if atime is not None and ptime is not None else None
+        gold = atime < gtime if atime is not None and gtime is not None else False
+
+        pmark = compare[split]
+        pb_diff = amark - pmark if amark is not None and pmark is not None else None
+    else:
+        status = None
+        atime = None
+        ptime = None
+        gtime = None
+        possible_timesave = None
+        pb_delta = None
+        gold = False
+        amark = None
+        pmark = None
+        pb_diff = None
+
+    return {
+        'status': status,
+        'atime': atime,
+        'ptime': ptime,
+        'gtime': gtime,
+        'possible_timesave': possible_timesave,
+        'pb_delta': pb_delta,
+        'gold': gold,
+        'amark': amark,
+        'pmark': pmark,
+        'pb_diff': pb_diff,
+    }
+
+def cached_stats(sm, split, level):
+    """
+    generate_stats, memoized for every split except the one in progress
+    """
+    if split is None or sm.current_split(level) is split:
+        return generate_stats(sm, split, level)
+    cache = sm.render_cache('stream_stats')
+    try:
+        return cache[(split, level)]
+    except KeyError:
+        result = cache[(split, level)] = generate_stats(sm, split, level)
+        return result
+
+class ViewModel:
+    def __init__(self, sm):
+        self.generation = sm.generation
+        self.route_name = sm.route.name
+        self.comparison = sm.comparison_name
+        self.level_names = sm.route.level_names
+        self.num_levels = max(1, len(sm.route.level_names))
+        self.current_time = sm.current_time
+        self.started = sm.started
+        self.done = sm.done
+
+        layout = sm.render_cache('view_layout')
+        subsegments = layout.get('subsegments')
+        if subsegments is None:
+            subsegments = layout['subsegments'] = set(sm.route.all_subsegments)
+            try:
+                layout['sum_of_best'] = sum_of_best(sm.route.splits, sm.compare_best)
+            except KeyError:
+                layout['sum_of_best'] = None
+        self.sum_of_best = layout['sum_of_best']
+        self.pb_time = sm.compare_pb.get(sm.route.splits[-1])
+        self.possible_timesave = self.pb_time - self.sum_of_best \
+            if self.pb_time is not None and self.sum_of_best is not None else None
+
+        self.splits_cur = [sm.current_split(i) for i in range(self.num_levels)]
+        self.splits_prev = [sm.previous_split(i) for i in range(self.num_levels)]
+        for lvl in range(1, self.num_levels):
+            if (self.splits_cur[lvl], lvl) not in subsegments:
+                self.splits_cur[lvl] = None
+            if (self.splits_prev[lvl], lvl) not in subsegments:
+                self.splits_prev[lvl] = None
+
+        self.stats_cur = [cached_stats(sm, self.splits_cur[lvl], lvl) for lvl in range(self.num_levels)]
+        self.stats_prev = [cached_stats(sm, self.splits_prev[lvl], lvl) for lvl in range(self.num_levels)]
+
+        # the deepest previous split decides how far ahead or behind the run is
+        for split, stat in zip(self.splits_prev, self.stats_prev):
+            if split is not None or split is self.splits_prev[0]:
+                self.mark = stat
+                self.mark_split = split
+
+    def fields(self):
+        """
+        The display as a flat mapping of field name to text
+        """
+        result = {
+            'route': self.route_name,
+            'timer': fmt_time_ex(self.current_time, True),
+            'pb_diff': fmt_time_ex(self.mark['pb_diff'], self.mark_split, sign=True),
+            'comparison': self.comparison,
+            'pb': fmt_time_ex(self.pb_time, True),
+            'sum_of_best': fmt_time_ex(self.sum_of_best, True),
+            'possible_timesave': fmt_time_ex(self.possible_timesave, True),
+        }
+        for lvl in range(self.num_levels):
+            split = self.splits_cur[lvl]
+            stat = self.stats_cur[lvl]
+            result['level%d_split' % lvl] = '' if split is None else split.level_name(lvl)
+            result['level%d_time' % lvl] = fmt_time_ex(stat['atime'], split)
+            result['level%d_pb' % lvl] = fmt_time_ex(stat['ptime'], split)
+            result['level%d_can_save' % lvl] = fmt_time_ex(stat['possible_timesave'], split)
+            split = self.splits_prev[lvl]
+            stat = self.stats_prev[lvl]
+            result['prev%d_split' % lvl] = '' if split is None else split.level_name(lvl)
+            result['prev%d_delta' % lvl] = fmt_time_ex(stat['pb_delta'], split, sign=True)
+            result['prev%d_could_save' % lvl] = fmt_time_ex(stat['possible_timesave'], split)
+            result['prev%d_gold' % lvl] = 'gold' if stat['gold'] else ''
+        return result
+
+    def to_dict(self):
+        def level(split, stat, lvl):
+            return dict(stat, split=None if split is None else split.level_name(lvl))
+        return {
+            'route': self.route_name,
+            'level_names': list(self.level_names),
+            'current_time': self.current_time,
+            'started': self.started,
+            'done': self.done,
+            'pb': self.pb_time,
+            'sum_of_best': self.sum_of_best,
+            'possible_timesave': self.possible_timesave,
+            'pb_diff': self.mark['pb_diff'],
+            'comparison': self.comparison,
+            'current': [level(split, stat, lvl) for lvl, (split, stat) in enumerate(zip(self.splits_cur, self.stats_cur))],
+            'previous': [level(split, stat, lvl) for lvl, (split, stat) in enumerate(zip(self.splits_prev, self.stats_prev))],
+        }
+
+def build_view(sm):
+    """
+    The ViewModel for the manager's current frame, built at most once per frame
+    """
+    cache = sm.render_cache('view')
+    view = cache.get('view')
+    if view is None or view.generation != sm.generation:
+        view = cache['view'] = ViewModel(sm)
+    return view
+
+class TerminalSink:
+    def __init__(self, formatter):
+        self.formatter = formatter
+
+    def __call__(self, sm):
+        from .full_splits import print_splits # pylint: disable=import-outside-toplevel
+        return print_splits(sm, self.formatter)
+
+class FileSink:
+    """
+    Writes each field to <directory>/<field>.txt. A file is only rewritten when its text changes, and is replaced
+    atomically so a reader never sees it half-written.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.last = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, sm):
+        written = 0
+        for name, text in build_view(sm).fields().items():
+            if self.last.get(name) == text:
+                continue
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.' + name)
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(text)
+            os.replace(tmp, os.path.join(self.directory, name + '.txt'))
+            self.last[name] = text
+            written += len(text)
+        return written
+
+class JsonSink:
+    """
+    Serves the view model as one line of JSON per change to any client connected to the port
+    """
+    def __init__(self, port, host='127.0.0.1'):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.server.setblocking(False)
+        self.clients = []
+        self.last = None
+
+    def __call__(self, sm):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except BlockingIOError:
+                break
+            client.setblocking(False)
+            self.clients.append(client)
+            self.last = None  # make sure the new client gets the current state
+
+        if not self.clients:
+            return 0
+        data = (json.dumps(build_view(sm).to_dict()) + '\n').encode()
+        if data == self.last:
+            return 0
+        self.last = data
+        for client in list(self.clients):
+            try:
+                client.sendall(data)
+            except OSError:
+                # gone, or too far behind to keep up with
+                client.close()
+                self.clients.remove(client)
+        return len(data)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.server.close()
+
+def fanout(*sinks):
+    """
+    Combine several sinks into one renderer
+    """
+    def render(sm):
+        return sum(sink(sm) or 0 for sink in sinks)
+    return render
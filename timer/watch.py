@@ -0,0 +1,138 @@
+"""
+Watch a single file for being created, replaced or deleted.
+
+Uses inotify on the file's parent directory where available (via ctypes, so there are no extra dependencies) and
+falls back to polling os.stat otherwise.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_event_header = struct.Struct('iIII')
+
+def _load_inotify():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError(errno.ENOSYS, 'inotify is not available')
+    return libc
+
+def file_identity(path):
+    """
+    (device, inode) of the path, or None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+class FileWatcher:
+    def __init__(self, path, poll_interval=0.5):
+        self.path = path
+        self.dirname = os.path.dirname(os.path.abspath(path))
+        self.basename = os.fsencode(os.path.basename(path))
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.identity = file_identity(path)
+        self.next_poll = 0
+
+        try:
+            libc = _load_inotify()
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+            mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+            if libc.inotify_add_watch(fd, os.fsencode(self.dirname), mask) < 0:
+                err = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(err, 'inotify_add_watch failed')
+            self.fd = fd
+        except (OSError, AttributeError, TypeError):
+            self.fd = None
+
+    @property
+    def polling(self):
+        return self.fd is None
+
+    def _drain(self):
+        """
+        Read all pending inotify events, returning whether any of them concern our file
+        """
+        relevant = False
+        while True:
+            try:
+                buf = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(buf):
+                _, mask, _, namelen = _event_header.unpack_from(buf, offset)
+                name = buf[offset + _event_header.size:offset + _event_header.size + namelen].rstrip(b'\0')
+                offset += _event_header.size + namelen
+                if name == self.basename or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    relevant = True
+
+    def _poll(self):
+        identity = file_identity(self.path)
+        changed = identity != self.identity
+        self.identity = identity
+        return changed
+
+    def changed(self):
+        """
+        Non-blocking check for whether the file has been created, replaced or deleted since the last call
+        """
+        if self.fd is not None:
+            if not self._drain():
+                return False
+            self.identity = file_identity(self.path)
+            return True
+
+        now = time.monotonic()
+        if now < self.next_poll:
+            return False
+        self.next_poll = now + self.poll_interval
+        return self._poll()
+
+    def wait(self, timeout=None):
+        """
+        Block until the file is created, replaced or deleted, or until the timeout expires. Returns whether it changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if self.fd is not None:
+                readable, _, _ = select.select([self.fd], [], [], remaining)
+                if readable and self.changed():
+                    return True
+            else:
+                time.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+                self.next_poll = 0
+                if self.changed():
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def wait_exists(self):
+        while file_identity(self.path) is None:
+            self.wait(1)
+        self.identity = file_identity(self.path)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -1,5 +1,7 @@
+#define _GNU_SOURCE
 #include <stdio.h>
 #include <stdlib.h>
+#include <stddef.h>
 #include <stdint.h>
 #include <stdbool.h>
 #include <getopt.h>
@@ -10,7 +12,9 @@
 #include <libgen.h>
 #include <dirent.h>
 #include <setjmp.h>
+#include <errno.h>
 #include <sys/fcntl.h>
+#include <sys/uio.h>
 #include <sys/types.h>
 #include <sys/ptrace.h>
 #include <sys/wait.h>
@@ -23,6 +27,7 @@
 
 jmp_buf safety;
 bool safety_enabled = false;
+int target_pid = 0; // for process_vm_readv; 0 if we can only use the mem file
 
 int trace_celeste(const char *celeste_path) {
     int pid = fork();
@@ -75,24 +80,55 @@ int load_mem(int pid) {
         exit(1);
     }
 
+    target_pid = pid;
     return fd;
 }
 
 void read_mem(int fd, uint64_t addr, void *buf, size_t len) {
-    if (lseek(fd, addr, SEEK_SET) == -1) {
-        perror("lseek");
+    if (pread(fd, buf, len, addr) != (ssize_t)len) {
+        perror("read");
         if (safety_enabled) {
             longjmp(safety, 0);
         }
         exit(1);
     }
+}
 
-    if (read(fd, buf, len) != (ssize_t)len) {
-        perror("read");
-        if (safety_enabled) {
-            longjmp(safety, 0);
+typedef struct _ReadRequest {
+    uint64_t addr;
+    void *buf;
+    size_t len;
+} ReadRequest;
+
+#define MAX_BATCH 8
+
+// Do several independent reads, in one syscall if process_vm_readv is permitted
+void read_batch(int fd, ReadRequest *reqs, int n) {
+    if (n == 0) {
+        return;
+    }
+    if (target_pid != 0) {
+        struct iovec local[MAX_BATCH], remote[MAX_BATCH];
+        ssize_t total = 0;
+        for (int i = 0; i < n; i++) {
+            local[i].iov_base = reqs[i].buf;
+            local[i].iov_len = reqs[i].len;
+            remote[i].iov_base = (void*)reqs[i].addr;
+            remote[i].iov_len = reqs[i].len;
+            total += reqs[i].len;
+        }
+        ssize_t got = process_vm_readv(target_pid, local, n, remote, n, 0);
+        if (got == total) {
+            return;
+        }
+        if (got < 0 && (errno == ENOSYS || errno == EPERM)) {
+            DBGPRINT("process_vm_readv unavailable, using the mem file\n");
+            target_pid = 0;
         }
-        exit(1);
+    }
+    // one at a time, so a bad address gets the usual error handling
+    for (int i = 0; i < n; i++) {
+        read_mem(fd, reqs[i].addr, reqs[i].buf, reqs[i].len);
     }
 }
 
@@ -157,7 +193,33 @@ uint64_t lookup_class(int memfd, char *name) {
     exit(1);
 }
 
-uint64_t class_static_fields(int memfd, uint64_t klass) {
+// Metadata lookups below walk mono's structures with many reads, so their results are cached per class. The caches
+// are emptied whenever the dump loop reconnects.
+typedef struct _FieldCacheEntry {
+    uint64_t klass;
+    const char *name;
+    uint32_t offset;
+} FieldCacheEntry;
+
+#define FIELD_CACHE_SIZE 64
+FieldCacheEntry field_cache[FIELD_CACHE_SIZE];
+int field_cache_len = 0;
+
+typedef struct _StaticCacheEntry {
+    uint64_t klass;
+    uint64_t static_data;
+} StaticCacheEntry;
+
+#define STATIC_CACHE_SIZE 16
+StaticCacheEntry static_cache[STATIC_CACHE_SIZE];
+int static_cache_len = 0;
+
+void clear_metadata_caches() {
+    field_cache_len = 0;
+    static_cache_len = 0;
+}
+
+uint64_t lookup_class_static_fields(int memfd, uint64_t klass) {
     uint32_t vtable_size = read_dword(memfd, klass + 0x54);
     uint64_t runtime_info = read_qword(memfd, klass + 0xc8);
     // hack: assume the class is only valid in one domain
@@ -175,6 +237,21 @@ uint64_t class_static_fields(int memfd, uint64_t klass) {
     exit(1);
 }
 
+uint64_t class_static_fields(int memfd, uint64_t klass) {
+    for (int i = 0; i < static_cache_len; i++) {
+        if (static_cache[i].klass == klass) {
+            return static_cache[i].static_data;
+        }
+    }
+    uint64_t static_data = lookup_class_static_fields(memfd, klass);
+    if (static_cache_len < STATIC_CACHE_SIZE) {
+        static_cache[static_cache_len].klass = klass;
+        static_cache[static_cache_len].static_data = static_data;
+        static_cache_len++;
+    }
+    return static_data;
+}
+
 uint64_t instance_class(int memfd, uint64_t instance) {
     return read_qword(memfd, read_qword(memfd, instance) & ~1);
 }
@@ -199,8 +276,9 @@ MonoTypeKind class_kind(int memfd, uint64_t klass) {
     return (MonoTypeKind)read_byte(memfd, klass + 0x24) & 7;
 }
 
-// For getters with implicit storage it's <Name>k__BackingField WITH the braces
-uint32_t class_field_offset(int memfd, uint64_t klass, char *name) {
+uint32_t class_field_offset(int memfd, uint64_t klass, char *name);
+
+uint32_t lookup_class_field_offset(int memfd, uint64_t klass, char *name) {
     MonoTypeKind kind = class_kind(memfd, klass);
     if (kind == MONO_CLASS_GINST) {
         return class_field_offset(memfd, read_qword(memfd, read_qword(memfd, klass + 0xe0)), name);
@@ -229,6 +307,24 @@ uint32_t class_field_offset(int memfd, uint64_t klass, char *name) {
     exit(1);
 }
 
+// For getters with implicit storage it's <Name>k__BackingField WITH the braces
+uint32_t class_field_offset(int memfd, uint64_t klass, char *name) {
+    for (int i = 0; i < field_cache_len; i++) {
+        if (field_cache[i].klass == klass && strcmp(field_cache[i].name, name) == 0) {
+            return field_cache[i].offset;
+        }
+    }
+    uint32_t offset = lookup_class_field_offset(memfd, klass, name);
+    if (field_cache_len < FIELD_CACHE_SIZE) {
+        // names are always string literals, so keeping the pointer is fine
+        field_cache[field_cache_len].klass = klass;
+        field_cache[field_cache_len].name = name;
+        field_cache[field_cache_len].offset = offset;
+        field_cache_len++;
+    }
+    return offset;
+}
+
 uint64_t instance_field_qword(int memfd, uint64_t instance, char *name) {
     uint64_t klass = instance_class(memfd, instance);
     uint32_t field_offset = class_field_offset(memfd, klass, name);
@@ -275,6 +371,36 @@ char *read_boxed_string_chars(int memfd, uint64_t instance) {
     return charres;
 }
 
+uint32_t string_length_offset = 0, string_chars_offset = 0;
+
+#define LEVEL_NAME_SIZE 100
+
+// Like read_boxed_string_chars but into a caller-provided buffer, truncating, with no allocation. The buffer is
+// zero-filled past the end of the string, as strncpy would. At most LEVEL_NAME_SIZE - 1 characters are read.
+void read_boxed_string_into(int memfd, uint64_t instance, char *out, size_t outsize) {
+    if (outsize == 0) {
+        return;
+    }
+    if (string_chars_offset == 0) {
+        uint64_t klass = instance_class(memfd, instance);
+        string_chars_offset = class_field_offset(memfd, klass, "m_firstChar");
+        string_length_offset = class_field_offset(memfd, klass, "m_stringLength");
+    }
+    uint16_t wordres[LEVEL_NAME_SIZE];
+    uint32_t size = read_dword(memfd, instance + string_length_offset);
+    if (size > outsize - 1) {
+        size = outsize - 1;
+    }
+    if (size > LEVEL_NAME_SIZE - 1) {
+        size = LEVEL_NAME_SIZE - 1;
+    }
+    read_mem(memfd, instance + string_chars_offset, wordres, size*2);
+    for (uint32_t i = 0; i < size; i++) {
+        out[i] = wordres[i];
+    }
+    memset(out + size, 0, outsize - size);
+}
+
 uint64_t savedata_class, celeste_class, celeste_instance, engine_class, level_class;
 
 void load_base_info(int memfd) {
@@ -342,9 +468,70 @@ typedef struct _DumpInfo {
     int CurrentLevelCheckpoints;
     bool InCutscene;
     int DeathCount;
-    char LevelName[100];
+    char LevelName[LEVEL_NAME_SIZE];
 } DumpInfo;
 
+// The dump file is a DumpHeader followed by a DumpInfo. seq works as a seqlock: it is odd while the DumpInfo is being
+// rewritten and only moves when the DumpInfo changes, so a reader can tell a torn read or an unchanged frame from the
+// header alone. capture_ns (CLOCK_MONOTONIC) is refreshed every frame, even when nothing changed.
+#define DUMP_MAGIC "CDMP"
+#define DUMP_VERSION 1
+
+typedef struct _DumpHeader {
+    char magic[4];
+    uint32_t version;
+    uint64_t seq;
+    uint64_t capture_ns;
+} DumpHeader;
+
+// outside dump_info_loop so they survive its longjmps
+DumpHeader dump_header;
+DumpInfo last_dump;
+bool dumped = false;
+
+// pwrite all of buf, reporting a failed or short write
+bool write_at(int fd, const void *buf, size_t len, off_t offset, const char *what) {
+    ssize_t written = pwrite(fd, buf, len, offset);
+    if (written == (ssize_t)len) {
+        return true;
+    }
+    if (written < 0) {
+        perror(what);
+    } else {
+        fprintf(stderr, "%s: short write (%zd of %zu bytes)\n", what, written, len);
+    }
+    return false;
+}
+
+void write_dump(int dumpfd, DumpInfo *info) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    dump_header.capture_ns = (uint64_t)now.tv_sec * 1000000000 + now.tv_nsec;
+
+    if (dumped && memcmp(info, &last_dump, sizeof(DumpInfo)) == 0) {
+        write_at(dumpfd, &dump_header.capture_ns, sizeof(dump_header.capture_ns), offsetof(DumpHeader, capture_ns),
+                 "write info dump timestamp");
+        return;
+    }
+    // seq is still odd if the last rewrite failed partway, in which case the file says so already
+    if ((dump_header.seq & 1) == 0) {
+        dump_header.seq++;
+    }
+    // on failure the frame is written again in full next time, since last_dump isn't updated
+    dumped = false;
+    if (!write_at(dumpfd, &dump_header, sizeof(DumpHeader), 0, "write info dump header")
+            || !write_at(dumpfd, info, sizeof(DumpInfo), sizeof(DumpHeader), "write info dump")) {
+        return;
+    }
+    dump_header.seq++;
+    if (!write_at(dumpfd, &dump_header, sizeof(DumpHeader), 0, "write info dump header")) {
+        dump_header.seq--;
+        return;
+    }
+    memcpy(&last_dump, info, sizeof(DumpInfo));
+    dumped = true;
+}
+
 void *dump_info_loop(void *v) {
     struct marshall *m = (struct marshall *)v;
     int memfd = m->memfd;
@@ -355,11 +542,23 @@ void *dump_info_loop(void *v) {
         perror("open info dump file");
         exit(1);
     }
+    // carry on from the sequence number already in the file, so a reader can't mistake our first frame for its last
+    if (pread(dumpfd, &dump_header, sizeof(DumpHeader), 0) != sizeof(DumpHeader)
+            || memcmp(dump_header.magic, DUMP_MAGIC, 4) != 0) {
+        dump_header.seq = 0;
+    }
+    memcpy(dump_header.magic, DUMP_MAGIC, 4);
+    dump_header.version = DUMP_VERSION;
+    dump_header.seq += dump_header.seq & 1;
 
     setjmp(safety);
     safety_enabled = false;
     sleep(2);
 
+    // whatever we cached may be what just failed, so look everything up again
+    clear_metadata_caches();
+    string_chars_offset = 0;
+
     load_base_info(memfd);
     uint64_t info_addr = locate_autosplitter_info(memfd);
     DBGPRINT("ASI @ %p\n", info_addr);
@@ -370,8 +569,20 @@ void *dump_info_loop(void *v) {
     memset(&info_buf, 0, sizeof(DumpInfo));
     uint64_t areas_obj;
     uint64_t last_savedata_addr = 0;
-    uint64_t last_level = 0;
-    uint64_t last_scene = 0;
+
+    // Offsets are looked up once here, or when the object they belong to changes, so each frame only reads values.
+    // The static field can only be found once the savedata class has been initialized.
+    uint32_t scene_offset = class_field_offset(memfd, engine_class, "scene");
+    uint32_t in_cutscene_offset = class_field_offset(memfd, level_class, "InCutscene");
+    uint64_t savedata_instance_addr = 0;
+    uint32_t total_deaths_offset = 0;
+    uint32_t checkpoints_offset = 0;
+    uint32_t count_offset = 0;
+    // the vtables of the last scene which was and wasn't a Level, to tell scenes apart without reading their class
+    uint64_t level_vtable = 0;
+    uint64_t other_vtable = 0;
+    ReadRequest batch[MAX_BATCH];
+    int n;
     while (1) {
         safety_enabled = false;
         struct timespec millisecond = {0, 1000000};
@@ -382,28 +593,36 @@ void *dump_info_loop(void *v) {
 
         // Extract ASI.Level
         if (info_buf.asi.Level != 0) {
-            char *lvlname = read_boxed_string_chars(memfd, info_buf.asi.Level);
-            strncpy(info_buf.LevelName, lvlname, sizeof(info_buf.LevelName));
-            free(lvlname);
+            read_boxed_string_into(memfd, info_buf.asi.Level, info_buf.LevelName, sizeof(info_buf.LevelName));
         } else {
-            strncpy(info_buf.LevelName, "", sizeof(info_buf.LevelName));
+            memset(info_buf.LevelName, 0, sizeof(info_buf.LevelName));
         }
 
         safety_enabled = true;
 
-        savedata_addr = static_field_qword(memfd, savedata_class, "Instance");
+        if (savedata_instance_addr == 0) {
+            savedata_instance_addr = class_static_fields(memfd, savedata_class)
+                                   + class_field_offset(memfd, savedata_class, "Instance");
+        }
+        bool need_scene = info_buf.asi.Chapter != -1 && info_buf.asi.ChapterStarted && !info_buf.asi.ChapterComplete;
+        uint64_t scene = 0;
+        n = 0;
+        batch[n++] = (ReadRequest){savedata_instance_addr, &savedata_addr, sizeof(savedata_addr)};
+        if (need_scene) {
+            batch[n++] = (ReadRequest){celeste_instance + scene_offset, &scene, sizeof(scene)};
+        }
+        read_batch(memfd, batch, n);
         DBGPRINT("savedata_addr = %p\n", (void*)savedata_addr);
-        if (savedata_addr != 0) {
-            if (savedata_addr != last_savedata_addr) {
-                sleep(1);
-                last_savedata_addr = savedata_addr;
-                mode_stats = 0;
-                continue;
-            }
-            // extract death count
-            info_buf.DeathCount = instance_field_dword(memfd, savedata_addr, "TotalDeaths");
 
-            // Extract checkpoint count
+        if (savedata_addr != 0 && savedata_addr != last_savedata_addr) {
+            sleep(1);
+            last_savedata_addr = savedata_addr;
+            mode_stats = 0;
+            total_deaths_offset = class_field_offset(memfd, instance_class(memfd, savedata_addr), "TotalDeaths");
+            continue;
+        }
+
+        if (savedata_addr != 0) {
             if (info_buf.asi.Chapter == -1) {
                 mode_stats = 0;
             } else if (mode_stats == 0) {
@@ -424,38 +643,72 @@ void *dump_info_loop(void *v) {
                     uint64_t mode_arr = instance_field_qword(memfd, area_stats, "Modes") + 0x20;
                     DBGPRINT("mode_arr = %p\n", (void*)mode_arr);
                     mode_stats = read_qword(memfd, mode_arr + info_buf.asi.Mode*8);
+                    if (mode_stats != 0) {
+                        checkpoints_offset = class_field_offset(memfd, instance_class(memfd, mode_stats), "Checkpoints");
+                    }
                 }
             }
             DBGPRINT("mode_stats = %p\n", (void*)mode_stats);
+        }
 
+        // Second round: things hanging off the savedata and the scene
+        uint64_t checkpoints_obj = 0;
+        uint64_t scene_vtable = 0;
+        n = 0;
+        if (savedata_addr != 0) {
+            // extract death count
+            batch[n++] = (ReadRequest){savedata_addr + total_deaths_offset, &info_buf.DeathCount, sizeof(info_buf.DeathCount)};
             if (mode_stats != 0) {
-                uint64_t checkpoints_obj = instance_field_qword(memfd, mode_stats, "Checkpoints");
-                DBGPRINT("checkpoints_obj = %p\n", (void*)checkpoints_obj);
-                info_buf.CurrentLevelCheckpoints = instance_field_dword(memfd, checkpoints_obj, "_count");
-                DBGPRINT("CurrentLevelCheckpoints = %d\n", info_buf.CurrentLevelCheckpoints);
-            } else {
-                info_buf.CurrentLevelCheckpoints = 0;
+                batch[n++] = (ReadRequest){mode_stats + checkpoints_offset, &checkpoints_obj, sizeof(checkpoints_obj)};
             }
         }
-
-        // Extract in-cutscene
-        if (info_buf.asi.Chapter != -1) {
-            if (!info_buf.asi.ChapterStarted || info_buf.asi.ChapterComplete) {
-                info_buf.InCutscene = true;
-            } else {
-                uint64_t scene = read_qword(memfd, celeste_instance + class_field_offset(memfd, engine_class, "scene"));
-                if (instance_class(memfd, scene) != level_class) {
-                    info_buf.InCutscene = false;
+        if (scene != 0) {
+            batch[n++] = (ReadRequest){scene, &scene_vtable, sizeof(scene_vtable)};
+        }
+        read_batch(memfd, batch, n);
+        scene_vtable &= ~1;
+
+        bool is_level = false;
+        if (scene != 0) {
+            if (scene_vtable == level_vtable) {
+                is_level = true;
+            } else if (scene_vtable != other_vtable) {
+                is_level = read_qword(memfd, scene_vtable) == level_class;
+                if (is_level) {
+                    level_vtable = scene_vtable;
                 } else {
-                    info_buf.InCutscene = read_byte(memfd, scene + class_field_offset(memfd, level_class, "InCutscene"));
+                    other_vtable = scene_vtable;
                 }
             }
+        }
+        if (checkpoints_obj != 0 && count_offset == 0) {
+            count_offset = class_field_offset(memfd, instance_class(memfd, checkpoints_obj), "_count");
+        }
+
+        // Third round: the checkpoint count and the cutscene flag
+        uint8_t in_cutscene = 0;
+        n = 0;
+        if (checkpoints_obj != 0) {
+            DBGPRINT("checkpoints_obj = %p\n", (void*)checkpoints_obj);
+            batch[n++] = (ReadRequest){checkpoints_obj + count_offset, &info_buf.CurrentLevelCheckpoints,
+                                       sizeof(info_buf.CurrentLevelCheckpoints)};
+        } else if (savedata_addr != 0) {
+            info_buf.CurrentLevelCheckpoints = 0;
+        }
+        if (is_level) {
+            batch[n++] = (ReadRequest){scene + in_cutscene_offset, &in_cutscene, sizeof(in_cutscene)};
+        }
+        read_batch(memfd, batch, n);
+        DBGPRINT("CurrentLevelCheckpoints = %d\n", info_buf.CurrentLevelCheckpoints);
+
+        // Extract in-cutscene
+        if (info_buf.asi.Chapter != -1) {
+            info_buf.InCutscene = need_scene ? in_cutscene : true;
         } else {
             info_buf.InCutscene = false;
         }
 
-        lseek(dumpfd, 0, SEEK_SET);
-        write(dumpfd, &info_buf, sizeof(DumpInfo));
+        write_dump(dumpfd, &info_buf);
     }
 }
 